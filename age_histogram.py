@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+from count_cube import column_codes, disease_bits, merge_cells, select_cells
+from data_loader import DISEASE_COLUMNS, MISSING_CODE
+
+# Bands are closed on the left: edges [0, 10, 20] give "0-9", "10-19" and the
+# overflow band "20+" for everyone older; a first edge above 0 adds "<edge"
+DECADES = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
+AGE_SCHEMES = {
+    "Decades": DECADES,
+    "5-year bands": list(range(0, 101, 5)),
+    "Clinical bands": [0, 1, 5, 18, 40, 65, 80],
+}
+
+KEYS = ["SEX", "NATIONALITY", "DISEASES", "AGE"]
+
+
+def whole_ages(age):
+    # Completed years, MISSING_CODE where the age is unknown or negative
+    age = np.asarray(age, dtype=float)
+    known = age >= 0
+    return np.where(known, np.floor(np.where(known, age, 0)), MISSING_CODE).astype(np.int64)
+
+
+def parse_edges(text):
+    # "0, 18, 65" -> [0, 18, 65]; whole years, increasing
+    edges = [int(part) for part in text.replace(";", ",").split(",") if part.strip()]
+    if not edges or edges[0] < 0 or any(high <= low for low, high in zip(edges, edges[1:])):
+        raise ValueError("age edges must be increasing whole years from 0 up")
+    return edges
+
+
+def band_labels(edges):
+    labels = [f"<{edges[0]}"] if edges[0] > 0 else []
+    labels += [f"{low}-{high - 1}" if high - 1 > low else str(low) for low, high in zip(edges, edges[1:])]
+    return labels + [f"{edges[-1]}+"]
+
+
+def age_bands(age, edges):
+    # Index into band_labels(edges) per patient, MISSING_CODE where the age is unknown
+    ages = whole_ages(age)
+    bands = np.searchsorted(edges, ages, side="right") - (1 if edges[0] == 0 else 0)
+    return np.where(ages >= 0, bands, MISSING_CODE)
+
+
+def bin_counts(cumulative, edges):
+    # Patients per band from prefix sums, one lookup per edge
+    younger = cumulative[np.minimum(edges, len(cumulative) - 1)]
+    bounds = np.concatenate([[0] if edges[0] > 0 else [], younger, cumulative[-1:]])
+    labels = band_labels(edges)
+    index = pd.CategoricalIndex(labels, categories=labels, ordered=True, name="Age Group")
+    return pd.Series(np.diff(bounds).astype(np.int64), index=index, name="count")
+
+
+class AgeHistogram:
+    # Patients per year of age for every combination of the sidebar filter
+    # columns. A filter selection collapses to one per-year vector whose
+    # prefix sums answer any band layout
+
+    def __init__(self, df, disease_columns=DISEASE_COLUMNS):
+        self.disease_columns = list(disease_columns)
+        self.cells = self._aggregate(df)
+
+    def _aggregate(self, df):
+        keys = pd.DataFrame({
+            "SEX": column_codes(df, "SEX"),
+            "NATIONALITY": column_codes(df, "NATIONALITY"),
+            "DISEASES": disease_bits(df, self.disease_columns),
+            "AGE": whole_ages(df["AGE"]),
+        })
+        return keys.groupby(KEYS, sort=False).size().rename("COUNT").reset_index()
+
+    def extend(self, df):
+        self.cells = merge_cells(pd.concat([self.cells, self._aggregate(df)], ignore_index=True), KEYS)
+
+    def merge(self, other):
+        self.cells = merge_cells(pd.concat([self.cells, other.cells], ignore_index=True), KEYS)
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + int(self.cells.memory_usage(deep=True).sum())
+
+    def select(self, terms):
+        return select_cells(self.cells, terms, self.disease_columns)
+
+    def cumulative(self, cells):
+        # Entry a counts the known ages below a; the last entry counts them all
+        cells = cells[cells["AGE"].to_numpy() >= 0]
+        per_year = np.bincount(cells["AGE"].to_numpy(), weights=cells["COUNT"].to_numpy(), minlength=1)
+        return np.concatenate([[0], np.cumsum(per_year)]).astype(np.int64)
@@ -0,0 +1,164 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+import data_loader
+from charts import downsample
+from comorbidity import combination_table, top_combinations
+from correlation import CorrelationStats, correlation_features
+from age_histogram import AGE_SCHEMES, AgeHistogram, bin_counts
+from count_cube import CountCube
+from filter_index import FilterIndex, filter_terms
+from synthetic import parse_size, write_dataset
+from timeseries import GRANULARITIES, DailyCounts
+
+# Sidebar selections timed by the filter stages, from no filter to three terms
+FILTERS = [
+    filter_terms(),
+    filter_terms(sex=1),
+    filter_terms(nationality=1, diseases=["DIABETES"]),
+    filter_terms(sex=2, diseases=["HYPERTENSION", "OBESITY"]),
+]
+
+
+def best_time(function, repeat):
+    # Fastest of `repeat` runs, plus the last result
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - started)
+    return min(seconds), result
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _time_series(df):
+    # Build the daily counts and every table the page can ask for
+    daily_counts = DailyCounts(df)
+    for category in daily_counts.categories:
+        for freq in GRANULARITIES.values():
+            daily_counts.table(category, freq, 7)
+    return daily_counts
+
+
+def _figures(daily_counts, cube):
+    figures = []
+    for freq in GRANULARITIES.values():
+        table = downsample(daily_counts.table("PNEUMONIA", freq)).reset_index()
+        figures.append(px.line(table, x="ADMISSION DATE", y=table.columns[1:]))
+    sex = data_loader.decode_counts(cube.counts(cube.cells, "SEX"), "SEX")
+    figures.append(px.pie(values=sex.values, names=sex.index))
+    # Serializing is what every rerun pays to ship the figure to the browser
+    return sum(len(figure.to_json()) for figure in figures)
+
+
+def run(path, repeat=3):
+    # Seconds per stage of what the pages do, each the best of `repeat` runs
+    seconds = {}
+
+    def stage(name, function):
+        seconds[name], result = best_time(function, repeat)
+        return result
+
+    stage("load_csv", lambda: data_loader.open_dataset(path, use_snapshot=False))
+    # What the correlation page parses: its twelve columns, typed by the schema
+    stage(
+        "load_csv_projected",
+        lambda: data_loader.open_dataset(path, use_snapshot=False, columns=correlation_features()),
+    )
+    data_loader.open_dataset(path)
+    df, _ = stage("load_snapshot", lambda: data_loader.open_dataset(path))
+
+    index = stage("filter_index", lambda: FilterIndex(df))
+    stage("filter", lambda: [index.count(index.select(terms)) for terms in FILTERS])
+    stage(
+        "filter_page",
+        lambda: [index.page(df, index.select(terms), 0, 100, sort_by="AGE") for terms in FILTERS],
+    )
+
+    cube = stage("count_cube", lambda: CountCube(df))
+    stage("cube_filter", lambda: [cube.total(cube.select(terms)) for terms in FILTERS])
+    stage(
+        "comorbidity",
+        lambda: [top_combinations(combination_table(cube.select(terms)), 10) for terms in FILTERS],
+    )
+    ages = stage("age_histogram", lambda: AgeHistogram(df))
+    stage(
+        "age_binning",
+        lambda: [
+            bin_counts(ages.cumulative(ages.select(terms)), edges)
+            for terms in FILTERS
+            for edges in AGE_SCHEMES.values()
+        ],
+    )
+
+    correlation = stage("correlation", lambda: CorrelationStats(df))
+    stage("correlation_matrix", lambda: correlation.matrix(correlation.features))
+
+    daily_counts = stage("time_series", lambda: _time_series(df))
+    figure_bytes = stage("figures", lambda: _figures(daily_counts, cube))
+
+    return {
+        "dataset": os.path.abspath(path),
+        "rows": len(df),
+        "bytes": os.path.getsize(path),
+        "commit": _commit(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "workers": data_loader.PARSE_WORKERS,
+        "repeat": repeat,
+        "figure_bytes": figure_bytes,
+        "seconds": seconds,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time each stage the dashboard pages run.")
+    parser.add_argument("path", nargs="?", default=data_loader.DATASET_PATH)
+    parser.add_argument(
+        "--size", help="benchmark synthetic_<size>.csv instead, generating it if missing (e.g. 1m)"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    path = args.path
+    if args.size:
+        path = f"synthetic_{args.size.lower()}.csv"
+        if not os.path.exists(path):
+            write_dataset(path, parse_size(args.size))
+
+    results = run(path, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        for name, seconds in results["seconds"].items():
+            print(f"{name:20} {seconds * 1000:10.1f} ms")
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import instrumentation
+
+# Most points a line trace is drawn with; longer series are downsampled
+MAX_POINTS = 1000
+
+# Finished figures kept per (chart, key); keys include the data version, so
+# a refresh simply stops hitting the old entries
+FIGURE_CACHE_SIZE = 256
+
+_figures = OrderedDict()
+_lock = threading.Lock()
+
+
+def express():
+    # plotly.express takes about half a second to import; it is loaded when
+    # the first figure is built rather than with every page
+    import plotly.express as px
+
+    return px
+
+
+def lttb(values, points):
+    # Largest-Triangle-Three-Buckets: positions of `points` samples of an
+    # evenly spaced series that keep its visual shape. The first and last
+    # samples are always kept; each bucket in between keeps the sample forming
+    # the largest triangle with the previous pick and the next bucket's mean
+    n = len(values)
+    if points >= n or points < 3:
+        return np.arange(n)
+    y = np.asarray(values, dtype=float)
+    x = np.arange(n, dtype=float)
+    edges = np.append((np.arange(points - 1) * (n - 2) / (points - 2)).astype(np.int64) + 1, n)
+    keep = np.empty(points, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    picked = 0
+    for i in range(points - 2):
+        start, end, after = edges[i], edges[i + 1], edges[i + 2]
+        mean_x, mean_y = x[end:after].mean(), y[end:after].mean()
+        area = np.abs(
+            (x[picked] - mean_x) * (y[start:end] - y[picked])
+            - (x[picked] - x[start:end]) * (mean_y - y[picked])
+        )
+        picked = start + int(np.nanargmax(area)) if not np.isnan(area).all() else start
+        keep[i + 1] = picked
+    return keep
+
+
+def downsample(table, points=MAX_POINTS):
+    # Rows of `table` kept when each column is reduced with LTTB; the columns
+    # share the budget and keep the union of their picks
+    if len(table) <= points or not len(table.columns):
+        return table
+    per_column = max(points // len(table.columns), 3)
+    keep = np.unique(np.concatenate([lttb(table[column].to_numpy(), per_column) for column in table.columns]))
+    return table.iloc[keep]
+
+
+def cached_figure(chart, key, build):
+    # build() runs only when no figure is cached for (chart, key)
+    key = (chart, key)
+    with _lock:
+        if key in _figures:
+            _figures.move_to_end(key)
+            instrumentation.cache_event("figure", hit=True)
+            return _figures[key]
+    instrumentation.cache_event("figure", hit=False)
+    figure = build()
+    with _lock:
+        _figures[key] = figure
+        while len(_figures) > FIGURE_CACHE_SIZE:
+            _figures.popitem(last=False)
+    return figure
@@ -0,0 +1,51 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from data_loader import DISEASE_COLUMNS
+
+COMBINATION_SIZES = [2, 3]
+RANKINGS = {"Deaths": "DEATHS", "Cases": "CASES", "Case-fatality rate": "CASE_FATALITY"}
+
+
+def superset_counts(masks, weights, width):
+    # Entry m counts the weight of every mask containing all the bits of m:
+    # a bincount over the 2**width masks, then one vectorized pass per bit
+    # adds each mask's total into the mask without that bit
+    totals = np.bincount(masks, weights=weights, minlength=1 << width).astype(float)
+    index = np.arange(1 << width)
+    for bit in range(width):
+        lower = index[(index >> bit) & 1 == 0]
+        totals[lower] += totals[lower | (1 << bit)]
+    return totals
+
+
+def combination_table(cells, disease_columns=DISEASE_COLUMNS, sizes=COMBINATION_SIZES):
+    # Patients and deaths with every combination of `sizes` diseases (and
+    # possibly others) among count cube cells, from their packed disease bits
+    width = len(disease_columns)
+    masks = cells["DISEASES"].to_numpy().astype(np.int64)
+    counts = cells["COUNT"].to_numpy()
+    deceased = cells["DECEASED"].to_numpy()
+    cases = superset_counts(masks, counts, width)
+    deaths = superset_counts(masks[deceased], counts[deceased], width)
+
+    combinations = [combination for size in sizes for combination in itertools.combinations(range(width), size)]
+    positions = np.array([sum(1 << i for i in combination) for combination in combinations], dtype=np.int64)
+    table = pd.DataFrame({
+        "COMBINATION": [" + ".join(disease_columns[i] for i in combination) for combination in combinations],
+        "DISEASES": [len(combination) for combination in combinations],
+        "CASES": np.rint(cases[positions]).astype(np.int64),
+        "DEATHS": np.rint(deaths[positions]).astype(np.int64),
+    })
+    with np.errstate(divide="ignore", invalid="ignore"):
+        table["CASE_FATALITY"] = table["DEATHS"] / table["CASES"].where(table["CASES"] > 0)
+    return table
+
+
+def top_combinations(table, k=10, by="DEATHS", min_cases=1):
+    # The k combinations ranked by `by`, ties broken by more cases; rates of
+    # combinations with fewer than `min_cases` patients are too noisy to rank
+    table = table[table["CASES"] >= min_cases]
+    return table.sort_values([by, "CASES"], ascending=False, kind="stable").head(k).reset_index(drop=True)
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+from data_loader import DISEASE_COLUMNS, NO, YES
+
+# Rows turned into indicator matrices at a time; bounds the temporary memory
+BLOCK_ROWS = 1 << 20
+
+
+def correlation_features(disease_columns=DISEASE_COLUMNS):
+    return list(disease_columns) + ["ICU"]
+
+
+def _pearson(n, sx, sy, sxy):
+    # Pearson (phi) correlation of 0/1 features from pairwise-complete sums;
+    # for 0/1 values Σx² = Σx, so no extra squares are needed. The products
+    # pass 2**63 at a few hundred thousand rows, so they are taken in float64
+    n, sx, sy, sxy = (np.asarray(value, dtype=np.float64) for value in (n, sx, sy, sxy))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (n * sxy - sx * sy) / np.sqrt((n * sx - sx * sx) * (n * sy - sy * sy))
+
+
+class CorrelationStats:
+    # Pairwise-complete sums (n, Σx, Σy, Σxy) for every pair of YES/NO
+    # features; rows answering anything but YES or NO are left out of a pair,
+    # like DataFrame.corr() does with NaN
+
+    def __init__(self, df, disease_columns=DISEASE_COLUMNS):
+        self.features = correlation_features(disease_columns)
+        k = len(self.features)
+        self.n = np.zeros((k, k), dtype=np.int64)
+        self.sx = np.zeros((k, k), dtype=np.int64)
+        self.sxy = np.zeros((k, k), dtype=np.int64)
+        self.extend(df)
+
+    def extend(self, df):
+        # The int8 code columns are the compact YES/NO/missing matrix. Each
+        # block of rows becomes 0/1 float matrices whose Gram products give all
+        # k² pair sums at once:
+        #   n = VᵀV, Σx = XᵀV, Σxy = XᵀX   (X: YES flags, V: YES-or-NO flags)
+        # The sums are added into copies, which Dataset.refresh() relies on
+        missing = np.zeros(len(df), dtype=np.int8)
+        columns = [df[f].to_numpy() if f in df.columns else missing for f in self.features]
+        n, sx, sxy = self.n.copy(), self.sx.copy(), self.sxy.copy()
+        for start in range(0, len(df), BLOCK_ROWS):
+            block = np.column_stack([column[start : start + BLOCK_ROWS] for column in columns])
+            flags = (block == YES).astype(np.float64)
+            valid = flags + (block == NO)
+            # Block sums stay far below 2**53, so the float products are exact
+            n += np.rint(valid.T @ valid).astype(np.int64)
+            sx += np.rint(flags.T @ valid).astype(np.int64)
+            sxy += np.rint(flags.T @ flags).astype(np.int64)
+        self.n, self.sx, self.sxy = n, sx, sxy
+        self._correlation = _pearson(n, sx, sx.T, sxy)
+
+    def matrix(self, features):
+        # Correlation of any subset is a k² lookup; no rows are touched
+        positions = [self.features.index(feature) for feature in features]
+        return pd.DataFrame(
+            self._correlation[np.ix_(positions, positions)], index=features, columns=features
+        )
+
+    def pair_counts(self, features):
+        # Patients answering YES or NO to both features of each pair
+        positions = [self.features.index(feature) for feature in features]
+        return pd.DataFrame(self.n[np.ix_(positions, positions)], index=features, columns=features)
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+from data_loader import DISEASE_COLUMNS, MISSING_CODE, YES
+
+# Ages live in their own per-year histogram (age_histogram.py)
+CODE_DIMENSIONS = ["SEX", "NATIONALITY", "OUTCOME", "ICU", "INTUBATED"]
+DIMENSIONS = CODE_DIMENSIONS + ["DECEASED", "DISEASES"]
+
+
+def disease_bits(df, disease_columns=DISEASE_COLUMNS):
+    # One bit per disease answered YES, in disease_columns order
+    bits = np.zeros(len(df), dtype=np.int16)
+    for i, disease in enumerate(disease_columns):
+        if disease in df.columns:
+            bits |= (df[disease].to_numpy() == YES).astype(np.int16) << i
+    return bits
+
+
+def column_codes(df, column):
+    if column in df.columns:
+        return df[column].to_numpy()
+    return np.full(len(df), MISSING_CODE, dtype=np.int8)
+
+
+def cube_keys(df, disease_columns=DISEASE_COLUMNS):
+    keys = {column: column_codes(df, column) for column in CODE_DIMENSIONS}
+    keys["DECEASED"] = df["DATE_OF_DEATH"].notna().to_numpy()
+    keys["DISEASES"] = disease_bits(df, disease_columns)
+    return pd.DataFrame(keys)
+
+
+def merge_cells(cells, dimensions=DIMENSIONS):
+    return cells.groupby(dimensions, sort=False)["COUNT"].sum().reset_index()
+
+
+def select_cells(cells, terms, disease_columns=DISEASE_COLUMNS):
+    # Cells matching every (column, code) filter term; disease terms test their bit
+    mask = np.ones(len(cells), dtype=bool)
+    for column, code in terms:
+        if column in disease_columns:
+            bit = 1 << disease_columns.index(column)
+            mask &= (cells["DISEASES"].to_numpy() & bit) != 0
+        else:
+            mask &= cells[column].to_numpy() == code
+    return cells[mask]
+
+
+class CountCube:
+    def __init__(self, df, disease_columns=DISEASE_COLUMNS):
+        self.disease_columns = list(disease_columns)
+        self.cells = self._aggregate(df)
+
+    def _aggregate(self, df):
+        return cube_keys(df, self.disease_columns).groupby(DIMENSIONS, sort=False).size().rename("COUNT").reset_index()
+
+    def extend(self, df):
+        # Fold newly ingested rows in; cost depends on the new rows and the
+        # number of cells, not on the rows already counted
+        self.cells = merge_cells(pd.concat([self.cells, self._aggregate(df)], ignore_index=True))
+
+    def merge(self, other):
+        # Fold in a cube of other rows, e.g. of another admission month
+        self.cells = merge_cells(pd.concat([self.cells, other.cells], ignore_index=True))
+
+    def __sizeof__(self):
+        # For the byte budget of the caches holding cubes
+        return object.__sizeof__(self) + int(self.cells.memory_usage(deep=True).sum())
+
+    def codes(self, column):
+        codes = np.unique(self.cells[column].to_numpy())
+        return [int(code) for code in codes if code != MISSING_CODE]
+
+    def select(self, terms):
+        return select_cells(self.cells, terms, self.disease_columns)
+
+    def total(self, cells):
+        return round(cells["COUNT"].sum())
+
+    def count(self, cells, column, code):
+        return round(cells.loc[cells[column] == code, "COUNT"].sum())
+
+    def counts(self, cells, column):
+        # Equivalent of value_counts() on the filtered rows
+        counts = cells.groupby(column)["COUNT"].sum()
+        return counts[counts > 0].sort_values(ascending=False)
+
+    def disease_counts(self, cells, deceased=None):
+        if deceased is not None:
+            cells = cells[cells["DECEASED"] == deceased]
+        diseases = cells["DISEASES"].to_numpy()
+        counts = cells["COUNT"].to_numpy()
+        return {
+            disease: round(counts[(diseases & (1 << i)) != 0].sum())
+            for i, disease in enumerate(self.disease_columns)
+        }
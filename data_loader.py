@@ -1,30 +1,791 @@
+import argparse
+import contextlib
+import functools
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
-import streamlit as st
+from pandas.api.types import union_categoricals
 
-@st.cache_data
-def load_data():
-    df = pd.read_csv("dataset.csv")
-    df.columns = map(str.upper, df.columns)
+try:
+    import fcntl
+except ImportError:  # Windows: snapshot writers are not coordinated across processes
+    fcntl = None
+
+DATASET_PATH = "dataset.csv"
+DATA_DICTIONARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_dictionary.xlsx")
+
+# Admission dates are ISO days; a fixed format skips pandas' per-value inference
+DATE_FORMAT = "%Y-%m-%d"
+
+# Bump whenever the decoded layout changes so old snapshots get rebuilt
+SNAPSHOT_VERSION = 4
+SNAPSHOT_SUFFIX = ".snapshot"
+# Snapshots go here instead of beside the CSV when set, e.g. /dev/shm to keep
+# the columns every server process maps in RAM
+SNAPSHOT_DIR = os.environ.get("DATASET_SNAPSHOT_DIR")
+# Seconds an attaching process waits for the loader to publish a snapshot
+ATTACH_TIMEOUT = 600
+_HASH_BLOCK = 1 << 20
+
+# Files at least this large are parsed by PARSE_WORKERS processes at once
+PARSE_WORKERS = int(os.environ.get("DATASET_WORKERS") or os.cpu_count() or 1)
+PARALLEL_MIN_BYTES = 64 << 20
+
+logger = logging.getLogger(__name__)
+
+# Raw survey codes are kept as int8 in memory; labels are only looked up when
+# a chart or table is drawn
+YES = 1
+NO = 2
+MISSING_CODE = -1
 
-    # Convert and map categorical values
-    mapping = {
-        "SEX": {1: "FEMALE", 2: "MALE", 99: "UNKNOWN"},
-        "HOSPITALIZED": {1: "YES", 2: "NO", 97: "DOES NOT APPLY", 98: "IGNORED", 99: "UNKNOWN"},
-        "INTUBATED": {1: "YES", 2: "NO", 97: "DOES NOT APPLY", 98: "IGNORED", 99: "UNKNOWN"},
-        "TOBACCO": {1: "YES", 2: "NO", 97: "DOES NOT APPLY", 98: "IGNORED", 99: "UNKNOWN"},
-        "PNEUMONIA": {1: "YES", 2: "NO", 97: "DOES NOT APPLY", 98: "IGNORED", 99: "UNKNOWN"},
+YES_NO = {1: "YES", 2: "NO", 97: "DOES NOT APPLY", 98: "IGNORED", 99: "UNKNOWN"}
+
+# Labels of the columns the data dictionary does not define, and of every
+# column when it cannot be read
+MAPPING = {
+    "SEX": {1: "FEMALE", 2: "MALE", 99: "UNKNOWN"},
+    "HOSPITALIZED": YES_NO,
+    "INTUBATED": YES_NO,
+    "PREGNANCY": YES_NO,
+    "SPEAKS_NATIVE_LANGUAGE": YES_NO,
+    "ANOTHER CASE": YES_NO,
+    "MIGRANT": YES_NO,
+    "ICU": YES_NO,
+    "OUTCOME": {1: "POSITIVE", 2: "NEGATIVE", 97: "PENDING"},
+    "NATIONALITY": {1: "MEXICAN", 2: "FOREIGN", 97: "UNKNOWN"},
+}
+
+DISEASE_COLUMNS = [
+    "DIABETES",
+    "COPD",
+    "ASTHMA",
+    "INMUSUPR",
+    "HYPERTENSION",
+    "PNEUMONIA",
+    "CARDIOVASCULAR",
+    "OBESITY",
+    "CHRONIC_KIDNEY",
+    "TOBACCO",
+    "OTHER_DISEASE",
+]
+
+for _disease in DISEASE_COLUMNS:
+    MAPPING.setdefault(_disease, YES_NO)
+
+# Types of the columns the data dictionary does not code; the coded ones are
+# int8 codes. "int16" columns stay float32 when a value is missing
+COLUMN_TYPES = {
+    "ORIGIN": "category",
+    "SECTOR": "category",
+    "TREATMENT_LOCATION": "int16",
+    "BIRTHPLACE_LOCATION": "int16",
+    "PATIENT_LOCATION": "int16",
+    "MUNICIPALITY": "int16",
+    "ADMISSION DATE": "date",
+    "DATE_OF_FIRST_SYMPTOM": "category",
+    "DATE_OF_DEATH": "category",
+    "AGE": "int16",
+    "COUNTRY OF ORIGIN": "category",
+}
+
+
+def _parse_dictionary_entry(text):
+    # "1 = Female, 2= Male, 99= Unknown" -> {1: "FEMALE", 2: "MALE", 99: "UNKNOWN"}
+    return {
+        int(code): value.strip().upper()
+        for code, value in re.findall(r"(\d+)\s*=\s*([^,]+)", str(text))
     }
 
-    disease_columns = ["DIABETES", "COPD", "ASTHMA", "INMUSUPR", "HYPERTENSION", 
-                       "PNEUMONIA", "CARDIOVASCULAR", "OBESITY", "CHRONIC_KIDNEY", "TOBACCO", "OTHER_DISEASE"]
 
-    for column, map_values in mapping.items():
-        if column in df.columns:
-            df[column] = pd.to_numeric(df[column], errors="coerce")
-            df[column] = df[column].map(map_values)
+@functools.lru_cache(maxsize=None)
+def code_tables(path=DATA_DICTIONARY_PATH):
+    tables = {column: dict(values) for column, values in MAPPING.items()}
+    try:
+        dictionary = pd.read_excel(path)
+    except (ImportError, OSError, ValueError) as e:
+        logger.warning("Could not read data dictionary, using built-in labels: %s", e)
+        return tables
+
+    # A column the dictionary defines takes its codes from there only; mixing
+    # in the built-in ones would give one label two codes (e.g. UNKNOWN as
+    # both 97 and 99)
+    defined = set()
+    for variable, text in zip(dictionary["variable"], dictionary["value"]):
+        column = str(variable).strip().upper()
+        codes = _parse_dictionary_entry(text)
+        if not codes:
+            continue
+        if column not in defined:
+            tables[column] = {}
+            defined.add(column)
+        tables[column].update(codes)
+    return tables
+
+
+def coded_columns():
+    return list(code_tables())
+
+
+def label(column, code):
+    if code == MISSING_CODE:
+        return None
+    return code_tables().get(column, {}).get(code, str(code))
+
+
+def dictionary_codes(column):
+    # Every code the data dictionary defines for `column`, for widgets drawn
+    # before the data is loaded
+    return sorted(code_tables().get(column, {}))
+
+
+def codes_present(values):
+    return [int(code) for code in np.unique(np.asarray(values)) if code != MISSING_CODE]
+
+
+def format_option(column):
+    # format_func for selectboxes whose options are codes plus "All"; codes
+    # sharing a label (e.g. two UNKNOWNs) also show the code
+    labels = list(code_tables().get(column, {}).values())
+
+    def format_code(option):
+        if option == "All":
+            return option
+        text = label(column, option)
+        return f"{text} ({option})" if labels.count(text) > 1 else text
+
+    return format_code
+
+
+def decode(column, codes):
+    # Codes -> Categorical of labels; no per-row strings are created
+    table = code_tables().get(column, {})
+    categories = list(dict.fromkeys(table.values()))
+    lookup = np.full(256, -1, dtype=np.int16)
+    for code, value in table.items():
+        lookup[code & 0xFF] = categories.index(value)
+    codes = np.asarray(codes).astype(np.int8, copy=False).view(np.uint8)
+    return pd.Categorical.from_codes(lookup[codes], categories=categories)
+
+
+def decode_counts(counts, column):
+    # Relabel a value_counts() result indexed by code, dropping missing values
+    counts = counts.drop(MISSING_CODE, errors="ignore")
+    return counts.rename(index=lambda code: label(column, code))
 
-    for column in disease_columns:
+
+def decode_frame(df):
+    decoded = df.copy(deep=False)
+    for column in coded_columns():
+        if column in decoded.columns:
+            decoded[column] = decode(column, decoded[column])
+    return decoded
+
+
+def read_dtypes(names):
+    # read_csv dtypes for the CSV columns `names`: float32 for codes and
+    # counts, so blanks parse as NaN, and categories for repeated text
+    coded = set(coded_columns())
+    dtypes = {}
+    for name in names:
+        kind = "code" if name.upper() in coded else COLUMN_TYPES.get(name.upper())
+        if kind in ("code", "int16"):
+            dtypes[name] = "float32"
+        elif kind == "category":
+            dtypes[name] = "category"
+    return dtypes
+
+
+def csv_columns(path=DATASET_PATH):
+    # Column names as decode_columns() gives them, in file order
+    return [name.upper() for name in pd.read_csv(path, nrows=0).columns]
+
+
+def _usecols(header, columns):
+    # CSV names of `columns` (decoded names; None for every column)
+    if columns is None:
+        return list(header)
+    wanted = set(columns)
+    return [name for name in header if name.upper() in wanted]
+
+
+def decode_columns(df):
+    df.columns = map(str.upper, df.columns)
+
+    # Coded columns stay as their raw codes, one byte per value
+    for column in coded_columns():
         if column in df.columns:
-            df[column] = df[column].map({1: "YES", 2: "NO", 97: "N/A", 98: "IGNORED", 99: "UNKNOWN"})
+            values = pd.to_numeric(df[column], errors="coerce")
+            values = values.where(values.between(0, 127), MISSING_CODE)
+            df[column] = values.astype(np.int8)
+
+    for column, kind in COLUMN_TYPES.items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if kind == "date":
+            df[column] = pd.to_datetime(values, format=DATE_FORMAT, errors="coerce")
+        elif kind == "category" and isinstance(values.dtype, pd.CategoricalDtype):
+            # read_csv orders categories by first appearance per block; sorted
+            # ones do not depend on how the file was split
+            df[column] = values.cat.reorder_categories(values.cat.categories.sort_values())
+        elif (
+            kind == "int16"
+            and pd.api.types.is_numeric_dtype(values.dtype)
+            and values.notna().all()
+            and (values % 1 == 0).all()
+            and values.between(-(1 << 15), (1 << 15) - 1).all()
+        ):
+            df[column] = values.astype(np.int16)
+
+    return df
+
+
+def parse_csv(path=DATASET_PATH, workers=None, columns=None, end=None):
+    # Decodes `columns` (None: every column) of the rows in the first `end`
+    # bytes (None: the whole file)
+    workers = PARSE_WORKERS if workers is None else workers
+    end = os.path.getsize(path) if end is None else end
+    if workers > 1 and end >= PARALLEL_MIN_BYTES:
+        return parse_csv_parallel(path, workers, columns, end)
+    return read_rows(path, _data_start(path), end, columns)
+
+
+def _data_start(path):
+    with open(path, "rb") as f:
+        f.readline()
+        return f.tell()
+
+
+def split_ranges(path, parts, end=None):
+    # Byte ranges of roughly equal size covering every row, each starting
+    # right after a newline. Assumes no quoted field contains a line break
+    size = os.path.getsize(path) if end is None else end
+    with open(path, "rb") as f:
+        f.readline()
+        bounds = [f.tell()]
+        for i in range(1, parts):
+            f.seek(max(bounds[0] + (size - bounds[0]) * i // parts, bounds[-1]) - 1)
+            f.readline()
+            bounds.append(f.tell())
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def parse_csv_parallel(path=DATASET_PATH, workers=PARSE_WORKERS, columns=None, end=None):
+    # Each worker process parses and decodes one newline-aligned byte range;
+    # the typed parts are concatenated in file order
+    ranges = split_ranges(path, workers, end)
+    if len(ranges) < 2:
+        return read_rows(path, _data_start(path), os.path.getsize(path) if end is None else end, columns)
+    starts, ends = zip(*ranges)
+    # Spawned workers are safe to start from the threaded Streamlit server
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(len(ranges), mp_context=context) as pool:
+        parts = list(pool.map(read_rows, [path] * len(ranges), starts, ends, [columns] * len(ranges)))
+    df = pd.concat(parts, ignore_index=True)
+    # Each part has categories of its own values, which concat turns into
+    # objects; combine them the way a single read_csv would have
+    for column in df.columns:
+        if all(isinstance(part[column].dtype, pd.CategoricalDtype) for part in parts):
+            df[column] = union_categoricals([part[column] for part in parts], sort_categories=True)
+    return df
+
+
+def read_rows(path, start, end, columns=None):
+    # Decode only the rows stored in bytes [start, end) of the CSV, and of
+    # them only `columns` (None: every column), typed by the schema. A file
+    # that breaks the schema, e.g. text in a coded column, is read again with
+    # inferred types for decode_columns to coerce
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = _usecols(header, columns)
+
+    def read(dtypes):
+        with io.BufferedReader(_ByteRange(path, start, end)) as f:
+            return pd.read_csv(f, header=None, names=header, usecols=usecols, dtype=dtypes)
+
+    try:
+        df = read(read_dtypes(usecols))
+    except (ValueError, TypeError) as e:
+        logger.warning("Dataset does not match its schema, inferring column types: %s", e)
+        df = read(None)
+    return decode_columns(df)
+
+
+class _ByteRange(io.RawIOBase):
+    # Read-only file view that stops at `end`, so a streaming pass never reads
+    # rows appended after its fingerprint was taken
+    def __init__(self, path, start, end):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        view = memoryview(buffer)[: max(self._remaining, 0)]
+        read = self._file.readinto(view)
+        self._remaining -= read
+        return read
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def parse_memory_limit(text):
+    # "512M", "2G", "1500000" -> bytes; empty means no limit
+    if not text:
+        return None
+    text = str(text).strip().upper().rstrip("B")
+    scale = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}.get(text[-1:], 1)
+    return int(float(text.rstrip("KMG")) * scale)
+
+
+def estimate_memory(path=DATASET_PATH, sample_rows=1000, columns=None):
+    # (bytes to hold the decoded table, bytes per row while parsing), from a sample
+    usecols = _usecols(pd.read_csv(path, nrows=0).columns, columns)
+    sample = pd.read_csv(path, nrows=sample_rows, usecols=usecols, dtype=read_dtypes(usecols))
+    if sample.empty:
+        return 0, 1
+    parsing = sample.memory_usage(deep=True).sum() / len(sample)
+    decoded = decode_columns(sample).memory_usage(deep=True).sum() / len(sample)
+    with open(path, "rb") as f:
+        head = f.read(_HASH_BLOCK)
+    rows = os.path.getsize(path) * max(head.count(b"\n") - 1, 1) / len(head)
+    return int(decoded * rows), parsing
+
+
+def iter_chunks(path=DATASET_PATH, chunk_rows=None, memory_limit=None, end=None, columns=None):
+    # Decoded chunks of `columns` (None: every column) for out-of-core
+    # aggregation. Without an explicit chunk_rows, chunks are sized so parsing
+    # one stays within memory_limit
+    if chunk_rows is None:
+        _, parsing = estimate_memory(path, columns=columns)
+        # read_csv briefly needs a few times the parsed size of a chunk
+        chunk_rows = max(1000, int((memory_limit or 256 << 20) / (parsing * 4)))
+    end = os.path.getsize(path) if end is None else end
+    usecols = _usecols(pd.read_csv(path, nrows=0).columns, columns)
+    with io.BufferedReader(_ByteRange(path, 0, end)) as f:
+        for chunk in pd.read_csv(f, chunksize=chunk_rows, usecols=usecols, dtype=read_dtypes(usecols)):
+            yield decode_columns(chunk)
+
+
+def snapshot_path(path=DATASET_PATH):
+    if SNAPSHOT_DIR:
+        # Named after the CSV's absolute path so same-named datasets don't collide
+        digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]
+        return os.path.join(SNAPSHOT_DIR, f"{os.path.basename(path)}-{digest}{SNAPSHOT_SUFFIX}")
+    return path + SNAPSHOT_SUFFIX
+
+
+@contextlib.contextmanager
+def snapshot_lock(path=DATASET_PATH):
+    # Held while a snapshot is built or appended to, so server processes
+    # starting together parse the CSV once and map the result
+    target = snapshot_path(path)
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+        f = open(target + ".lock", "a")
+    except OSError:
+        # Unwritable location: no snapshot will be written there either
+        yield
+        return
+    with f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _hash_range(f, start, end):
+    f.seek(start)
+    return hashlib.sha1(f.read(max(end - start, 0))).hexdigest()
+
+
+def _tail_start(size):
+    return max(size - _HASH_BLOCK, min(size, _HASH_BLOCK))
+
+
+def fingerprint(path=DATASET_PATH, size=None):
+    # Size and mtime catch ordinary edits; hashing the first and last block
+    # catches rewrites that preserve both without reading the whole file.
+    # `size` fingerprints only the first `size` bytes, e.g. whole rows read so far
+    stat = os.stat(path)
+    size = stat.st_size if size is None else size
+    with open(path, "rb") as f:
+        head = _hash_range(f, 0, min(size, _HASH_BLOCK))
+        tail = _hash_range(f, _tail_start(size), size)
+    return {"size": size, "mtime_ns": stat.st_mtime_ns, "head": head, "tail": tail}
+
+
+def appended_range(previous, path=DATASET_PATH):
+    # Byte range holding whole rows appended since `previous` was taken, or
+    # None when the file was rewritten rather than appended to
+    current = fingerprint(path)
+    if current == previous:
+        return previous["size"], previous["size"]
+    size = previous["size"]
+    if current["size"] <= size or current["head"] != previous["head"]:
+        return None
+    with open(path, "rb") as f:
+        if _hash_range(f, _tail_start(size), size) != previous["tail"]:
+            return None
+        f.seek(size - 1)
+        if f.read(1) != b"\n":
+            return None
+        f.seek(size)
+        data = f.read(current["size"] - size)
+    # A half-written last line is left for the next refresh
+    return size, size + data.rfind(b"\n") + 1
+
+
+def _encode_column(values, entry=None, dtype=None):
+    # Returns (array, manifest entry) of a new column, stored as `dtype` when
+    # given, or of rows for the existing column described by `entry`; raises
+    # ValueError when `values` cannot be appended to that column
+    text = values.dtype == object or isinstance(values.dtype, pd.CategoricalDtype)
+    if entry is not None and text and "categories" not in entry:
+        raise ValueError(f"{values.name} holds text its stored column cannot")
+    entry = dict(entry or ({"dtype": dtype} if dtype else {}))
+    if "datetime" in entry or pd.api.types.is_datetime64_dtype(values.dtype):
+        entry.setdefault("datetime", "datetime64[ns]")
+        entry.setdefault("dtype", "int64")
+        data = pd.to_datetime(values).to_numpy().astype("datetime64[ns]").view("int64")
+    elif "categories" in entry or text:
+        # Strings are stored as dictionary codes so every column can be mmapped
+        categories = list(entry.get("categories", []))
+        known = dict(zip(categories, range(len(categories))))
+        for value in pd.unique(values.dropna()):
+            if value not in known:
+                known[value] = len(categories)
+                categories.append(value)
+        entry["categories"] = categories
+        entry.setdefault("dtype", str(pd.Categorical(categories).codes.dtype))
+        data = values.astype(object).map(known).fillna(-1).to_numpy(dtype=float)
+    else:
+        data = values.to_numpy()
+        entry.setdefault("dtype", str(data.dtype))
+    encoded = data.astype(entry["dtype"])
+    if not np.array_equal(encoded, data, equal_nan=data.dtype.kind == "f"):
+        raise ValueError(f"{values.name} does not fit a {entry['dtype']} column")
+    return encoded, entry
+
+
+def write_manifest(directory, manifest, name="manifest.json"):
+    staging = os.path.join(directory, f"{name}.tmp-{os.getpid()}")
+    with open(staging, "w") as f:
+        json.dump(manifest, f)
+    os.replace(staging, os.path.join(directory, name))
+
+
+def write_columns(df, directory, first=0, dtypes=None):
+    # One file per column of `df` in `directory`, numbered from `first`;
+    # returns their manifest entries. `dtypes` fixes the stored width of some
+    # columns by name instead of taking the narrowest that holds `df`
+    dtypes = dtypes or {}
+    entries = []
+    for i, column in enumerate(df.columns, first):
+        data, entry = _encode_column(df[column], dtype=dtypes.get(column))
+        entry.update(name=column, file=f"{i}.bin")
+        data.tofile(os.path.join(directory, entry["file"]))
+        entries.append(entry)
+    return entries
+
+
+def append_columns(rows, directory, entries, stored_rows):
+    # Appends `rows` to the column files `entries` describe, which hold
+    # `stored_rows` rows, and returns the updated entries. Raises KeyError,
+    # ValueError or TypeError, before writing anything, when the rows do not
+    # fit. Writing at the recorded end means a crash between files leaves
+    # nothing behind once the manifest is not updated
+    encoded = [_encode_column(rows[entry["name"]], entry) for entry in entries]
+    for data, entry in encoded:
+        with open(os.path.join(directory, entry["file"]), "r+b") as f:
+            f.seek(stored_rows * data.itemsize)
+            data.tofile(f)
+            f.truncate()
+    return [entry for _, entry in encoded]
+
+
+def read_columns(directory, entries, rows):
+    # Frame of the memory-mapped column files `entries` describe, or None
+    # when one of them cannot be mapped
+    columns = {}
+    for entry in entries:
+        file = os.path.join(directory, entry["file"])
+        try:
+            data = np.memmap(file, dtype=entry["dtype"], mode="r", shape=(rows,)) if rows else np.empty(0, dtype=entry["dtype"])
+        except (OSError, ValueError):
+            return None
+        if "categories" in entry:
+            data = pd.Categorical.from_codes(data, categories=entry["categories"])
+        elif "datetime" in entry:
+            data = data.view(entry["datetime"])
+        columns[entry["name"]] = data
+    return pd.DataFrame(columns, copy=False)
+
+
+def write_snapshot(df, path=DATASET_PATH, source_fingerprint=None):
+    target = snapshot_path(path)
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    staging = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    write_manifest(staging, {
+        "version": SNAPSHOT_VERSION,
+        "fingerprint": source_fingerprint or fingerprint(path),
+        "rows": len(df),
+        "columns": write_columns(df, staging),
+    })
+
+    # Swap the finished directory into place; processes still mapping the old
+    # files keep reading them until they reopen
+    previous = f"{target}.old-{os.getpid()}"
+    if os.path.isdir(target):
+        os.rename(target, previous)
+    os.rename(staging, target)
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+def append_snapshot(rows, path=DATASET_PATH, source_fingerprint=None, previous=None):
+    # Append decoded rows to the column files in place; False means the rows
+    # do not fit the stored layout and the snapshot has to be rebuilt.
+    # `previous` is the fingerprint the rows follow: when the snapshot has
+    # already moved past it, another process appended them first
+    with snapshot_lock(path):
+        return _append_snapshot(rows, path, source_fingerprint, previous)
+
+
+def _append_snapshot(rows, path, source_fingerprint, previous):
+    target = snapshot_path(path)
+    manifest = _read_manifest(target)
+    if manifest is None:
+        return False
+    if source_fingerprint is not None and manifest["fingerprint"] == source_fingerprint:
+        return True
+    if previous is not None and manifest["fingerprint"] != previous:
+        return False
+    if not len(rows):
+        # e.g. a blank line; empty columns carry no dtype to check against
+        manifest["fingerprint"] = source_fingerprint or fingerprint(path)
+        write_manifest(target, manifest)
+        return True
+    try:
+        manifest["columns"] = append_columns(rows, target, manifest["columns"], manifest["rows"])
+    except (KeyError, ValueError, TypeError):
+        return False
+    manifest["rows"] += len(rows)
+    manifest["fingerprint"] = source_fingerprint or fingerprint(path)
+    write_manifest(target, manifest)
+    return True
+
+
+def _read_manifest(target):
+    try:
+        with open(os.path.join(target, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        return None
+    return manifest
+
+
+def snapshot_fingerprint(path=DATASET_PATH):
+    manifest = _read_manifest(snapshot_path(path))
+    return manifest and manifest["fingerprint"]
+
+
+def snapshot_columns(path=DATASET_PATH):
+    manifest = _read_manifest(snapshot_path(path))
+    return [entry["name"] for entry in manifest["columns"]] if manifest else []
+
+
+def _add_snapshot_columns(df, path, held):
+    # Store the columns of `df` next to the ones already in the snapshot of
+    # the `held` rows; False when the snapshot changed or does not match
+    target = snapshot_path(path)
+    manifest = _read_manifest(target)
+    if manifest is None or manifest["fingerprint"] != held or manifest["rows"] != len(df):
+        return False
+    manifest["columns"] += write_columns(df, target, len(manifest["columns"]))
+    write_manifest(target, manifest)
+    return True
+
+
+def read_snapshot(path=DATASET_PATH, expected_fingerprint=None, columns=None):
+    # The snapshot as a frame of `columns` (None: every stored column), or
+    # None when it is stale or lacks one of them
+    target = snapshot_path(path)
+    manifest = _read_manifest(target)
+    if manifest is None:
+        return None
+    if manifest["fingerprint"] != (expected_fingerprint or fingerprint(path)):
+        return None
+    entries = {entry["name"]: entry for entry in manifest["columns"]}
+    if columns is not None:
+        if not set(columns) <= set(entries):
+            return None
+        entries = {name: entries[name] for name in columns}
+    return read_columns(target, entries.values(), manifest["rows"])
+
+
+def _catch_up(path, current):
+    # Brings the snapshot up to the CSV by appending the rows added since it
+    # was written; returns the fingerprint it then holds, or None when it has
+    # to be rebuilt
+    previous = snapshot_fingerprint(path)
+    if previous is None or previous == current:
+        return previous
+    span = appended_range(previous, path)
+    if not span:
+        return None
+    if span[1] == span[0]:
+        # Only a half-written line was added; serve the snapshot as it is
+        return previous
+    start, end = span
+    consumed = fingerprint(path, end)
+    rows = read_rows(path, start, end, snapshot_columns(path))
+    if _append_snapshot(rows, path, consumed, previous):
+        return consumed
+    return None
+
+
+def _add_missing_columns(path, held, columns, workers):
+    # Parses only the requested columns the snapshot lacks, over the rows it
+    # holds, and stores them alongside the others
+    wanted = set(columns) - set(snapshot_columns(path))
+    missing = [column for column in csv_columns(path) if column in wanted]
+    if not missing:
+        return True
+    return _add_snapshot_columns(parse_csv(path, workers, missing, end=held["size"]), path, held)
+
+
+def open_dataset(path=DATASET_PATH, use_snapshot=True, workers=None, columns=None):
+    # Returns the decoded frame of `columns` (None: every column) and the
+    # fingerprint of the CSV bytes it holds. The snapshot keeps every column
+    # any caller asked for, so a new one is parsed once, on its own
+    current = fingerprint(path)
+    if not use_snapshot:
+        return parse_csv(path, workers, columns), current
+    header = csv_columns(path)
+    columns = header if columns is None else list(columns)
+    df = read_snapshot(path, current, columns)
+    if df is not None:
+        return df, current
+
+    with snapshot_lock(path):
+        # Another process may have built the snapshot while this one waited
+        held = _catch_up(path, current)
+        if held is not None and _add_missing_columns(path, held, columns, workers):
+            df = read_snapshot(path, held, columns)
+            if df is not None:
+                return df, held
+
+        # Rebuild with the columns stored so far, so other callers keep theirs
+        wanted = set(columns) | set(snapshot_columns(path))
+        df = parse_csv(path, workers, [column for column in header if column in wanted])
+        try:
+            write_snapshot(df, path, current)
+        except OSError as e:
+            logger.warning("Could not write dataset snapshot: %s", e)
+        else:
+            # Serve the mapped copy so cold and warm starts look the same
+            df = read_snapshot(path, current)
+    return df[columns], current
+
+
+def load_columns(path=DATASET_PATH, columns=(), held=None, use_snapshot=True):
+    # Just `columns` of the rows a frame opened at fingerprint `held` holds,
+    # for adding to it; None when the CSV has moved on and the frame has to
+    # be refreshed first
+    if use_snapshot:
+        with snapshot_lock(path):
+            stored = snapshot_fingerprint(path)
+            if stored == held and _add_missing_columns(path, held, columns, None):
+                df = read_snapshot(path, held, columns)
+                if df is not None:
+                    return df
+    if fingerprint(path, held["size"]) != held:
+        return None
+    return parse_csv(path, columns=columns, end=held["size"])
+
+
+def attach_snapshot(path=DATASET_PATH, timeout=ATTACH_TIMEOUT, columns=None):
+    # Map the snapshot a loader process (`python data_loader.py --watch N`)
+    # publishes, without parsing anything here. The columns are read-only
+    # views of the same pages in every process. Returns the frame and the
+    # fingerprint of the CSV bytes it holds
+    deadline = time.monotonic() + timeout
+    while True:
+        published = snapshot_fingerprint(path)
+        df = published and read_snapshot(path, published, columns)
+        if df is not None:
+            return df, published
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"No snapshot of {path} was published within {timeout}s")
+        time.sleep(0.5)
+
+
+def load_data(path=DATASET_PATH, use_snapshot=True, columns=None):
+    df, _ = open_dataset(path, use_snapshot, columns=columns)
+    return df, list(DISEASE_COLUMNS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Decode the dataset CSV and write its column snapshot.")
+    parser.add_argument("path", nargs="?", default=DATASET_PATH)
+    parser.add_argument("--workers", type=int, default=PARSE_WORKERS, help="parser processes")
+    parser.add_argument(
+        "--verify", action="store_true", help="check that the parallel and serial loaders agree"
+    )
+    parser.add_argument(
+        "--watch",
+        type=float,
+        metavar="SECONDS",
+        help="keep running as the loader for DATASET_ATTACH servers, checking the CSV this often",
+    )
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        started = time.perf_counter()
+        parallel = parse_csv_parallel(args.path, max(args.workers, 2))
+        parallel_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        serial = parse_csv(args.path, workers=1)
+        serial_seconds = time.perf_counter() - started
+        pd.testing.assert_frame_equal(parallel, serial)
+        print(f"{len(serial):,} rows identical; serial {serial_seconds:.2f}s, parallel {parallel_seconds:.2f}s")
+        return
+
+    # Attached servers take the admission-month partitions from the loader
+    # too. Imported here: partitions.py builds on this module
+    import partitions
+
+    started = time.perf_counter()
+    df, published = open_dataset(args.path, workers=args.workers)
+    partitions.open_partitions(args.path)
+    print(f"{len(df):,} rows ready in {time.perf_counter() - started:.2f}s")
+    while args.watch:
+        time.sleep(args.watch)
+        df, current = open_dataset(args.path, workers=args.workers)
+        partitions.open_partitions(args.path)
+        if current != published:
+            print(f"{len(df):,} rows published")
+            published = current
+
 
-    return df, disease_columns
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+import copy
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+
+import data_loader
+import instrumentation
+import memo
+import partitions
+from age_histogram import AgeHistogram
+from correlation import CorrelationStats, correlation_features
+from count_cube import CODE_DIMENSIONS, CountCube
+from filter_index import FILTER_COLUMNS, FLAG_COLUMNS, FilterIndex
+from sampling import SampleCube
+from timeseries import DailyCounts, time_series_categories
+
+# Pages get shallow copies of one shared frame; copy-on-write keeps any
+# column they add or overwrite private to that page
+pd.set_option("mode.copy_on_write", True)
+
+# Seconds between checks of the CSV for newly appended admissions
+REFRESH_INTERVAL = 60
+
+# Above this many bytes of decoded data (e.g. "4G") the rows are streamed
+# through the aggregates below in chunks instead of being kept in memory
+MEMORY_LIMIT = data_loader.parse_memory_limit(os.environ.get("DATASET_MEMORY_LIMIT"))
+
+# Never parse the CSV in this process; map the snapshot published by a loader
+# process (`python data_loader.py --watch N`) instead, so every server
+# process shares one copy of the columns
+ATTACH = bool(os.environ.get("DATASET_ATTACH"))
+
+# Bytes of filtered views (e.g. "512M") kept for reuse across sessions
+VIEW_CACHE_BYTES = data_loader.parse_memory_limit(os.environ.get("DASHBOARD_CACHE_BYTES") or "256M")
+
+# Default of the pages' fast approximate mode: answer from the stratified
+# sample first, then swap in exact numbers
+APPROXIMATE = bool(os.environ.get("DASHBOARD_APPROXIMATE"))
+
+# Aggregates every page can run on without a resident frame
+AGGREGATES = {
+    "count_cube": CountCube,
+    "age_histogram": AgeHistogram,
+    "daily_counts": DailyCounts,
+    "correlation": CorrelationStats,
+    "sample": SampleCube,
+}
+
+# Columns each aggregate reads; they are loaded before it is built
+AGGREGATE_COLUMNS = {
+    "filter_index": FILTER_COLUMNS + FLAG_COLUMNS,
+    "count_cube": CODE_DIMENSIONS + ["DATE_OF_DEATH"] + data_loader.DISEASE_COLUMNS,
+    "age_histogram": ["SEX", "NATIONALITY", "AGE"] + data_loader.DISEASE_COLUMNS,
+    "daily_counts": ["ADMISSION DATE"] + time_series_categories(),
+    "correlation": correlation_features(),
+    "sample": CODE_DIMENSIONS + ["DATE_OF_DEATH", "AGE", "ADMISSION DATE"] + data_loader.DISEASE_COLUMNS,
+}
+# Loaded when the first caller names no columns, and always when streaming
+DEFAULT_COLUMNS = list(dict.fromkeys(column for columns in AGGREGATE_COLUMNS.values() for column in columns))
+
+
+class Dataset:
+    # The decoded frame plus every aggregate derived from it, shared by all
+    # sessions of one server process. Only the columns some caller required
+    # are loaded; others are added to the frame when first required
+
+    def __init__(self, path, use_snapshot=True, memory_limit=MEMORY_LIMIT, attach=ATTACH):
+        self.path = path
+        self.use_snapshot = use_snapshot
+        self.memory_limit = memory_limit
+        self.attach = attach
+        self.disease_columns = list(data_loader.DISEASE_COLUMNS)
+        self.header = data_loader.csv_columns(path)
+        self.columns = []
+        self.df = None
+        self.fingerprint = None
+        self.rows = 0
+        self.served = 0
+        self._derived = {}
+        self._lock = threading.RLock()
+        self._partitions = None
+        self._partitions_for = None
+        self._partitions_lock = threading.Lock()
+
+    def _project(self, columns):
+        # `columns` (None: every column) that the CSV has, in file order
+        if columns is None:
+            return list(self.header)
+        columns = set(columns)
+        return [column for column in self.header if column in columns]
+
+    def require(self, columns=()):
+        # Loads the dataset with `columns` (None: every column) on first use,
+        # DEFAULT_COLUMNS when none are named; afterwards parses only the
+        # columns not loaded yet and adds them to the frame
+        with self._lock:
+            wanted = self._project(columns)
+            if self.fingerprint is None:
+                self.columns = wanted or self._project(DEFAULT_COLUMNS)
+                self._load()
+            elif self.resident and not set(wanted) <= set(self.columns):
+                self._add_columns([column for column in wanted if column not in self.columns])
+
+    def _fetch(self, columns):
+        if self.attach:
+            return data_loader.read_snapshot(self.path, self.fingerprint, columns)
+        return data_loader.load_columns(self.path, columns, self.fingerprint, self.use_snapshot)
+
+    def _add_columns(self, missing):
+        added = self._fetch(missing)
+        if added is None:
+            # The CSV moved on since the frame was loaded; catch up first
+            self.refresh()
+            added = self._fetch(missing) if self.resident else None
+        self.columns = self._project(self.columns + missing)
+        if added is None or len(added) != self.rows:
+            self._load()
+            return
+        # The columns already loaded are shared with the new frame, not copied
+        df = self.df.copy(deep=False)
+        for column in missing:
+            df[column] = added[column]
+        self.df = df[self.columns]
+
+    def _load(self):
+        self._derived = {}
+        self._checked = time.monotonic()
+        self.header = data_loader.csv_columns(self.path)
+        self.columns = self._project(self.columns)
+        if self.attach:
+            self.df, self.fingerprint = data_loader.attach_snapshot(self.path, columns=self.columns)
+            self.rows = len(self.df)
+        elif self.memory_limit and data_loader.estimate_memory(self.path, columns=self.columns)[0] > self.memory_limit:
+            self._stream()
+        else:
+            self.df, self.fingerprint = data_loader.open_dataset(
+                self.path, self.use_snapshot, columns=self.columns
+            )
+            self.rows = len(self.df)
+
+    def _stream(self):
+        # One pass over the CSV in chunks sized to the memory limit; each chunk
+        # is folded into every aggregate and then dropped
+        self.df = None
+        self.rows = 0
+        self.columns = self._project(self.columns + DEFAULT_COLUMNS)
+        self.fingerprint = data_loader.fingerprint(self.path)
+        chunks = data_loader.iter_chunks(
+            self.path, memory_limit=self.memory_limit, end=self.fingerprint["size"], columns=self.columns
+        )
+        for chunk in chunks:
+            self.rows += len(chunk)
+            for name, factory in AGGREGATES.items():
+                if name in self._derived:
+                    self._derived[name].extend(chunk)
+                else:
+                    self._derived[name] = factory(chunk, self.disease_columns)
+        if not self._derived:
+            empty = data_loader.decode_columns(pd.read_csv(self.path, nrows=0))
+            self._derived = {name: factory(empty, self.disease_columns) for name, factory in AGGREGATES.items()}
+
+    @property
+    def resident(self):
+        return self.df is not None
+
+    def derived(self, name, factory):
+        # factory(df, disease_columns) builds the aggregate once; it must also
+        # provide extend(rows) so refresh() can fold new rows into a copy of
+        # it, rebinding the copy's attributes rather than writing into arrays
+        # both share. Without a resident frame only the streamed AGGREGATES exist
+        with self._lock:
+            instrumentation.cache_event(name, hit=name in self._derived)
+            if name not in self._derived:
+                self.require(AGGREGATE_COLUMNS.get(name, ()))
+            if name not in self._derived and self.resident:
+                self._derived[name] = factory(self.df, self.disease_columns)
+            return self._derived.get(name)
+
+    def refresh(self):
+        # Decode only the rows appended to the CSV since the last load and fold
+        # them into the frame and every derived aggregate. A file that was
+        # rewritten rather than appended to is reloaded from scratch.
+        # Returns the number of rows added.
+        with self._lock:
+            self._checked = time.monotonic()
+            if self.attach:
+                return self._follow_snapshot()
+            span = data_loader.appended_range(self.fingerprint, self.path)
+            if span is None:
+                self._load()
+                return self.rows
+            start, end = span
+            if end == start:
+                return 0
+
+            # The snapshot is appended to in every column it stores
+            columns = self.columns
+            if self.resident and self.use_snapshot:
+                columns = self._project(columns + data_loader.snapshot_columns(self.path))
+            rows = data_loader.read_rows(self.path, start, end, columns)
+            consumed = data_loader.fingerprint(self.path, end)
+            df = None
+            if (
+                self.resident
+                and self.use_snapshot
+                and data_loader.append_snapshot(rows, self.path, consumed, self.fingerprint)
+            ):
+                # The grown column files are mapped again rather than copied
+                df = data_loader.read_snapshot(self.path, consumed, self.columns)
+            if df is None and self.resident:
+                df = pd.concat([self.df, rows[self.columns]], ignore_index=True)
+
+            self._derived = _extended(self._derived, rows)
+            self.df, self.fingerprint = df, consumed
+            self.rows += len(rows)
+            return len(rows)
+
+    def _follow_snapshot(self):
+        # Map what the loader process published since the last check; rows it
+        # appended are folded into the aggregates, anything else reloads
+        published = data_loader.snapshot_fingerprint(self.path)
+        if published is None or published == self.fingerprint:
+            return 0
+        df = data_loader.read_snapshot(self.path, published, self.columns)
+        if df is None:
+            return 0
+        if data_loader.appended_range(self.fingerprint, self.path) is None or len(df) < self.rows:
+            self._load()
+            return self.rows
+        rows = df.iloc[self.rows :]
+        self._derived = _extended(self._derived, rows)
+        self.df, self.fingerprint = df, published
+        self.rows = len(df)
+        return len(rows)
+
+    def partitions(self):
+        # Manifest of the admission-month partitions, brought up to the CSV
+        # once per version of the rows loaded here; None when they could not
+        # be written. Attached servers use what the loader process publishes
+        with self._partitions_lock:
+            if self._partitions_for != self.fingerprint:
+                if self.attach:
+                    self._partitions = partitions.partition_manifest(self.path)
+                else:
+                    self._partitions = partitions.open_partitions(self.path, self.memory_limit)
+                self._partitions_for = self.fingerprint
+            return self._partitions
+
+    def maybe_refresh(self):
+        if time.monotonic() - self._checked >= REFRESH_INTERVAL:
+            self.refresh()
+
+
+def _extended(derived, rows):
+    # Copies of the aggregates with `rows` folded in. Sessions read the
+    # aggregates they were handed without the lock, so the originals are left
+    # as they are and only the references are swapped
+    updated = {}
+    for name, aggregate in derived.items():
+        aggregate = copy.copy(aggregate)
+        aggregate.extend(rows)
+        updated[name] = aggregate
+    return updated
+
+
+@st.cache_resource(show_spinner="Loading dataset...")
+def _shared_dataset(path):
+    return Dataset(path)
+
+
+_warming = {}
+_warming_lock = threading.Lock()
+
+
+def _warm(path, columns):
+    # Only aggregates over the loaded columns; the others would load more
+    dataset = _shared_dataset(path)
+    dataset.require(columns)
+    factories = dict(AGGREGATES, filter_index=lambda df, _: FilterIndex(df))
+    for name, factory in factories.items():
+        if set(dataset._project(AGGREGATE_COLUMNS[name])) <= set(dataset.columns):
+            dataset.derived(name, factory)
+    # Date-range filters need the month partitions
+    dataset.partitions()
+
+
+def warm_up(path=data_loader.DATASET_PATH, columns=()):
+    # Loads the dataset with the page's `columns` and builds the aggregates
+    # they cover on a background thread, once per server process, so a page
+    # can draw its layout and filters while that runs; the first accessor to
+    # need the data waits for it. Later pages add their columns on first use
+    path = os.path.abspath(path)
+    with _warming_lock:
+        if path not in _warming:
+            thread = threading.Thread(target=_warm, args=(path, columns), name="warm-up", daemon=True)
+            # Inherit the page's script context so st.cache_resource works
+            add_script_run_ctx(thread)
+            thread.start()
+            _warming[path] = thread
+        return _warming[path]
+
+
+def get_dataset(path=data_loader.DATASET_PATH, columns=()):
+    # One parse per column and server process, shared by every page and session
+    dataset = _shared_dataset(os.path.abspath(path))
+    dataset.require(columns)
+    instrumentation.cache_event("dataset", hit=dataset.served > 0)
+    dataset.served += 1
+    dataset.maybe_refresh()
+    return dataset
+
+
+def data_version(path=data_loader.DATASET_PATH):
+    # Changes whenever rows are added or the file is reloaded; part of the
+    # key of anything cached from the aggregates
+    fingerprint = get_dataset(path).fingerprint
+    return fingerprint["size"], fingerprint["head"], fingerprint["tail"]
+
+
+_views = memo.LRUCache("filtered_views", VIEW_CACHE_BYTES)
+
+
+def filtered(name, terms, build, path=data_loader.DATASET_PATH):
+    # Anything derived from one filter selection, built once for all sessions.
+    # `terms` is the canonical tuple from filter_terms(); entries of older
+    # data versions are never hit again and age out
+    value, hit = _views.lookup((name, terms, data_version(path)), build)
+    instrumentation.cache_event("filtered_views", hit)
+    return value
+
+
+# Builds exact views while a page draws estimates
+_refiner = ThreadPoolExecutor(thread_name_prefix="refine")
+
+
+def is_filtered(name, terms, path=data_loader.DATASET_PATH):
+    return (name, terms, data_version(path)) in _views
+
+
+def refine(name, terms, build, path=data_loader.DATASET_PATH):
+    # Future of filtered(name, terms, build), built off the script thread
+    key = (name, terms, data_version(path))
+    return _refiner.submit(lambda: _views.lookup(key, build)[0])
+
+
+def cache_stats():
+    # Entries, bytes, budget and hit rate of every memo cache
+    return memo.stats()
+
+
+def load_data(path=data_loader.DATASET_PATH, columns=None):
+    # The frame, holding at least `columns` (None: every column), is None
+    # when the dataset is too large to keep in memory
+    dataset = get_dataset(path, columns)
+    df = dataset.df.copy(deep=False) if dataset.resident else None
+    return df, list(dataset.disease_columns)
+
+
+def load_filter_index(path=data_loader.DATASET_PATH):
+    return get_dataset(path).derived("filter_index", lambda df, _: FilterIndex(df))
+
+
+def load_count_cube(path=data_loader.DATASET_PATH):
+    return get_dataset(path).derived("count_cube", CountCube)
+
+
+def load_age_histogram(path=data_loader.DATASET_PATH):
+    return get_dataset(path).derived("age_histogram", AgeHistogram)
+
+
+def load_daily_counts(path=data_loader.DATASET_PATH):
+    return get_dataset(path).derived("daily_counts", DailyCounts)
+
+
+def load_sample_cube(path=data_loader.DATASET_PATH):
+    return get_dataset(path).derived("sample", SampleCube)
+
+
+def load_correlation_stats(path=data_loader.DATASET_PATH):
+    return get_dataset(path).derived("correlation", CorrelationStats)
+
+
+def load_partitions(path=data_loader.DATASET_PATH):
+    return get_dataset(path).partitions()
+
+
+def _partitions_version(manifest):
+    fingerprint = manifest["fingerprint"]
+    return fingerprint["size"], fingerprint["head"], fingerprint["tail"]
+
+
+def load_in_range(name, factory, dates, path=data_loader.DATASET_PATH):
+    # Aggregate `name` over the admissions between the dates (start, end).
+    # Months the range covers reuse their cached aggregate, months it cuts
+    # are filtered by date, and no other month is opened, so the cost
+    # follows the length of the range rather than of the whole history
+    dataset = get_dataset(path)
+    return _load_in_range(dataset, dataset.partitions(), name, factory, dates)
+
+
+def in_range_loaded(name, dates, path=data_loader.DATASET_PATH):
+    # Whether load_in_range(name, ...) has this range cached
+    manifest = get_dataset(path).partitions()
+    return (name, dates, _partitions_version(manifest)) in _views
+
+
+def refine_in_range(name, factory, dates, path=data_loader.DATASET_PATH):
+    # Future of load_in_range(), built off the script thread
+    dataset = get_dataset(path)
+    return _refiner.submit(_load_in_range, dataset, dataset.partitions(), name, factory, dates)
+
+
+def _load_in_range(dataset, manifest, name, factory, dates):
+    start, end = dates
+    columns = AGGREGATE_COLUMNS.get(name)
+    if columns is not None:
+        columns = columns + [partitions.DATE_COLUMN]
+
+    def month_aggregate(month, entry):
+        bounds = None if partitions.covered(entry, start, end) else dates
+
+        def build():
+            rows = partitions.read_partition(dataset.path, month, entry, columns)
+            if bounds is not None:
+                rows = partitions.between(rows, *bounds)
+            return factory(rows, dataset.disease_columns)
+
+        # Appending rows to one month leaves the others' entries valid
+        value, hit = _views.lookup((name, month, entry["rows"], manifest["fingerprint"]["head"], bounds), build)
+        instrumentation.cache_event("partition_aggregates", hit)
+        return value
+
+    def build():
+        parts = [month_aggregate(month, entry) for month, entry in partitions.overlapping(manifest, start, end)]
+        if not parts:
+            return factory(partitions.rows_in_range(dataset.path, manifest, start, end), dataset.disease_columns)
+        combined = copy.copy(parts[0])
+        for part in parts[1:]:
+            combined.merge(part)
+        return combined
+
+    value, _ = _views.lookup((name, dates, _partitions_version(manifest)), build)
+    return value
+
+
+def load_rows_in_range(dates, columns=None, path=data_loader.DATASET_PATH):
+    # Patient rows admitted between the dates, read from their months only
+    dataset = get_dataset(path)
+    manifest = dataset.partitions()
+    key = ("rows", dates, columns and tuple(columns), _partitions_version(manifest))
+    value, hit = _views.lookup(key, lambda: partitions.rows_in_range(dataset.path, manifest, *dates, columns))
+    instrumentation.cache_event("filtered_views", hit)
+    return value
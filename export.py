@@ -0,0 +1,262 @@
+import argparse
+import contextlib
+import io
+import os
+import secrets
+import sys
+import tempfile
+import threading
+import time
+import weakref
+
+import numpy as np
+
+import data_loader
+from data_loader import DISEASE_COLUMNS, decode_frame
+from filter_index import filter_terms
+
+# Rows decoded and encoded at a time; one Parquet row group each
+EXPORT_ROWS = int(os.environ.get("DASHBOARD_EXPORT_ROWS") or 100_000)
+FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+# Prepared downloads older than this many seconds are removed by the next
+# export, whichever session prepares it
+EXPORT_TTL = float(os.environ.get("DASHBOARD_EXPORT_TTL") or 3600)
+# Largest export a download button serves; the button reads the whole file
+# into the server's memory, unlike a static file link
+DOWNLOAD_BYTES = data_loader.parse_memory_limit(os.environ.get("DASHBOARD_DOWNLOAD_BYTES") or "50M")
+# Streamlit answers 404 for larger static files
+STATIC_FILE_BYTES = 200 << 20
+EXPORT_PREFIX = "dashboard-export-"
+
+
+def matching_rows(df, terms):
+    # Rows of `df` matching every (column, code) filter term
+    mask = np.ones(len(df), dtype=bool)
+    for column, code in terms:
+        mask &= df[column].to_numpy() == code
+    return df[mask]
+
+
+def selected_chunks(df, positions, columns=None, chunk_rows=EXPORT_ROWS):
+    # Decoded frames of the rows at `positions`, chunk_rows at a time; an
+    # empty selection still yields one empty frame carrying the columns
+    positions = positions[positions < len(df)]
+    indexer = df.columns.get_indexer(df.columns if columns is None else columns)
+    for start in range(0, max(len(positions), 1), chunk_rows):
+        yield decode_frame(df.iloc[positions[start : start + chunk_rows], indexer])
+
+
+def filtered_chunks(chunks, terms, columns=None):
+    # Decoded matching rows of each frame in `chunks`, e.g. blocks of a mapped
+    # snapshot or of the CSV itself
+    rows = None
+    for chunk in chunks:
+        rows = matching_rows(chunk, terms)
+        rows = rows if columns is None else rows[columns]
+        if len(rows):
+            yield decode_frame(rows)
+    if rows is not None and not len(rows):
+        yield decode_frame(rows.iloc[:0])
+
+
+def frame_blocks(df, chunk_rows=EXPORT_ROWS):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start : start + chunk_rows]
+
+
+def csv_bytes(frames):
+    header = True
+    for frame in frames:
+        yield frame.to_csv(index=False, header=header).encode()
+        header = False
+
+
+class _Sink(io.RawIOBase):
+    # Write-only file that hands out what was written since the last drain()
+    # while reporting the full offset, which the Parquet footer records
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def parquet_bytes(frames):
+    # pyarrow is only needed for Parquet, so it is imported here
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _Sink()
+    writer = None
+    for frame in frames:
+        # Labels are written as plain strings: the categories of separately
+        # decoded chunks differ, and Parquet dictionary-encodes them anyway
+        categorical = frame.select_dtypes("category").columns
+        table = pa.Table.from_pandas(frame.astype({column: "string" for column in categorical}), preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        else:
+            # e.g. AGE is int16 in one chunk and float32 where one is missing
+            table = table.cast(writer.schema)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+def encode(frames, fmt="csv"):
+    # Bytes of the export, produced one chunk at a time
+    return parquet_bytes(frames) if fmt == "parquet" else csv_bytes(frames)
+
+
+def write_export(frames, target, fmt="csv"):
+    # Streams the chunks into `target`, a path or a binary file; returns the
+    # number of bytes written
+    written = 0
+    with (open(target, "wb") if isinstance(target, str) else contextlib.nullcontext(target)) as f:
+        for data in encode(frames, fmt):
+            f.write(data)
+            written += len(data)
+    return written
+
+
+def export_file(frames, fmt="csv", directory=None):
+    # File in `directory` (default: the temporary directory) holding the
+    # export, for the page to serve. The name is unguessable, as a static
+    # file can be fetched by anyone who knows it
+    prefix = f"{EXPORT_PREFIX}{secrets.token_hex(16)}-"
+    f = tempfile.NamedTemporaryFile(prefix=prefix, suffix=f".{fmt}", dir=directory, delete=False)
+    try:
+        with f:
+            write_export(frames, f, fmt)
+    except BaseException:
+        os.remove(f.name)
+        raise
+    return f.name
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def remove_stale_exports(directory=None, ttl=EXPORT_TTL):
+    # Removes the exports in `directory` written more than `ttl` seconds ago,
+    # e.g. those of sessions that ended without their files being removed
+    directory = directory or tempfile.gettempdir()
+    cutoff = time.time() - ttl
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if name.startswith(EXPORT_PREFIX) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+_sweepers = set()
+_sweepers_lock = threading.Lock()
+
+
+def start_sweeper(directory=None, ttl=EXPORT_TTL):
+    # Runs remove_stale_exports() on `directory` every quarter of the TTL in a
+    # daemon thread, once per directory and process, so the files of ended
+    # sessions go even when nobody exports again
+    directory = directory or tempfile.gettempdir()
+    with _sweepers_lock:
+        if directory in _sweepers:
+            return
+        _sweepers.add(directory)
+
+    def sweep():
+        while True:
+            remove_stale_exports(directory, ttl)
+            time.sleep(max(ttl / 4, 1))
+
+    threading.Thread(target=sweep, name="export-sweeper", daemon=True).start()
+
+
+class PreparedExport:
+    # An export_file() kept in one session's state under the filter `key` it
+    # was prepared for. The file is removed with remove(), when the state is
+    # garbage-collected or when the server exits; start_sweeper() removes
+    # the files of ended sessions, whose state Streamlit may keep for a while
+
+    def __init__(self, key, path):
+        self.key = key
+        self.path = path
+        self._finalizer = weakref.finalize(self, _remove, path)
+
+    def remove(self):
+        self._finalizer()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the patients matching a filter selection.")
+    parser.add_argument("path", nargs="?", default=data_loader.DATASET_PATH)
+    parser.add_argument("--out", default="-", help="output file, '-' for stdout (default)")
+    parser.add_argument("--format", choices=list(FORMATS), help="default: from --out, else csv")
+    parser.add_argument("--sex", default="All", help="code, or 'all' (default)")
+    parser.add_argument("--nationality", default="All", help="code, or 'all' (default)")
+    parser.add_argument("--diseases", default="", help="comma-separated diseases every patient must have")
+    parser.add_argument("--columns", help="comma-separated columns to export (default: all)")
+    parser.add_argument("--chunk-rows", type=int, default=EXPORT_ROWS)
+    parser.add_argument(
+        "--no-snapshot", action="store_true", help="stream the CSV instead of mapping the column snapshot"
+    )
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("parquet" if args.out.endswith(".parquet") else "csv")
+    diseases = [disease.strip().upper() for disease in args.diseases.split(",") if disease.strip()]
+    unknown = sorted(set(diseases) - set(DISEASE_COLUMNS))
+    if unknown:
+        parser.error(f"unknown diseases: {', '.join(unknown)}")
+    terms = filter_terms(
+        "All" if args.sex.lower() == "all" else args.sex,
+        "All" if args.nationality.lower() == "all" else args.nationality,
+        diseases,
+    )
+    header = data_loader.csv_columns(args.path)
+    columns = [column.strip().upper() for column in args.columns.split(",")] if args.columns else header
+    unknown = sorted(set(columns) - set(header))
+    if unknown:
+        parser.error(f"unknown columns: {', '.join(unknown)}")
+    # The filter columns are read too, but only `columns` are written
+    needed = list(dict.fromkeys(columns + [column for column, _ in terms]))
+
+    started = time.perf_counter()
+    if args.no_snapshot:
+        chunks = data_loader.iter_chunks(args.path, chunk_rows=args.chunk_rows, columns=needed)
+    else:
+        # Mapped columns are paged in and out by the OS, so memory stays flat
+        df, _ = data_loader.open_dataset(args.path, columns=needed)
+        chunks = frame_blocks(df, args.chunk_rows)
+    frames = filtered_chunks(chunks, terms, columns)
+    written = write_export(frames, sys.stdout.buffer if args.out == "-" else args.out, fmt)
+    print(f"{written:,} bytes of {fmt} written in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+
+from data_loader import DISEASE_COLUMNS, YES, codes_present
+
+FILTER_COLUMNS = ["SEX", "NATIONALITY"]
+FLAG_COLUMNS = DISEASE_COLUMNS + ["ICU", "INTUBATED"]
+
+# Number of set bits in every possible byte
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+_ALL = "ALL"
+
+
+def filter_terms(sex="All", nationality="All", diseases=()):
+    # Sidebar selections -> sorted (column, code) pairs; "All" adds no term
+    terms = set()
+    if sex != "All":
+        terms.add(("SEX", int(sex)))
+    if nationality != "All":
+        terms.add(("NATIONALITY", int(nationality)))
+    terms.update((disease, YES) for disease in diseases)
+    return tuple(sorted(terms))
+
+
+def _write_bits(buffer, offset, mask):
+    # Pack `mask` into `buffer` starting at bit `offset`, merging the partial byte
+    start, shift = divmod(offset, 8)
+    if shift:
+        mask = np.concatenate([np.unpackbits(buffer[start : start + 1], count=shift), mask])
+    packed = np.packbits(mask)
+    buffer[start : start + len(packed)] = packed
+
+
+class FilterIndex:
+    def __init__(self, df, columns=FILTER_COLUMNS, flag_columns=FLAG_COLUMNS):
+        self.columns = [column for column in columns if column in df.columns]
+        self.flag_columns = [
+            column for column in flag_columns if column in df.columns and column not in self.columns
+        ]
+        self.rows = 0
+        self.bitsets = {}
+        self._codes = {column: set() for column in self.columns}
+        self.extend(df)
+
+    def _masks(self, df):
+        yield _ALL, np.ones(len(df), dtype=bool)
+        for column in self.columns:
+            values = df[column].to_numpy()
+            self._codes[column].update(codes_present(values))
+            for code in self._codes[column]:
+                yield (column, code), values == code
+        for column in self.flag_columns:
+            yield (column, YES), df[column].to_numpy() == YES
+
+    def extend(self, df):
+        # Append the bits of newly ingested rows. Every bitset is written
+        # anew, in whole 64-bit words, so a copy extended by Dataset.refresh()
+        # never changes the arrays sessions still read from the original;
+        # codes seen for the first time get a bitset empty for every earlier row
+        rows = self.rows + len(df)
+        size = -(-rows // 64) * 8
+        self._codes = {column: set(codes) for column, codes in self._codes.items()}
+        bitsets = {}
+        for key, mask in self._masks(df):
+            bitset = np.zeros(size, dtype=np.uint8)
+            if key in self.bitsets:
+                bitset[: len(self.bitsets[key])] = self.bitsets[key]
+            _write_bits(bitset, self.rows, mask)
+            bitsets[key] = bitset
+        self.bitsets = bitsets
+        self.rows = rows
+
+    def __sizeof__(self):
+        # For the byte budget of the caches holding indexes
+        return object.__sizeof__(self) + sum(bitset.nbytes for bitset in self.bitsets.values())
+
+    def codes(self, column):
+        return sorted(self._codes.get(column, []))
+
+    def _words(self, key):
+        return self.bitsets[key][: -(-self.rows // 64) * 8].view(np.uint64)
+
+    def select(self, terms):
+        selection = self._words(_ALL)
+        for term in terms:
+            if term not in self.bitsets:
+                return np.zeros_like(selection)
+            selection = selection & self._words(term)
+        return selection
+
+    def count(self, selection, *terms):
+        if terms:
+            selection = selection & self.select(terms)
+        return int(_POPCOUNT[selection.view(np.uint8)].sum(dtype=np.int64))
+
+    def positions(self, selection):
+        return np.flatnonzero(np.unpackbits(selection.view(np.uint8), count=self.rows))
+
+    def take(self, df, selection):
+        # Rows are only materialized here, when a table or row-level chart needs them.
+        # Rows ingested after `df` was read are skipped
+        positions = self.positions(selection)
+        positions = positions[positions < len(df)]
+        if len(positions) == len(df):
+            return df
+        return df.iloc[positions]
+
+    def order(self, df, selection, sort_by=None, ascending=True):
+        # Positions in `df` of the selected rows in table order: file order,
+        # or stably sorted by one column. Sorting reads only the sort column
+        # of the selected rows; pages cache the result per selection and
+        # order, so flipping through them does not sort again
+        positions = self.positions(selection)
+        positions = positions[positions < len(df)]
+        if sort_by is not None:
+            values = df[sort_by].iloc[positions].reset_index(drop=True)
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.cat.reorder_categories(sorted(values.cat.categories))
+            positions = positions[values.sort_values(ascending=ascending, kind="stable").index.to_numpy()]
+        return positions
+
+    def page(self, df, selection, start, size, sort_by=None, ascending=True, columns=None):
+        # One window of the selected rows for a paginated table
+        return page_rows(df, self.order(df, selection, sort_by, ascending), start, size, columns)
+
+
+def page_rows(df, positions, start, size, columns=None):
+    # Rows positions[start : start + size] of `df`, in that order; only the
+    # window is read from every shown column
+    columns = df.columns if columns is None else columns
+    return df.iloc[positions[start : start + size], df.columns.get_indexer(columns)]
@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+import streamlit as st
+
+import memo
+
+# One JSON line per page rerun is appended here when set
+METRICS_PATH = os.environ.get("DASHBOARD_METRICS")
+# Opening a page with ?debug=1 (or setting this) shows the timings in the sidebar
+DEBUG = bool(os.environ.get("DASHBOARD_DEBUG"))
+# Per-stage peak memory from tracemalloc, which slows every allocation of the
+# server several times over; off unless set, so timings stay representative
+TRACE_MEMORY = bool(os.environ.get("DASHBOARD_TRACE_MEMORY"))
+
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+class Rerun:
+    # Stages of one script run of one page. Each checkpoint() closes the stage
+    # that ran since the previous one: wall time, peak traced memory above the
+    # level at its start, rows and cache hits/misses recorded inside it.
+    # Peak memory comes from tracemalloc and is process-wide: it counts every
+    # session's allocations, and each stage start resets the one peak all
+    # concurrent reruns share, so it is only a guide while sessions overlap
+
+    def __init__(self, page, debug):
+        self.page = page
+        self.debug = debug
+        self.started = time.time()
+        self.stages = []
+        self._begin_stage()
+
+    def _begin_stage(self):
+        self._stage_started = time.perf_counter()
+        self._cache = {}
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self._memory_base = tracemalloc.get_traced_memory()[0]
+
+    def checkpoint(self, name, rows=None):
+        stage = {"name": name, "seconds": time.perf_counter() - self._stage_started}
+        if tracemalloc.is_tracing():
+            stage["peak_bytes"] = max(tracemalloc.get_traced_memory()[1] - self._memory_base, 0)
+        if rows is not None:
+            stage["rows"] = int(rows)
+        if self._cache:
+            stage["cache"] = self._cache
+        self.stages.append(stage)
+        self._begin_stage()
+
+    def cache_event(self, cache, hit):
+        counts = self._cache.setdefault(cache, {"hit": 0, "miss": 0})
+        counts["hit" if hit else "miss"] += 1
+
+    def record(self):
+        return {
+            "time": round(self.started, 3),
+            "page": self.page,
+            "seconds": sum(stage["seconds"] for stage in self.stages),
+            "stages": self.stages,
+        }
+
+
+def start(page):
+    # Called first thing on every page; the rerun lives in the script thread
+    debug = DEBUG or st.experimental_get_query_params().get("debug", ["0"])[0] not in ("", "0")
+    # Only its own variable turns tracing on, never metrics, debug or a
+    # visitor's ?debug=1
+    if TRACE_MEMORY and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _local.rerun = Rerun(page, debug)
+
+
+def checkpoint(name, rows=None):
+    # Everything since the previous checkpoint is recorded as stage `name`
+    rerun = getattr(_local, "rerun", None)
+    if rerun is not None:
+        rerun.checkpoint(name, rows)
+
+
+def cache_event(cache, hit):
+    # Caches report lookups here; outside a page rerun this does nothing
+    rerun = getattr(_local, "rerun", None)
+    if rerun is not None:
+        rerun.cache_event(cache, hit)
+
+
+def finish():
+    # Called last on every page: appends the metrics line and draws the panel
+    rerun = getattr(_local, "rerun", None)
+    if rerun is None:
+        return
+    _local.rerun = None
+    record = rerun.record()
+    if METRICS_PATH:
+        with _write_lock, open(METRICS_PATH, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    if rerun.debug:
+        with st.sidebar.expander("Timings", expanded=True):
+            st.write(f"Rerun: {record['seconds'] * 1000:.1f} ms")
+            st.dataframe(stage_table(record["stages"]), use_container_width=True)
+            if tracemalloc.is_tracing():
+                st.caption("Peak memory is process-wide: it includes other sessions' allocations.")
+            else:
+                st.caption("Peak memory is traced only with DASHBOARD_TRACE_MEMORY set.")
+            st.write("Caches:")
+            st.dataframe(pd.DataFrame(memo.stats()).T, use_container_width=True)
+
+
+def stage_table(stages):
+    rows = []
+    for stage in stages:
+        cache = stage.get("cache", {})
+        rows.append({
+            "stage": stage["name"],
+            "ms": round(stage["seconds"] * 1000, 1),
+            "peak MB": round(stage["peak_bytes"] / 2**20, 1) if "peak_bytes" in stage else None,
+            "rows": stage.get("rows"),
+            "cache": " ".join(
+                f"{name} {counts['hit']}/{counts['hit'] + counts['miss']}" for name, counts in cache.items()
+            ),
+        })
+    return pd.DataFrame(rows).set_index("stage")
+
+
+def summarize(path):
+    # p50/p95/p99 milliseconds per page for whole reruns and for each stage
+    rows = []
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            rows.append((record["page"], "(rerun)", record["seconds"]))
+            rows.extend((record["page"], stage["name"], stage["seconds"]) for stage in record["stages"])
+    timings = pd.DataFrame(rows, columns=["page", "stage", "seconds"])
+    grouped = timings.groupby(["page", "stage"], sort=False)["seconds"]
+    summary = grouped.quantile([0.5, 0.95, 0.99]).unstack() * 1000
+    summary.columns = ["p50 ms", "p95 ms", "p99 ms"]
+    summary.insert(0, "reruns", grouped.size())
+    return summary.round(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize the rerun latencies in a metrics file.")
+    parser.add_argument("path", nargs="?", default=METRICS_PATH or "metrics.jsonl")
+    args = parser.parse_args(argv)
+    with pd.option_context("display.width", 120, "display.max_rows", None):
+        print(summarize(args.path))
+
+
+if __name__ == "__main__":
+    main()
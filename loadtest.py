@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import pandas as pd
+from streamlit import source_util
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tornado.websocket import WebSocketClosedError, websocket_connect
+
+import instrumentation
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+# Widgets a session changes between reruns; buttons, dates, numbers and free
+# text keep their defaults
+WIDGET_TYPES = ("selectbox", "multiselect", "radio", "slider", "checkbox")
+# Most options picked at once in a multiselect, e.g. diseases to filter by
+MAX_SELECTED = 3
+
+
+def rss_bytes(pid):
+    # Resident memory of process `pid`, or None where /proc is missing
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, metrics=None, trace_memory=False, timeout=60):
+    # `streamlit run main.py` in the working directory, where the pages look
+    # for the dataset; returns once the server answers its health check.
+    # Memory tracing slows the whole server, so it is on only when asked for,
+    # never inherited from this process's environment
+    env = dict(os.environ)
+    env.pop("DASHBOARD_TRACE_MEMORY", None)
+    if metrics:
+        env["DASHBOARD_METRICS"] = metrics
+    if trace_memory:
+        env["DASHBOARD_TRACE_MEMORY"] = "1"
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "streamlit", "run", MAIN_SCRIPT,
+            "--server.headless", "true",
+            "--server.port", str(port),
+            "--browser.gatherUsageStats", "false",
+        ],
+        env=env,
+        # Page errors reach the sessions as exception elements; the server's
+        # own log would only bury the summary
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"streamlit exited with status {server.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://localhost:{port}/_stcore/health", timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"streamlit did not start within {timeout:.0f}s")
+
+
+def widget_state(widget_id, kind, proto, rng, current):
+    # A random new value for one widget, as the browser would send it:
+    # choices travel as option positions, sliders as a list of numbers
+    state = WidgetState(id=widget_id)
+    if kind in ("selectbox", "radio"):
+        state.int_value = rng.randrange(len(proto.options))
+    elif kind == "multiselect":
+        count = rng.randint(0, min(MAX_SELECTED, len(proto.options)))
+        state.int_array_value.data[:] = sorted(rng.sample(range(len(proto.options)), count))
+    elif kind == "slider":
+        steps = int(round((proto.max - proto.min) / proto.step))
+        state.double_array_value.data[:] = [proto.min + rng.randint(0, steps) * proto.step for _ in proto.default]
+    else:
+        state.bool_value = not (current.bool_value if current is not None else proto.default)
+    return state
+
+
+class Session:
+    # One simulated browser tab on one page: a websocket to the server, the
+    # widgets its last run drew and the values picked for them so far, which
+    # are sent with every rerun as the browser does
+
+    def __init__(self, url, page_hash, rng, timeout):
+        self.url = url
+        self.page_hash = page_hash
+        self.rng = rng
+        self.timeout = timeout
+        self.connection = None
+        self.widgets = {}
+        self.states = {}
+
+    async def connect(self):
+        self.connection = await websocket_connect(self.url, subprotocols=["streamlit"])
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+    def change_widget(self):
+        # Changes one randomly chosen widget, as a user would between reruns
+        if self.widgets:
+            widget_id = self.rng.choice(list(self.widgets))
+            kind, proto = self.widgets[widget_id]
+            self.states[widget_id] = widget_state(widget_id, kind, proto, self.rng, self.states.get(widget_id))
+
+    async def run(self):
+        # Asks for a rerun and reads the server's messages until the script
+        # finishes; returns the first exception the page showed, or None
+        msg = BackMsg()
+        msg.rerun_script.page_script_hash = self.page_hash
+        msg.rerun_script.widget_states.widgets.extend(self.states.values())
+        await self.connection.write_message(msg.SerializeToString(), binary=True)
+
+        self.widgets = {}
+        error = None
+        while True:
+            payload = await asyncio.wait_for(self.connection.read_message(), self.timeout)
+            if payload is None:
+                raise ConnectionError("the server closed the connection")
+            message = ForwardMsg()
+            message.ParseFromString(payload)
+            kind = message.WhichOneof("type")
+            if kind == "script_finished":
+                if message.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    return error
+            elif kind == "page_not_found":
+                raise LookupError(f"page {message.page_not_found.page_name!r} not found")
+            elif kind == "delta" and message.delta.WhichOneof("type") == "new_element":
+                element = message.delta.new_element
+                element_type = element.WhichOneof("type")
+                if element_type in WIDGET_TYPES:
+                    proto = getattr(element, element_type)
+                    if element_type != "slider" or proto.data_type in (proto.INT, proto.FLOAT):
+                        self.widgets[proto.id] = (element_type, proto)
+                elif element_type == "exception" and error is None:
+                    error = f"{element.exception.type}: {element.exception.message}"
+
+
+async def drive(url, page, number, reruns, seed, think, timeout, records):
+    # The first load of the page, then `reruns` reruns each changing one
+    # widget after a random pause of up to `think` seconds
+    rng = random.Random(f"{seed}-{page['page_name']}-{number}")
+    session = Session(url, page["page_script_hash"], rng, timeout)
+    try:
+        await session.connect()
+        for rerun in range(reruns + 1):
+            if rerun:
+                await asyncio.sleep(rng.uniform(0, think))
+                session.change_widget()
+            started = time.perf_counter()
+            try:
+                error = await session.run()
+                lost = False
+            except (OSError, LookupError, WebSocketClosedError, asyncio.TimeoutError) as e:
+                error = f"{type(e).__name__}: {e}"
+                lost = True
+            records.append({
+                "page": page["page_name"],
+                "session": number,
+                "rerun": rerun,
+                "seconds": time.perf_counter() - started,
+                "error": error,
+            })
+            if lost:
+                break
+    finally:
+        session.close()
+
+
+async def load_page(url, page, sessions, reruns, seed, think, timeout, records):
+    await asyncio.gather(*(
+        drive(url, page, number, reruns, seed, think, timeout, records) for number in range(sessions)
+    ))
+
+
+def run_load(url, pages, sessions, reruns, seed=0, think=0.0, timeout=120, pid=None):
+    # Drives each page in turn with `sessions` concurrent sessions. Returns
+    # a record per script run and a (page, RSS before, RSS after, seconds)
+    # row per page, RSS being the server's when its `pid` is known
+    records = []
+    phases = []
+    for page in pages:
+        before = rss_bytes(pid) if pid else None
+        started = time.perf_counter()
+        asyncio.run(load_page(url, page, sessions, reruns, seed, think, timeout, records))
+        after = rss_bytes(pid) if pid else None
+        phases.append((page["page_name"], before, after, time.perf_counter() - started))
+    return records, phases
+
+
+def summarize(records, phases):
+    # Per page: p50/p95/p99 rerun latency, reruns served per second and the
+    # server's resident memory after the page and growth while serving it.
+    # First loads are left out of the latencies, reruns are what users wait on
+    runs = pd.DataFrame(records, columns=["page", "session", "rerun", "seconds", "error"])
+    reruns = runs[runs["rerun"] > 0]
+    grouped = reruns.groupby("page", sort=False)["seconds"]
+    summary = grouped.quantile([0.5, 0.95, 0.99]).unstack() * 1000
+    summary.columns = ["p50 ms", "p95 ms", "p99 ms"]
+    summary.insert(0, "reruns", grouped.size())
+    summary.insert(1, "errors", runs.groupby("page", sort=False)["error"].count())
+
+    memory = pd.DataFrame(phases, columns=["page", "rss_before", "rss_after", "seconds"]).set_index("page")
+    summary["reruns/s"] = summary["reruns"] / memory["seconds"]
+    summary["RSS MB"] = memory["rss_after"] / 2**20
+    summary["RSS growth MB"] = (memory["rss_after"] - memory["rss_before"]) / 2**20
+    return summary.round(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load-test the pages with concurrent headless sessions changing random filters."
+    )
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent sessions per page")
+    parser.add_argument("--reruns", type=int, default=20, help="widget changes per session")
+    parser.add_argument("--pages", help="comma-separated substrings of the pages to drive (default: all)")
+    parser.add_argument("--think", type=float, default=0.0, help="most seconds a session waits between reruns")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120, help="seconds one script run may take")
+    parser.add_argument("--url", help="server to drive, e.g. http://localhost:8501 (default: start one)")
+    parser.add_argument("--metrics", help="keep the started server's stage timings in this file")
+    parser.add_argument("--records", help="write every script run as CSV here")
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="add per-stage peak memory to the started server's stage timings; slows every rerun several times",
+    )
+    args = parser.parse_args(argv)
+
+    pages = list(source_util.get_pages(MAIN_SCRIPT).values())
+    if args.pages:
+        wanted = [part.strip().lower() for part in args.pages.split(",") if part.strip()]
+        pages = [page for page in pages if any(part in page["page_name"].lower() for part in wanted)]
+        if not pages:
+            parser.error(f"no page matches {args.pages!r}")
+
+    server = None
+    metrics = None
+    if args.url:
+        url = args.url.rstrip("/")
+    else:
+        metrics = args.metrics or tempfile.NamedTemporaryFile(prefix="metrics-", suffix=".jsonl", delete=False).name
+        port = free_port()
+        server = start_server(port, metrics, args.trace_memory)
+        url = f"http://localhost:{port}"
+    try:
+        started = time.perf_counter()
+        records, phases = run_load(
+            url.replace("http", "ws", 1) + "/_stcore/stream",
+            pages,
+            args.sessions,
+            args.reruns,
+            args.seed,
+            args.think,
+            args.timeout,
+            server.pid if server else None,
+        )
+        elapsed = time.perf_counter() - started
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    with pd.option_context("display.width", 120, "display.max_columns", None):
+        print(summarize(records, phases))
+    print(f"{len(records)} script runs in {elapsed:.1f}s: {len(records) / elapsed:.1f} runs/s")
+    failed = [record for record in records if record["error"]]
+    for record in failed[:5]:
+        print(f"error on {record['page']} (session {record['session']}, run {record['rerun']}): {record['error']}")
+    if args.records:
+        pd.DataFrame(records).to_csv(args.records, index=False)
+    if metrics and os.path.getsize(metrics):
+        # Where the server spent each rerun, from the pages' own checkpoints
+        with pd.option_context("display.width", 120, "display.max_rows", None):
+            print(instrumentation.summarize(metrics))
+    if metrics and not args.metrics:
+        os.remove(metrics)
+    if failed:
+        parser.exit(1, f"{len(failed)} of {len(records)} script runs failed\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,94 +1,60 @@
+import os
+
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-
-
-
-# Load the dataset
-@st.cache_data
-def load_data():
-    df = pd.read_csv("dataset.csv")
-    df.columns = map(str.upper, df.columns)
-
-    # Convert and map categorical values
-    mapping = {
-        "SEX": {1: "FEMALE", 2: "MALE", 99: "UNKNOWN"},
-        "HOSPITALIZED": {
-            1: "YES",
-            2: "NO",
-            97: "DOES NOT APPLY",
-            98: "IGNORED",
-            99: "UNKNOWN",
-        },
-        "INTUBATED": {
-            1: "YES",
-            2: "NO",
-            97: "DOES NOT APPLY",
-            98: "IGNORED",
-            99: "UNKNOWN",
-        },
-        "PREGNANCY": {
-            1: "YES",
-            2: "NO",
-            97: "DOES NOT APPLY",
-            98: "IGNORED",
-            99: "UNKNOWN",
-        },
-        "SPEAKS_NATIVE_LANGUAGE": {
-            1: "YES",
-            2: "NO",
-            97: "DOES NOT APPLY",
-            98: "IGNORED",
-            99: "UNKNOWN",
-        },
-        "TOBACCO": {
-            1: "YES",
-            2: "NO",
-            97: "DOES NOT APPLY",
-            98: "IGNORED",
-            99: "UNKNOWN",
-        },
-        "ANOTHER CASE": {
-            1: "YES",
-            2: "NO",
-            97: "DOES NOT APPLY",
-            98: "IGNORED",
-            99: "UNKNOWN",
-        },
-        "ICU": {1: "YES", 2: "NO", 97: "DOES NOT APPLY", 98: "IGNORED", 99: "UNKNOWN"},
-        "OUTCOME": {1: "POSITIVE", 2: "NEGATIVE", 97: "PENDING"},
-        "NATIONALITY": {1: "MEXICAN", 2: "FOREIGN", 97: "UNKNOWN"},
-    }
-
-    disease_columns = [
-        "DIABETES",
-        "COPD",
-        "ASTHMA",
-        "INMUSUPR",
-        "HYPERTENSION",
-        "PNEUMONIA",
-        "CARDIOVASCULAR",
-        "OBESITY",
-        "CHRONIC_KIDNEY",
-        "TOBACCO",
-        "OTHER_DISEASE",
-    ]
-
-    for column, map_values in mapping.items():
-        if column in df.columns:
-            df[column] = pd.to_numeric(df[column], errors="coerce")
-            df[column] = df[column].map(map_values)
-
-    for column in disease_columns:
-        if column in df.columns:
-            df[column] = df[column].map(
-                {1: "YES", 2: "NO", 97: "N/A", 98: "IGNORED", 99: "UNKNOWN"}
-            )
 
-    return df, disease_columns
+import instrumentation
+from age_histogram import AGE_SCHEMES, AgeHistogram, age_bands, bin_counts, parse_edges
+from count_cube import CountCube
+from data_loader import (
+    DATASET_PATH,
+    DISEASE_COLUMNS,
+    csv_columns,
+    decode_frame,
+    dictionary_codes,
+    format_option,
+    iter_chunks,
+)
+from dataset import (
+    APPROXIMATE,
+    data_version,
+    filtered,
+    in_range_loaded,
+    load_age_histogram,
+    load_count_cube,
+    load_data,
+    load_filter_index,
+    load_in_range,
+    load_partitions,
+    load_rows_in_range,
+    load_sample_cube,
+    refine_in_range,
+    warm_up,
+)
+from export import (
+    DOWNLOAD_BYTES,
+    FORMATS,
+    STATIC_FILE_BYTES,
+    PreparedExport,
+    export_file,
+    filtered_chunks,
+    remove_stale_exports,
+    selected_chunks,
+    start_sweeper,
+)
+from filter_index import FilterIndex, filter_terms, page_rows
+from partitions import admission_span, date_range
+
+PAGE_SIZES = [25, 50, 100, 500]
+# Exports are linked from here when static serving is on
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "exports")
+# The results table can show any column
+COLUMNS = None
 
+instrumentation.start("main")
 
-df, disease_columns = load_data()
+# The dataset loads in the background while the filters are drawn; their
+# options come from the data dictionary, not the data
+warm_up(columns=COLUMNS)
 
 st.title("COVID-19 Cases Data Dashboard")
 
@@ -98,55 +64,187 @@ column1, column2 = st.columns(2)
 # Filter by Sex
 with column1:
     sex_filter = st.selectbox(
-        "Filter by Sex:", ["All"] + list(df["SEX"].dropna().unique())
+        "Filter by Sex:",
+        ["All"] + dictionary_codes("SEX"),
+        format_func=format_option("SEX"),
     )
-    if sex_filter != "All":
-        df = df[df["SEX"] == sex_filter]
 
 # Filter by Nationality
 with column2:
     nationality_filter = st.selectbox(
-        "Filter by Nationality:", ["All"] + list(df["NATIONALITY"].dropna().unique())
+        "Filter by Nationality:",
+        ["All"] + dictionary_codes("NATIONALITY"),
+        format_func=format_option("NATIONALITY"),
     )
-    if nationality_filter != "All":
-        df = df[df["NATIONALITY"] == nationality_filter]
 
 # Filter by Disease
-selected_diseases = st.multiselect("Filter by Disease:", disease_columns)
-if selected_diseases:
-    for disease in selected_diseases:
-        df = df[df[disease] == "YES"]
+selected_diseases = st.multiselect("Filter by Disease:", DISEASE_COLUMNS)
+approximate = st.checkbox(
+    "Fast approximate mode",
+    value=APPROXIMATE,
+    help="For a new admission date range, show the age analysis estimated from a stratified sample first, then swap in exact numbers.",
+)
 
-# Display filtered results
-if not df.empty:
-    st.write("### Filtered Results:")
-    st.dataframe(df)
+terms = filter_terms(sex_filter, nationality_filter, selected_diseases)
+
+# Wait for the dataset
+df, _ = load_data(columns=COLUMNS)
+
+# Admission date range, bounded by the span of the month partitions
+manifest = load_partitions()
+span = manifest and admission_span(manifest)
+dates = None
+if span:
+    picked = st.sidebar.date_input("Admission date:", value=span, min_value=span[0], max_value=span[1])
+    dates = date_range(picked, span)
+# Key of everything cached for this selection
+view = terms if dates is None else (terms, dates)
+
+# Fast mode sums the age histogram of a new date range in the background
+# while the results below are built; the whole histogram is filtered in a
+# few milliseconds, no faster from the sample
+pending = None
+if dates is None:
+    index = load_filter_index()
+    cube = load_count_cube()
+    ages = load_age_histogram()
 else:
+    # Only the admission months the range overlaps are opened; their rows
+    # get an index of their own
+    df = load_rows_in_range(dates, COLUMNS)
+    index = filtered("index", dates, lambda: FilterIndex(df))
+    cube = load_in_range("count_cube", CountCube, dates)
+    if approximate and not in_range_loaded("age_histogram", dates):
+        pending = refine_in_range("age_histogram", AgeHistogram, dates)
+    else:
+        ages = load_in_range("age_histogram", AgeHistogram, dates)
+instrumentation.checkpoint("load_data")
+
+# Cases per year of age are summed once per filter selection; any band
+# layout is then a few lookups into their running totals
+cells = filtered("cells", view, lambda: cube.select(terms))
+instrumentation.checkpoint("filter", rows=cube.total(cells))
+
+
+def export_section(frames, columns):
+    # The whole selection, not just the page shown: frames() yields it a chunk
+    # at a time into a file. With static serving on (.streamlit/config.toml)
+    # the file is linked from static/exports and streamed from disk;
+    # otherwise a download button serves it, which holds it in memory, so
+    # only small exports get one
+    serve_static = st.get_option("server.enableStaticServing")
+    directory = EXPORT_DIR if serve_static else None
+    start_sweeper(directory)
+    with st.expander("Export"):
+        export_format = st.radio("Format:", list(FORMATS), horizontal=True)
+        export_key = (view, tuple(columns), export_format, data_version())
+        if st.button("Prepare export"):
+            previous = st.session_state.pop("export", None)
+            if previous is not None:
+                previous.remove()
+            if directory is not None:
+                os.makedirs(directory, exist_ok=True)
+            remove_stale_exports(directory)
+            try:
+                st.session_state["export"] = PreparedExport(export_key, export_file(frames(), export_format, directory))
+            except ImportError:
+                st.error("Parquet export needs pyarrow; choose CSV instead.")
+            instrumentation.checkpoint("export")
+        exported = st.session_state.get("export")
+        if exported is not None and exported.key == export_key and os.path.exists(exported.path):
+            size = os.path.getsize(exported.path)
+            label = f"Download {export_format.upper()} ({size / 2**20:,.1f} MB)"
+            if serve_static and size <= STATIC_FILE_BYTES:
+                url = f"app/static/exports/{os.path.basename(exported.path)}"
+                st.markdown(
+                    f'<a href="{url}" download="patients.{export_format}">{label}</a>', unsafe_allow_html=True
+                )
+            elif size <= DOWNLOAD_BYTES:
+                with open(exported.path, "rb") as f:
+                    st.download_button(label, f, file_name=f"patients.{export_format}", mime=FORMATS[export_format])
+            else:
+                st.warning(
+                    f"This export is {size / 2**20:,.0f} MB, too large to download from the page; "
+                    "run `python export.py` with the same filters instead."
+                )
+
+
+# Display filtered results
+if not cube.total(cells):
     st.warning("No data found for the selected filters.")
+elif df is None:
+    st.info("This dataset is too large to keep patient rows in memory; the counts below cover every matching patient.")
+    # The export streams the matching rows from the CSV instead
+    export_section(lambda: filtered_chunks(iter_chunks(DATASET_PATH), terms), csv_columns())
+else:
+    # Resolve all filters at once on the bitmap index; only the visible page
+    # of rows is decoded and sent to the browser
+    selection = filtered("selection", view, lambda: index.select(terms))
+    total_rows = index.count(selection)
+    st.write(f"### Filtered Results: {total_rows:,} patients")
+
+    grid1, grid2, grid3, grid4 = st.columns(4)
+    with grid1:
+        sort_column = st.selectbox(
+            "Sort by:",
+            [None] + list(df.columns),
+            format_func=lambda x: "(file order)" if x is None else x,
+        )
+    with grid2:
+        sort_order = st.selectbox("Order:", ["Ascending", "Descending"])
+    with grid3:
+        page_size = st.selectbox("Rows per page:", PAGE_SIZES)
+    page_count = max(1, -(-total_rows // page_size))
+    with grid4:
+        page_number = st.number_input("Page:", min_value=1, max_value=page_count, value=1)
+
+    with st.expander("Columns"):
+        shown_columns = st.multiselect("Show columns:", list(df.columns), default=list(df.columns))
+
+    # The selection is sorted once per order and data version; turning the
+    # page only reads the next window of rows
+    ascending = sort_order == "Ascending"
+    order = filtered(
+        "order", (view, sort_column, ascending), lambda: index.order(df, selection, sort_column, ascending)
+    )
+    rows = page_rows(df, order, (page_number - 1) * page_size, page_size, shown_columns)
+    st.dataframe(decode_frame(rows))
+    st.caption(f"Page {page_number:,} of {page_count:,}")
+    instrumentation.checkpoint("results_table", rows=len(rows))
+
+    export_section(lambda: selected_chunks(df, index.positions(selection), shown_columns), shown_columns)
 
 # Age Group Analysis
 st.title("COVID-19 Age Group Analysis")
 
-# Define age bins and labels
-bins = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
-labels = [
-    "0-10",
-    "11-20",
-    "21-30",
-    "31-40",
-    "41-50",
-    "51-60",
-    "61-70",
-    "71-80",
-    "81-90",
-    "91-100",
-]
-
-# Categorize AGE into bins
-df["Age Group"] = pd.cut(df["AGE"], bins=bins, labels=labels, right=True)
-
-# Count cases per age group
-age_distribution = df["Age Group"].value_counts().sort_index()
+# Age bands: a preset or edges typed by the user
+scheme_column, edges_column = st.columns(2)
+with scheme_column:
+    scheme = st.selectbox("Age bands:", list(AGE_SCHEMES) + ["Custom"])
+edges = AGE_SCHEMES.get(scheme)
+if edges is None:
+    with edges_column:
+        text = st.text_input("Band edges (years):", "0, 18, 40, 65, 80")
+    try:
+        edges = parse_edges(text)
+    except ValueError as e:
+        st.error(f"{e}; showing decades instead.")
+        edges = AGE_SCHEMES["Decades"]
+
+# Still summing: estimate from the stratified sample meanwhile
+sample = None
+if pending is not None and not pending.done():
+    sample = filtered("sample", dates, lambda: load_sample_cube().in_range(dates))
+    sample_cells = filtered("sample_age_cells", view, lambda: sample.select_ages(terms))
+    age_distribution = bin_counts(
+        filtered("sample_age_cumulative", view, lambda: sample.cumulative(sample_cells)), edges
+    )
+else:
+    if pending is not None:
+        ages = pending.result()
+    cumulative = filtered("age_cumulative", view, lambda: ages.cumulative(ages.select(terms)))
+    age_distribution = bin_counts(cumulative, edges)
+instrumentation.checkpoint("age_binning")
 
 # Create two columns for the analysis
 col1, col2 = st.columns(2)
@@ -154,35 +252,64 @@ col1, col2 = st.columns(2)
 with col1:
     st.subheader("Interactive Age Group Selection")
     # Dropdown for age group selection with counts
+    marker = "~" if sample is not None else ""
     selected_group = st.selectbox(
         "Select an Age Group:",
-        options=labels,
-        format_func=lambda x: f"{x} ({age_distribution.get(x, 0)} cases)",
+        options=list(age_distribution.index),
+        format_func=lambda x: f"{x} ({marker}{age_distribution.get(x, 0)} cases)",
     )
-
-    # Show detailed statistics for selected group
-    if selected_group in age_distribution.index:
-        total_cases = age_distribution.sum()
-        group_cases = age_distribution[selected_group]
-        percentage = (group_cases / total_cases) * 100
-
-        st.metric(
-            label=f"Cases in {selected_group}",
-            value=f"{group_cases:,}",
-            delta=f"{percentage:.1f}% of total",
-        )
-    else:
-        st.warning(f"No cases found in age group {selected_group}")
+    group_area = st.empty()
 
 with col2:
     st.subheader("Most Affected Age Groups")
-    # Show top 3 most affected age groups
-    top_3_groups = age_distribution.nlargest(3)
-    for age_group, count in top_3_groups.items():
-        percentage = (count / age_distribution.sum()) * 100
-        st.metric(
-            label=f"#{list(top_3_groups.index).index(age_group) + 1}: {age_group}",
-            value=f"{count:,} cases",
-            delta=f"{percentage:.1f}% of total",
-        )
+    top_area = st.empty()
+
+
+def draw_ages(age_distribution, estimate):
+    # Fills the metrics below the dropdown; estimates are marked and show the
+    # 95% confidence interval of their share
+    marker = "~" if estimate else ""
+
+    def interval(age_group):
+        if estimate:
+            band = age_bands(sample_cells["AGE"], edges) == age_distribution.index.get_loc(age_group)
+            _, low, high = sample.share(sample_cells, band)
+            st.caption(f"95% CI: {low * 100:.1f}% to {high * 100:.1f}% of total")
+
+    with group_area.container():
+        # Show detailed statistics for selected group
+        if selected_group in age_distribution.index:
+            total_cases = age_distribution.sum()
+            group_cases = age_distribution[selected_group]
+            percentage = (group_cases / total_cases) * 100
+
+            st.metric(
+                label=f"Cases in {selected_group}",
+                value=f"{marker}{group_cases:,}",
+                delta=f"{percentage:.1f}% of total",
+            )
+            interval(selected_group)
+        else:
+            st.warning(f"No cases found in age group {selected_group}")
+
+    with top_area.container():
+        # Show top 3 most affected age groups
+        top_3_groups = age_distribution.nlargest(3)
+        for age_group, count in top_3_groups.items():
+            percentage = (count / age_distribution.sum()) * 100
+            st.metric(
+                label=f"#{list(top_3_groups.index).index(age_group) + 1}: {age_group}",
+                value=f"{marker}{count:,} cases",
+                delta=f"{percentage:.1f}% of total",
+            )
+            interval(age_group)
+
 
+draw_ages(age_distribution, estimate=sample is not None)
+if sample is not None:
+    instrumentation.checkpoint("sample_age_metrics")
+    ages = pending.result()
+    cumulative = filtered("age_cumulative", view, lambda: ages.cumulative(ages.select(terms)))
+    draw_ages(bin_counts(cumulative, edges), estimate=False)
+instrumentation.checkpoint("age_metrics")
+instrumentation.finish()
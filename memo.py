@@ -0,0 +1,82 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+_caches = {}
+
+
+def nbytes(value):
+    # Estimated bytes held by a cached value
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(nbytes(k) + nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(nbytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    # Values built on demand and kept, least recently used first out, while
+    # their estimated bytes fit the budget. Shared by every thread, so every
+    # session of a server process reuses what any of them built
+
+    def __init__(self, name, budget):
+        self.name = name
+        self.budget = budget
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        _caches[name] = self
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def lookup(self, key, build):
+        # Returns (value, hit); build() runs outside the lock, so two sessions
+        # missing the same key at once may both build it
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0], True
+            self.misses += 1
+        value = build()
+        size = nbytes(value)
+        with self._lock:
+            if size <= self.budget and key not in self._entries:
+                self._entries[key] = (value, size)
+                self.bytes += size
+                while self.bytes > self.budget:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self.bytes -= evicted
+        return value, False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "budget": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+
+def stats():
+    return {name: cache.stats() for name, cache in _caches.items()}
@@ -1,64 +1,62 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import plotly.express as px
+
+import instrumentation
+from age_histogram import AGE_SCHEMES, AgeHistogram, bin_counts, parse_edges
+from charts import cached_figure, express
+from count_cube import CountCube
+from data_loader import DISEASE_COLUMNS, MISSING_CODE, YES, decode_counts, dictionary_codes, format_option, label
+from dataset import (
+    APPROXIMATE,
+    data_version,
+    filtered,
+    in_range_loaded,
+    load_age_histogram,
+    load_count_cube,
+    load_in_range,
+    load_partitions,
+    load_sample_cube,
+    refine_in_range,
+    warm_up,
+)
+from filter_index import filter_terms
+from partitions import admission_span, date_range
+
+# Every tab is drawn from the count cube and the age histogram
+COLUMNS = ["SEX", "NATIONALITY", "OUTCOME", "ICU", "INTUBATED", "DATE_OF_DEATH", "AGE"] + DISEASE_COLUMNS
 
 st.set_page_config(page_title="COVID-19 Analysis Dashboard", layout="wide")
+instrumentation.start("dashboard")
 
-# Load the dataset
-@st.cache_data
-def load_data():
-    df = pd.read_csv("dataset.csv")
-    df.columns = map(str.upper, df.columns)
-
-    # Convert and map categorical values
-    mapping = {
-        "SEX": {1: "FEMALE", 2: "MALE", 99: "UNKNOWN"},
-        "HOSPITALIZED": {1: "YES", 2: "NO", 97: "DOES NOT APPLY", 98: "IGNORED", 99: "UNKNOWN"},
-        "INTUBATED": {1: "YES", 2: "NO", 97: "DOES NOT APPLY", 98: "IGNORED", 99: "UNKNOWN"},
-        "PREGNANCY": {1: "YES", 2: "NO", 97: "DOES NOT APPLY", 98: "IGNORED", 99: "UNKNOWN"},
-        "SPEAKS_NATIVE_LANGUAGE": {1: "YES", 2: "NO", 97: "DOES NOT APPLY", 98: "IGNORED", 99: "UNKNOWN"},
-        "TOBACCO": {1: "YES", 2: "NO", 97: "DOES NOT APPLY", 98: "IGNORED", 99: "UNKNOWN"},
-        "ANOTHER CASE": {1: "YES", 2: "NO", 97: "DOES NOT APPLY", 98: "IGNORED", 99: "UNKNOWN"},
-        "ICU": {1: "YES", 2: "NO", 97: "DOES NOT APPLY", 98: "IGNORED", 99: "UNKNOWN"},
-        "OUTCOME": {1: "POSITIVE", 2: "NEGATIVE", 97: "PENDING"},
-        "NATIONALITY": {1: "MEXICAN", 2: "FOREIGN", 97: "UNKNOWN"},
-    }
-
-    disease_columns = [
-        "DIABETES", "COPD", "ASTHMA", "INMUSUPR", "HYPERTENSION",
-        "PNEUMONIA", "CARDIOVASCULAR", "OBESITY", "CHRONIC_KIDNEY",
-        "TOBACCO", "OTHER_DISEASE",
-    ]
-
-    for column, map_values in mapping.items():
-        if column in df.columns:
-            df[column] = pd.to_numeric(df[column], errors="coerce")
-            df[column] = df[column].map(map_values)
-
-    for column in disease_columns:
-        if column in df.columns:
-            df[column] = df[column].map({1: "YES", 2: "NO", 97: "N/A", 98: "IGNORED", 99: "UNKNOWN"})
-
-    return df, disease_columns
-
-df, disease_columns = load_data()
+# The dataset loads in the background while the filters and tabs are drawn;
+# filter options come from the data dictionary, not the data
+warm_up(columns=COLUMNS)
 
 # Sidebar for global filters
 st.sidebar.title("Global Filters")
-sex_filter = st.sidebar.selectbox("Filter by Sex:", ["All"] + list(df["SEX"].dropna().unique()))
-nationality_filter = st.sidebar.selectbox("Filter by Nationality:", ["All"] + list(df["NATIONALITY"].dropna().unique()))
-selected_diseases = st.sidebar.multiselect("Filter by Disease:", disease_columns)
+sex_filter = st.sidebar.selectbox(
+    "Filter by Sex:", ["All"] + dictionary_codes("SEX"), format_func=format_option("SEX")
+)
+nationality_filter = st.sidebar.selectbox(
+    "Filter by Nationality:",
+    ["All"] + dictionary_codes("NATIONALITY"),
+    format_func=format_option("NATIONALITY"),
+)
+selected_diseases = st.sidebar.multiselect("Filter by Disease:", DISEASE_COLUMNS)
+# Filled once the admission span is known
+date_area = st.sidebar.container()
+
+# Fast mode draws every tab from the stratified sample while the counts of
+# a new date range are summed in the background, then draws them exactly
+approximate = st.sidebar.checkbox(
+    "Fast approximate mode",
+    value=APPROXIMATE,
+    help="Show estimates from a stratified sample first, then swap in exact numbers.",
+)
+status = st.sidebar.empty()
 
 # Apply filters
-filtered_df = df.copy()
-if sex_filter != "All":
-    filtered_df = filtered_df[filtered_df["SEX"] == sex_filter]
-if nationality_filter != "All":
-    filtered_df = filtered_df[filtered_df["NATIONALITY"] == nationality_filter]
-if selected_diseases:
-    for disease in selected_diseases:
-        filtered_df = filtered_df[filtered_df[disease] == "YES"]
+terms = filter_terms(sex_filter, nationality_filter, selected_diseases)
 
 # Main content
 st.title("COVID-19 Analysis Dashboard")
@@ -72,150 +70,256 @@ tab1, tab2, tab3, tab4, tab5 = st.tabs([
     "Outcome Analysis"
 ])
 
+# Widgets come first in each tab; the numbers go into the placeholders below
+# them, so estimates can be replaced in the same run
+
 # Tab 1: Age Distribution Analysis
 with tab1:
     st.header("Age Distribution Analysis")
     
-    # Age bins and distribution
-    bins = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
-    labels = ["0-10", "11-20", "21-30", "31-40", "41-50", "51-60", "61-70", "71-80", "81-90", "91-100"]
-    filtered_df["Age Group"] = pd.cut(filtered_df["AGE"], bins=bins, labels=labels, right=True)
-    age_distribution = filtered_df["Age Group"].value_counts().sort_index()
+    # Age bands: a preset or edges typed by the user
+    scheme_column, edges_column = st.columns(2)
+    with scheme_column:
+        scheme = st.selectbox("Age bands:", list(AGE_SCHEMES) + ["Custom"])
+    edges = AGE_SCHEMES.get(scheme)
+    if edges is None:
+        with edges_column:
+            text = st.text_input("Band edges (years):", "0, 18, 40, 65, 80")
+        try:
+            edges = parse_edges(text)
+        except ValueError as e:
+            st.error(f"{e}; showing decades instead.")
+            edges = AGE_SCHEMES["Decades"]
     
     # Interactive chart type selection
     chart_type = st.radio("Select Chart Type:", ["Bar", "Line", "Area"], horizontal=True)
-    
-    chart_data = pd.DataFrame({"Cases": age_distribution})
-    if chart_type == "Bar":
-        st.bar_chart(chart_data)
-    elif chart_type == "Line":
-        st.line_chart(chart_data)
-    else:
-        st.area_chart(chart_data)
+    age_area = st.empty()
 
 # Tab 2: Disease Impact Analysis
 with tab2:
     st.header("Disease Impact Analysis")
-    
-    # Filter deceased patients
-    deceased_df = filtered_df[filtered_df["DATE_OF_DEATH"].notna()]
-    
-    # Calculate disease counts
-    disease_counts = {}
-    for disease in disease_columns:
-        disease_counts[disease] = len(deceased_df[deceased_df[disease] == "YES"])
-    
-    disease_data = pd.DataFrame({
-        "Disease": list(disease_counts.keys()),
-        "Deaths": list(disease_counts.values())
-    }).sort_values("Deaths", ascending=True)
-    
-    st.bar_chart(data=disease_data.set_index("Disease"))
+    disease_area = st.empty()
 
 # Tab 3: Patient Demographics
 with tab3:
     st.header("Patient Demographics")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        # Gender distribution
-        gender_dist = filtered_df["SEX"].value_counts()
-        st.subheader("Gender Distribution")
-        fig_gender = px.pie(
-            values=gender_dist.values,
-            names=gender_dist.index,
-            title="Gender Distribution"
-        )
-        st.plotly_chart(fig_gender, use_container_width=True)
-    
-    with col2:
-        # Nationality distribution
-        nationality_dist = filtered_df["NATIONALITY"].value_counts()
-        st.subheader("Nationality Distribution")
-        st.bar_chart(nationality_dist)
+    demographics_area = st.empty()
 
 # Tab 4: Hospital Statistics
 with tab4:
     st.header("Hospital Statistics")
-    
-    # Get intubation counts
-    intubation_counts = filtered_df["INTUBATED"].value_counts()
-    
-    # Create enhanced bar chart using Plotly Express
-    fig = px.bar(
-        x=intubation_counts.index,
-        y=intubation_counts.values,
-        title="Number of Patients Requiring Intubation",
-        labels={"x": "Intubation Status", "y": "Number of Patients"},
-        color=intubation_counts.values,
-        color_continuous_scale="RdBu",  # Similar to coolwarm
-        text=intubation_counts.values  # Add value labels on bars
-    )
-    
-    # Customize the layout
-    fig.update_layout(
-        title=dict(
-            text="Number of Patients Requiring Intubation",
-            x=0.5,
-            font=dict(
-                size=20,
-                family="Arial, bold"  # Using Arial bold font instead of font-weight
-            )
-        ),
-        xaxis_title_font=dict(size=14, family="Arial, bold"),
-        yaxis_title_font=dict(size=14, family="Arial, bold"),
-        xaxis_tickfont=dict(size=12),
-        yaxis_tickfont=dict(size=12),
-        yaxis_gridcolor="rgba(0,0,0,0.1)",
-        showlegend=False,
-        height=600
-    )
-    
-    # Customize bar appearance
-    fig.update_traces(
-        textposition="outside",
-        textfont=dict(size=14, color="black", family="Arial Bold"),
-        texttemplate="%{text:,.0f}",  # Format with commas
-        marker_line_color="black",
-        marker_line_width=1.2
-    )
-    
-    # Display the plot
-    st.plotly_chart(fig, use_container_width=True)
-    
-    # Show percentage metrics
-    col1, col2 = st.columns(2)
-    with col1:
-        icu_percentage = len(filtered_df[filtered_df["ICU"] == "YES"]) / len(filtered_df) * 100
-        st.metric("ICU Cases", f"{icu_percentage:.1f}%")
-    
-    with col2:
-        intubated_percentage = len(filtered_df[filtered_df["INTUBATED"] == "YES"]) / len(filtered_df) * 100
-        st.metric("Intubated Cases", f"{intubated_percentage:.1f}%")
+    hospital_area = st.empty()
 
 # Tab 5: Outcome Analysis
 with tab5:
     st.header("Outcome Analysis")
     
-    # Outcome distribution
-    outcome_dist = filtered_df["OUTCOME"].value_counts()
-    
     # Interactive chart selection
     chart_style = st.selectbox("Select Chart Style:", ["Pie Chart", "Bar Chart"])
-    
-    if chart_style == "Pie Chart":
-        fig_outcome = px.pie(
-            values=outcome_dist.values,
-            names=outcome_dist.index,
-            title="Outcome Distribution"
+    outcome_area = st.empty()
+
+# Admission date range, bounded by the span of the month partitions
+manifest = load_partitions()
+span = manifest and admission_span(manifest)
+dates = None
+if span:
+    with date_area:
+        picked = st.date_input("Admission date:", value=span, min_value=span[0], max_value=span[1])
+    dates = date_range(picked, span)
+# Key of everything cached for this selection
+view = terms if dates is None else (terms, dates)
+
+# Wait for the pre-aggregated counts; no tab touches patient rows. A date
+# range combines the counts of the admission months it overlaps, the one
+# step slow enough for fast mode to estimate first: filtering the whole
+# cube takes a few milliseconds, no more than the sample does
+pending = None
+if dates is None:
+    cube = load_count_cube()
+    ages = load_age_histogram()
+elif approximate and not in_range_loaded("count_cube", dates):
+    pending = (
+        refine_in_range("count_cube", CountCube, dates),
+        refine_in_range("age_histogram", AgeHistogram, dates),
+    )
+else:
+    cube = load_in_range("count_cube", CountCube, dates)
+    ages = load_in_range("age_histogram", AgeHistogram, dates)
+instrumentation.checkpoint("load_data")
+
+
+def draw(source, cells, estimate):
+    # Fills every tab from `source`: the count cube, or the sample cube when
+    # `estimate` is set, whose numbers are marked approximate and whose views
+    # and figures are cached apart from the exact ones
+    prefix = "sample_" if estimate else ""
+    total_count = source.total(cells)
+    if not total_count:
+        # No patient matches: there is nothing to chart or divide by
+        for area in (age_area, disease_area, demographics_area, hospital_area, outcome_area):
+            area.info("No patients match the current filters.")
+        return
+    # Plotly figures are cached per filter selection and data version
+    figure_key = (view, data_version(), estimate)
+
+    def filtered_counts(column):
+        # Labelled value counts of the filtered patients, shared across sessions
+        return decode_counts(filtered(prefix + column, view, lambda: source.counts(cells, column)), column)
+
+    def share_metric(title, column, code, count=None):
+        # Percentage of the filtered patients with `column` == `code`; an
+        # estimate also shows its 95% confidence interval
+        if estimate:
+            share, low, high = source.proportion(cells, column, code)
+            st.metric(title, f"~{share * 100:.1f}%", None if count is None else f"~{count:,} cases")
+            st.caption(f"95% CI: {low * 100:.1f}% to {high * 100:.1f}%")
+        else:
+            count = source.count(cells, column, code) if count is None else count
+            percentage = count / total_count * 100
+            st.metric(title, f"{percentage:.1f}%", None if column in ("ICU", "INTUBATED") else f"{count:,} cases")
+
+    with age_area.container():
+        # Age distribution from the running totals of cases per year of age
+        if estimate:
+            build = lambda: source.cumulative(source.select_ages(terms))
+        else:
+            build = lambda: ages.cumulative(ages.select(terms))
+        age_distribution = bin_counts(filtered(prefix + "age_cumulative", view, build), edges)
+        
+        chart_data = pd.DataFrame({"Cases": age_distribution})
+        if chart_type == "Bar":
+            st.bar_chart(chart_data)
+        elif chart_type == "Line":
+            st.line_chart(chart_data)
+        else:
+            st.area_chart(chart_data)
+    instrumentation.checkpoint(prefix + "age_distribution")
+
+    with disease_area.container():
+        # Calculate disease counts among deceased patients
+        disease_counts = filtered(
+            prefix + "deaths_by_disease", view, lambda: source.disease_counts(cells, deceased=True)
         )
-        st.plotly_chart(fig_outcome, use_container_width=True)
-    else:
-        st.bar_chart(outcome_dist)
-    
-    # Show outcome percentages
-    total_cases = len(filtered_df)
-    for outcome, count in outcome_dist.items():
-        percentage = (count / total_cases) * 100
-        st.metric(f"{outcome} Cases", f"{percentage:.1f}%", f"{count:,} cases")
+        
+        disease_data = pd.DataFrame({
+            "Disease": list(disease_counts.keys()),
+            "Deaths": list(disease_counts.values())
+        }).sort_values("Deaths", ascending=True)
+        
+        st.bar_chart(data=disease_data.set_index("Disease"))
+    instrumentation.checkpoint(prefix + "disease_impact")
+
+    with demographics_area.container():
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            # Gender distribution
+            gender_dist = filtered_counts("SEX")
+            st.subheader("Gender Distribution")
+            fig_gender = cached_figure("gender_pie", figure_key, lambda: express().pie(
+                values=gender_dist.values,
+                names=gender_dist.index,
+                title="Gender Distribution"
+            ))
+            st.plotly_chart(fig_gender, use_container_width=True)
+        
+        with col2:
+            # Nationality distribution
+            nationality_dist = filtered_counts("NATIONALITY")
+            st.subheader("Nationality Distribution")
+            st.bar_chart(nationality_dist)
+    instrumentation.checkpoint(prefix + "demographics")
+
+    with hospital_area.container():
+        # Get intubation counts
+        intubation_counts = filtered_counts("INTUBATED")
+        
+        def intubation_chart():
+            # Create enhanced bar chart using Plotly Express
+            fig = express().bar(
+                x=intubation_counts.index,
+                y=intubation_counts.values,
+                title="Number of Patients Requiring Intubation",
+                labels={"x": "Intubation Status", "y": "Number of Patients"},
+                color=intubation_counts.values,
+                color_continuous_scale="RdBu",  # Similar to coolwarm
+                text=intubation_counts.values  # Add value labels on bars
+            )
+        
+            # Customize the layout
+            fig.update_layout(
+                title=dict(
+                    text="Number of Patients Requiring Intubation",
+                    x=0.5,
+                    font=dict(
+                        size=20,
+                        family="Arial, bold"  # Using Arial bold font instead of font-weight
+                    )
+                ),
+                xaxis_title_font=dict(size=14, family="Arial, bold"),
+                yaxis_title_font=dict(size=14, family="Arial, bold"),
+                xaxis_tickfont=dict(size=12),
+                yaxis_tickfont=dict(size=12),
+                yaxis_gridcolor="rgba(0,0,0,0.1)",
+                showlegend=False,
+                height=600
+            )
+        
+            # Customize bar appearance
+            fig.update_traces(
+                textposition="outside",
+                textfont=dict(size=14, color="black", family="Arial Bold"),
+                texttemplate="%{text:,.0f}",  # Format with commas
+                marker_line_color="black",
+                marker_line_width=1.2
+            )
+            return fig
+        
+        fig = cached_figure("intubation_bar", figure_key, intubation_chart)
+        
+        # Display the plot
+        st.plotly_chart(fig, use_container_width=True)
+        
+        # Show percentage metrics
+        col1, col2 = st.columns(2)
+        with col1:
+            share_metric("ICU Cases", "ICU", YES)
+        
+        with col2:
+            share_metric("Intubated Cases", "INTUBATED", YES)
+    instrumentation.checkpoint(prefix + "hospital_statistics")
+
+    with outcome_area.container():
+        # Outcome distribution
+        outcome_dist = filtered_counts("OUTCOME")
+        
+        if chart_style == "Pie Chart":
+            fig_outcome = cached_figure("outcome_pie", figure_key, lambda: express().pie(
+                values=outcome_dist.values,
+                names=outcome_dist.index,
+                title="Outcome Distribution"
+            ))
+            st.plotly_chart(fig_outcome, use_container_width=True)
+        else:
+            st.bar_chart(outcome_dist)
+        
+        # Show outcome percentages
+        outcome_codes = filtered(prefix + "OUTCOME", view, lambda: source.counts(cells, "OUTCOME"))
+        for code, count in outcome_codes.drop(MISSING_CODE, errors="ignore").items():
+            share_metric(f"{label('OUTCOME', code)} Cases", "OUTCOME", code, count)
+    instrumentation.checkpoint(prefix + "outcome_analysis")
+
+
+if pending is not None:
+    status.info("Showing estimates from a sample; exact numbers follow.")
+    sample = filtered("sample", dates, lambda: load_sample_cube().in_range(dates))
+    sample_cells = filtered("sample_cells", view, lambda: sample.select(terms))
+    instrumentation.checkpoint("sample_filter", rows=sample.total(sample_cells))
+    draw(sample, sample_cells, estimate=True)
+    cube, ages = (future.result() for future in pending)
+    status.empty()
+cells = filtered("cells", view, lambda: cube.select(terms))
+instrumentation.checkpoint("filter", rows=cube.total(cells))
+draw(cube, cells, estimate=False)
+
+instrumentation.finish()
@@ -0,0 +1,105 @@
+import streamlit as st
+
+import instrumentation
+from charts import cached_figure, express
+from comorbidity import RANKINGS, combination_table, top_combinations
+from data_loader import DISEASE_COLUMNS, dictionary_codes, format_option
+from dataset import data_version, filtered, load_count_cube, warm_up
+from filter_index import filter_terms
+
+# Combinations are counted from the count cube's packed disease bits
+COLUMNS = ["SEX", "NATIONALITY", "OUTCOME", "ICU", "INTUBATED", "DATE_OF_DEATH"] + DISEASE_COLUMNS
+SIZES = {"Pairs and triples": (2, 3), "Pairs": (2,), "Triples": (3,)}
+
+st.set_page_config(page_title="Comorbidity Combinations", layout="wide")
+instrumentation.start("comorbidity")
+
+# The dataset loads in the background while the controls are drawn
+warm_up(columns=COLUMNS)
+
+st.title("Comorbidity Combinations")
+
+# Sidebar filters, as on the dashboard
+st.sidebar.title("Filters")
+sex_filter = st.sidebar.selectbox(
+    "Filter by Sex:", ["All"] + dictionary_codes("SEX"), format_func=format_option("SEX")
+)
+nationality_filter = st.sidebar.selectbox(
+    "Filter by Nationality:",
+    ["All"] + dictionary_codes("NATIONALITY"),
+    format_func=format_option("NATIONALITY"),
+)
+selected_diseases = st.sidebar.multiselect("Filter by Disease:", DISEASE_COLUMNS)
+terms = filter_terms(sex_filter, nationality_filter, selected_diseases)
+
+# Ranking controls
+st.sidebar.header("Combinations")
+sizes = st.sidebar.radio("Combination size:", list(SIZES))
+ranking = st.sidebar.selectbox("Rank by:", list(RANKINGS))
+top_k = st.sidebar.slider("Combinations shown:", min_value=5, max_value=50, value=10, step=5)
+min_cases = st.sidebar.number_input(
+    "Minimum patients per combination:",
+    min_value=1,
+    value=30,
+    help="Combinations with fewer patients are left out; their fatality rates are too noisy to rank",
+)
+
+# Wait for the pre-aggregated counts; no patient rows are touched
+cube = load_count_cube()
+instrumentation.checkpoint("load_data")
+
+cells = filtered("cells", terms, lambda: cube.select(terms))
+instrumentation.checkpoint("filter", rows=cube.total(cells))
+
+# Every pair and triple is counted once per filter selection; the controls
+# above only rank and cut the shared table
+table = filtered("comorbidity_combinations", terms, lambda: combination_table(cells, cube.disease_columns))
+table = table[table["DISEASES"].isin(SIZES[sizes])]
+top = top_combinations(table, top_k, RANKINGS[ranking], min_cases)
+instrumentation.checkpoint("combinations")
+
+total_count = cube.total(cells)
+deaths = cube.count(cells, "DECEASED", True)
+col1, col2, col3 = st.columns(3)
+col1.metric("Patients", f"{total_count:,}")
+col2.metric("Deaths", f"{deaths:,}")
+col3.metric("Case-fatality rate", f"{deaths / total_count * 100:.1f}%" if total_count else "-")
+
+if top.empty:
+    st.info("No combination has enough patients under the current filters.")
+else:
+    def combination_chart():
+        chart_data = top.iloc[::-1]
+        fig = express().bar(
+            chart_data,
+            x=RANKINGS[ranking],
+            y="COMBINATION",
+            orientation="h",
+            color="CASE_FATALITY",
+            color_continuous_scale="Reds",
+            hover_data=["CASES", "DEATHS"],
+            labels={"COMBINATION": "Diseases", "CASE_FATALITY": "Case-fatality rate", **{
+                column: name for name, column in RANKINGS.items()
+            }},
+            title=f"Top {len(top)} Disease Combinations by {ranking}",
+        )
+        fig.update_layout(height=max(400, 30 * len(top)), coloraxis_colorbar_tickformat=".0%")
+        return fig
+
+    figure_key = (terms, sizes, ranking, top_k, min_cases, data_version())
+    st.plotly_chart(cached_figure("comorbidity_bar", figure_key, combination_chart), use_container_width=True)
+
+    st.dataframe(
+        top.rename(columns={
+            "COMBINATION": "Diseases",
+            "DISEASES": "Size",
+            "CASES": "Patients",
+            "DEATHS": "Deaths",
+            "CASE_FATALITY": "Case-fatality rate",
+        }),
+        column_config={"Case-fatality rate": st.column_config.NumberColumn(format="%.3f")},
+        hide_index=True,
+        use_container_width=True,
+    )
+instrumentation.checkpoint("combination_chart")
+instrumentation.finish()
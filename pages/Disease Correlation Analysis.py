@@ -1,32 +1,18 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 
-st.set_page_config(page_title="Disease Correlations", layout="wide")
+import instrumentation
+from charts import express
+from correlation import correlation_features
+from dataset import load_correlation_stats, warm_up
 
-# Load the dataset
-@st.cache_data
-def load_data():
-    df = pd.read_csv("dataset.csv")
-    df.columns = map(str.upper, df.columns)
-
-    disease_columns = [
-        "DIABETES", "COPD", "ASTHMA", "INMUSUPR", "HYPERTENSION",
-        "PNEUMONIA", "CARDIOVASCULAR", "OBESITY", "CHRONIC_KIDNEY",
-        "TOBACCO", "OTHER_DISEASE",
-    ]
-
-    # Map disease values
-    for column in disease_columns:
-        if column in df.columns:
-            df[column] = df[column].map({1: "YES", 2: "NO", 97: "N/A", 98: "IGNORED", 99: "UNKNOWN"})
-    
-    # Map ICU values
-    df["ICU"] = df["ICU"].map({1: "YES", 2: "NO", 97: "N/A", 98: "IGNORED", 99: "UNKNOWN"})
+COLUMNS = correlation_features()
 
-    return df, disease_columns
+st.set_page_config(page_title="Disease Correlations", layout="wide")
+instrumentation.start("correlation")
 
-df, disease_columns = load_data()
+# The dataset loads in the background while the controls are drawn
+warm_up(columns=COLUMNS)
 
 st.title("Disease Correlation Analysis")
 
@@ -36,7 +22,7 @@ st.sidebar.header("Visualization Controls")
 # Feature selection
 selected_features = st.sidebar.multiselect(
     "Select diseases to analyze:",
-    disease_columns + ["ICU"],
+    correlation_features(),
     default=["DIABETES", "PNEUMONIA", "ICU", "CARDIOVASCULAR"]
 )
 
@@ -60,20 +46,18 @@ color_scheme = st.sidebar.selectbox(
 # Main content area
 col1, col2 = st.columns([2, 1])
 
+# Wait for the pairwise sums; correlations are computed from them, not from patient rows
+correlation_stats = load_correlation_stats()
+instrumentation.checkpoint("load_data")
+
 with col1:
     st.header("Correlation Heatmap")
     
     if len(selected_features) < 2:
         st.warning("Please select at least 2 features to show correlations.")
     else:
-        # Convert categorical to numeric
-        disease_numeric_df = df.copy()
-        for col in disease_columns + ["ICU"]:
-            if col in disease_numeric_df.columns:
-                disease_numeric_df[col] = disease_numeric_df[col].map({"YES": 1, "NO": 0})
-
         # Compute correlation matrix for selected features
-        correlation_matrix = disease_numeric_df[selected_features].corr()
+        correlation_matrix = correlation_stats.matrix(selected_features)
 
         # Apply threshold masking
         if correlation_threshold > 0:
@@ -81,7 +65,7 @@ with col1:
             correlation_matrix = correlation_matrix.where(mask, None)
 
         # Create heatmap
-        fig = px.imshow(
+        fig = express().imshow(
             correlation_matrix,
             x=correlation_matrix.columns,
             y=correlation_matrix.index,
@@ -99,6 +83,7 @@ with col1:
         )
 
         st.plotly_chart(fig, use_container_width=True)
+instrumentation.checkpoint("heatmap")
 
 with col2:
     st.header("Key Insights")
@@ -109,7 +94,7 @@ with col2:
         for i in range(len(selected_features)):
             for j in range(i + 1, len(selected_features)):
                 corr_value = correlation_matrix.iloc[i, j]
-                if corr_value is not None:  # Check for masked values
+                if pd.notna(corr_value):  # Check for masked values
                     correlations.append({
                         "Feature 1": selected_features[i],
                         "Feature 2": selected_features[j],
@@ -136,4 +121,7 @@ with col2:
             st.write(f"Number of strong correlations (≥0.5): {len(correlations_df[abs(correlations_df['Correlation']) >= 0.5])}")
             st.write(f"Number of moderate correlations (0.3-0.5): {len(correlations_df[(abs(correlations_df['Correlation']) >= 0.3) & (abs(correlations_df['Correlation']) < 0.5)])}")
         else:
-            st.info("No correlations meet the threshold criteria.")
\ No newline at end of file
+            st.info("No correlations meet the threshold criteria.")
+
+instrumentation.checkpoint("insights")
+instrumentation.finish()
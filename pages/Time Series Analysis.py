@@ -1,106 +1,50 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
 
-def load_data():
-    df = pd.read_csv("dataset.csv")
-    df.columns = map(str.upper, df.columns)
+import instrumentation
+from charts import cached_figure, downsample, express
+from data_loader import MISSING_CODE, label
+from dataset import data_version, load_daily_counts, warm_up
+from timeseries import GRANULARITIES, time_series_categories
 
-    # Convert and map categorical values
-    mapping = {
-        "SEX": {1: "FEMALE", 2: "MALE", 99: "UNKNOWN"},
-        "HOSPITALIZED": {
-            1: "YES",
-            2: "NO",
-            97: "DOES NOT APPLY",
-            98: "IGNORED",
-            99: "UNKNOWN",
-        },
-        "INTUBATED": {
-            1: "YES",
-            2: "NO",
-            97: "DOES NOT APPLY",
-            98: "IGNORED",
-            99: "UNKNOWN",
-        },
-        "PREGNANCY": {
-            1: "YES",
-            2: "NO",
-            97: "DOES NOT APPLY",
-            98: "IGNORED",
-            99: "UNKNOWN",
-        },
-        "SPEAKS_NATIVE_LANGUAGE": {
-            1: "YES",
-            2: "NO",
-            97: "DOES NOT APPLY",
-            98: "IGNORED",
-            99: "UNKNOWN",
-        },
-        "TOBACCO": {
-            1: "YES",
-            2: "NO",
-            97: "DOES NOT APPLY",
-            98: "IGNORED",
-            99: "UNKNOWN",
-        },
-        "ANOTHER CASE": {
-            1: "YES",
-            2: "NO",
-            97: "DOES NOT APPLY",
-            98: "IGNORED",
-            99: "UNKNOWN",
-        },
-        "ICU": {1: "YES", 2: "NO", 97: "DOES NOT APPLY", 98: "IGNORED", 99: "UNKNOWN"},
-        "OUTCOME": {1: "POSITIVE", 2: "NEGATIVE", 97: "PENDING"},
-        "NATIONALITY": {1: "MEXICAN", 2: "FOREIGN", 97: "UNKNOWN"},
-    }
+COLUMNS = ["ADMISSION DATE"] + time_series_categories()
 
-    disease_columns = [
-        "DIABETES",
-        "COPD",
-        "ASTHMA",
-        "INMUSUPR",
-        "HYPERTENSION",
-        "PNEUMONIA",
-        "CARDIOVASCULAR",
-        "OBESITY",
-        "CHRONIC_KIDNEY",
-        "TOBACCO",
-        "OTHER_DISEASE",
-    ]
+instrumentation.start("time_series")
 
-    for column, map_values in mapping.items():
-        if column in df.columns:
-            df[column] = pd.to_numeric(df[column], errors="coerce")
-            df[column] = df[column].map(map_values)
+# The dataset loads in the background while the controls are drawn
+warm_up(columns=COLUMNS)
 
-    for column in disease_columns:
-        if column in df.columns:
-            df[column] = df[column].map(
-                {1: "YES", 2: "NO", 97: "N/A", 98: "IGNORED", 99: "UNKNOWN"}
-            )
-
-    return df
-
-df = load_data()
-df['ADMISSION DATE'] = pd.to_datetime(df['ADMISSION DATE'])
-
-pre_chosen_categories = ['PNEUMONIA', 'SEX', 'HOSPITALIZED', 'INTUBATED']
+pre_chosen_categories = time_series_categories()
 
 st.sidebar.title("Time Series Analysis")
 # choose one of the pre-chosen categories
 chosen_category = st.sidebar.selectbox("Select category", pre_chosen_categories)
+granularity = st.sidebar.selectbox("Granularity", list(GRANULARITIES))
+rolling_window = st.sidebar.slider("Rolling average (periods)", min_value=1, max_value=30, value=1)
+
+# Wait for the daily admission counts
+daily_counts = load_daily_counts()
+instrumentation.checkpoint("load_data")
 
-# Summarize data for the chosen category
-summarized_data = df.groupby('ADMISSION DATE')[chosen_category].value_counts().unstack().fillna(0)
-summarized_data = summarized_data.reset_index()
 
-# Create line chart
-fig = px.line(summarized_data, x='ADMISSION DATE', y=summarized_data.columns[1:], title=f'Line Chart of {chosen_category} Admission Over Time')
+def line_chart():
+    # Summarize data for the chosen category
+    summarized_data = daily_counts.table(chosen_category, GRANULARITIES[granularity], rolling_window)
+    summarized_data = summarized_data.drop(columns=MISSING_CODE, errors='ignore')
+    summarized_data.columns = [label(chosen_category, code) for code in summarized_data.columns]
+    summarized_data = downsample(summarized_data).reset_index()
+
+    # Create line chart
+    return express().line(summarized_data, x='ADMISSION DATE', y=summarized_data.columns[1:], title=f'Line Chart of {granularity} {chosen_category} Admission Over Time')
+
+
+fig = cached_figure("time_series", (chosen_category, granularity, rolling_window, data_version()), line_chart)
+instrumentation.checkpoint("time_series")
 
 # Display line chart
 st.plotly_chart(fig)
+instrumentation.checkpoint("render")
 
 # Display dataframe
-# st.write(df)
\ No newline at end of file
+# st.write(df)
+
+instrumentation.finish()
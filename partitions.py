@@ -0,0 +1,225 @@
+import datetime
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import data_loader
+
+logger = logging.getLogger(__name__)
+
+# Bump when the partition layout changes so old stores are rebuilt
+PARTITIONS_VERSION = 2
+PARTITIONS_SUFFIX = ".partitions"
+DATE_COLUMN = "ADMISSION DATE"
+# Partition of the rows without an admission date; no range opens it
+UNKNOWN = "unknown"
+# Bytes a chunk may take while the partitions are built, as for dataset.py
+MEMORY_LIMIT = data_loader.parse_memory_limit(os.environ.get("DATASET_MEMORY_LIMIT"))
+
+
+def partitions_path(path=data_loader.DATASET_PATH):
+    # Next to the column snapshot, wherever DATASET_SNAPSHOT_DIR puts that
+    snapshot = data_loader.snapshot_path(path)
+    return snapshot[: -len(data_loader.SNAPSHOT_SUFFIX)] + PARTITIONS_SUFFIX
+
+
+def _read_manifest(root):
+    try:
+        with open(os.path.join(root, "partitions.json")) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != PARTITIONS_VERSION:
+        return None
+    return manifest
+
+
+def partition_manifest(path=data_loader.DATASET_PATH):
+    # The store as last written, without checking it against the CSV
+    return _read_manifest(partitions_path(path))
+
+
+def storage_dtypes(rows):
+    # Stored widths no later month can outgrow: a month's first rows decide
+    # its files, yet later rows may add the 128th category of a column or
+    # leave a whole number such as AGE blank. Codes of category and text
+    # columns get 32 bits, integers become floats that hold them exactly
+    dtypes = {}
+    for column in rows.columns:
+        dtype = rows[column].dtype
+        if dtype == object or isinstance(dtype, pd.CategoricalDtype):
+            dtypes[column] = "int32"
+        elif dtype.kind in "iu" and column not in data_loader.coded_columns():
+            dtypes[column] = "float32" if dtype.itemsize <= 2 else "float64"
+    return dtypes
+
+
+def _rebuild_month(directory, entry, part):
+    # Rewrites one partition with `part` appended, for rows its files cannot
+    # take. The new files are numbered after the old ones, which stay for
+    # readers of the previous manifest until the store is next rebuilt
+    stored = data_loader.read_columns(directory, entry["columns"], entry["rows"])
+    if stored is None:
+        raise ValueError(f"partition {directory} cannot be read")
+    rows = pd.concat([stored, part[stored.columns]], ignore_index=True)
+    first = max(int(column["file"].split(".")[0]) for column in entry["columns"]) + 1
+    return data_loader.write_columns(rows, directory, first, storage_dtypes(rows))
+
+
+def _add_rows(root, manifest, rows):
+    # Appends decoded rows to the partitions of their admission months,
+    # creating the months not seen yet, and updates each one's row count and
+    # first and last admission. A month the rows do not fit is rebuilt alone
+    dates = rows[DATE_COLUMN]
+    months = dates.dt.strftime("%Y-%m").fillna(UNKNOWN).to_numpy()
+    for month in pd.unique(months):
+        positions = np.flatnonzero(months == month)
+        part = rows.iloc[positions]
+        directory = os.path.join(root, month)
+        entry = manifest["partitions"].get(month)
+        if entry is None:
+            os.makedirs(directory, exist_ok=True)
+            columns = data_loader.write_columns(part, directory, dtypes=storage_dtypes(part))
+            entry = {"rows": 0, "first": None, "last": None, "columns": columns}
+        else:
+            try:
+                columns = data_loader.append_columns(part, directory, entry["columns"], entry["rows"])
+            except (ValueError, TypeError) as e:
+                logger.info("Rebuilding partition %s: %s", month, e)
+                columns = _rebuild_month(directory, entry, part)
+            entry = dict(entry, columns=columns)
+        entry["rows"] += len(part)
+        known = dates.iloc[positions].dropna()
+        if len(known):
+            first, last = known.min().date().isoformat(), known.max().date().isoformat()
+            entry["first"] = first if entry["first"] is None else min(entry["first"], first)
+            entry["last"] = last if entry["last"] is None else max(entry["last"], last)
+        manifest["partitions"][month] = entry
+
+
+def build_partitions(path=data_loader.DATASET_PATH, source_fingerprint=None, memory_limit=MEMORY_LIMIT):
+    # Writes every row of the CSV into month partitions, streaming it in
+    # chunks sized to memory_limit; returns the manifest, or None when the
+    # rows cannot be stored even by rebuilding their month
+    source_fingerprint = source_fingerprint or data_loader.fingerprint(path)
+    root = partitions_path(path)
+    os.makedirs(os.path.dirname(os.path.abspath(root)), exist_ok=True)
+    staging = f"{root}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    manifest = {"version": PARTITIONS_VERSION, "fingerprint": source_fingerprint, "partitions": {}}
+    try:
+        chunks = data_loader.iter_chunks(path, memory_limit=memory_limit, end=source_fingerprint["size"])
+        for chunk in chunks:
+            _add_rows(staging, manifest, chunk)
+    except (KeyError, ValueError, TypeError) as e:
+        logger.warning("Could not partition the dataset by admission month: %s", e)
+        shutil.rmtree(staging, ignore_errors=True)
+        return None
+    data_loader.write_manifest(staging, manifest, "partitions.json")
+
+    # Swapped into place like the snapshot
+    previous = f"{root}.old-{os.getpid()}"
+    if os.path.isdir(root):
+        os.rename(root, previous)
+    os.rename(staging, root)
+    shutil.rmtree(previous, ignore_errors=True)
+    return manifest
+
+
+def open_partitions(path=data_loader.DATASET_PATH, memory_limit=MEMORY_LIMIT):
+    # The month partitions of the CSV as it is now: rows appended since they
+    # were written are added to their months, anything else rebuilds them
+    current = data_loader.fingerprint(path)
+    root = partitions_path(path)
+    manifest = _read_manifest(root)
+    if manifest is not None and manifest["fingerprint"] == current:
+        return manifest
+
+    with data_loader.snapshot_lock(path):
+        manifest = _read_manifest(root)
+        if manifest is not None:
+            if manifest["fingerprint"] == current:
+                return manifest
+            span = data_loader.appended_range(manifest["fingerprint"], path)
+            if span and span[1] == span[0]:
+                return manifest
+            if span:
+                start, end = span
+                try:
+                    _add_rows(root, manifest, data_loader.read_rows(path, start, end))
+                except (KeyError, ValueError, TypeError):
+                    pass
+                else:
+                    manifest["fingerprint"] = data_loader.fingerprint(path, end)
+                    data_loader.write_manifest(root, manifest, "partitions.json")
+                    return manifest
+        try:
+            return build_partitions(path, current, memory_limit)
+        except OSError as e:
+            logger.warning("Could not write dataset partitions: %s", e)
+            return None
+
+
+def admission_span(manifest):
+    # (first, last) admission date of the store, or None without any
+    known = [entry for entry in manifest["partitions"].values() if entry["first"] is not None]
+    if not known:
+        return None
+    first = min(entry["first"] for entry in known)
+    last = max(entry["last"] for entry in known)
+    return datetime.date.fromisoformat(first), datetime.date.fromisoformat(last)
+
+
+def date_range(picked, span):
+    # A date_input selection -> ("YYYY-MM-DD", "YYYY-MM-DD"), or None while
+    # only one end is picked or when the range covers every admission
+    if span is None or len(picked) != 2 or (picked[0] <= span[0] and picked[1] >= span[1]):
+        return None
+    return picked[0].isoformat(), picked[1].isoformat()
+
+
+def overlapping(manifest, start, end):
+    # (month, entry) of every partition with admissions between start and
+    # end, inclusive; partitions outside the range are never opened
+    return [
+        (month, entry)
+        for month, entry in sorted(manifest["partitions"].items())
+        if entry["first"] is not None and entry["first"] <= end and entry["last"] >= start
+    ]
+
+
+def covered(entry, start, end):
+    return start <= entry["first"] and entry["last"] <= end
+
+
+def read_partition(path, month, entry, columns=None):
+    # Memory-mapped frame of one partition; `columns` it lacks are left out
+    entries = entry["columns"]
+    if columns is not None:
+        wanted = set(columns)
+        entries = [column for column in entries if column["name"] in wanted]
+    return data_loader.read_columns(os.path.join(partitions_path(path), month), entries, entry["rows"])
+
+
+def between(rows, start, end):
+    dates = rows[DATE_COLUMN]
+    return rows[((dates >= pd.Timestamp(start)) & (dates <= pd.Timestamp(end))).to_numpy()]
+
+
+def rows_in_range(path, manifest, start, end, columns=None):
+    # Rows admitted between start and end, read from the overlapping
+    # partitions only; partitions the range cuts are filtered by date
+    parts = []
+    for month, entry in overlapping(manifest, start, end):
+        rows = read_partition(path, month, entry, None if columns is None else list(columns) + [DATE_COLUMN])
+        parts.append(rows if covered(entry, start, end) else between(rows, start, end))
+    if parts:
+        rows = pd.concat(parts, ignore_index=True)
+    else:
+        rows = data_loader.decode_columns(pd.read_csv(path, nrows=0))
+    return rows if columns is None else rows[list(columns)]
@@ -0,0 +1,217 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+import data_loader
+from correlation import CorrelationStats
+from age_histogram import DECADES, age_bands, band_labels
+from data_loader import DISEASE_COLUMNS, YES, codes_present, decode_counts, label
+from filter_index import FilterIndex, filter_terms
+
+# Columns the notebook analyses read; cohorts copy nothing else
+REPORT_COLUMNS = ["AGE", "SEX", "NATIONALITY", "INTUBATED", "ICU", "DATE_OF_DEATH"] + DISEASE_COLUMNS
+REPORTS = ["age_groups", "gender_age", "intubation", "icu_correlation", "deceased_comorbidities"]
+
+# Dataset and filter index of one worker process
+_worker = {}
+
+
+def _start_worker(path):
+    # The snapshot written by the parent is mapped, not parsed again
+    df, _ = data_loader.open_dataset(path, columns=REPORT_COLUMNS)
+    _worker.update(df=df, index=FilterIndex(df))
+
+
+def cohort_grid(df, sexes=None, nationalities=None, disease_sets=None):
+    # Every combination of the given selections; None means "All" plus every
+    # code in the data (diseases: no filter plus each disease alone)
+    sexes = ["All"] + codes_present(df["SEX"]) if sexes is None else sexes
+    nationalities = ["All"] + codes_present(df["NATIONALITY"]) if nationalities is None else nationalities
+    disease_sets = [()] + [(disease,) for disease in DISEASE_COLUMNS] if disease_sets is None else disease_sets
+    return [
+        {"sex": sex, "nationality": nationality, "diseases": tuple(diseases)}
+        for sex, nationality, diseases in itertools.product(sexes, nationalities, disease_sets)
+    ]
+
+
+def cohort_labels(cohort):
+    return {
+        "SEX": "All" if cohort["sex"] == "All" else label("SEX", int(cohort["sex"])),
+        "NATIONALITY": (
+            "All" if cohort["nationality"] == "All" else label("NATIONALITY", int(cohort["nationality"]))
+        ),
+        "DISEASES": "+".join(cohort["diseases"]) or "All",
+    }
+
+
+def analyses(rows):
+    # The notebook's Q2, Q5, Q6, Q7 and Q8 for one cohort's rows
+    labels = band_labels(DECADES)
+    groups = age_bands(rows["AGE"], DECADES)
+    age_counts = np.bincount(groups + 1, minlength=len(labels) + 1)[1:]
+    age_distribution = pd.DataFrame({"AGE_GROUP": labels, "COUNT": age_counts})
+
+    known = groups >= 0
+    gender_age = (
+        pd.DataFrame({
+            "AGE_GROUP": np.asarray(labels)[groups[known]],
+            "SEX": rows["SEX"].to_numpy()[known],
+        })
+        .groupby(["AGE_GROUP", "SEX"])
+        .size()
+        .rename("COUNT")
+        .reset_index()
+    )
+    gender_age["SEX"] = [label("SEX", code) for code in gender_age["SEX"]]
+
+    intubation = decode_counts(rows["INTUBATED"].value_counts(), "INTUBATED")
+    intubation = intubation.rename_axis("INTUBATED").rename("COUNT").reset_index()
+
+    stats = CorrelationStats(rows)
+    correlation = stats.matrix(stats.features).rename_axis(index="FEATURE_1", columns="FEATURE_2")
+    correlation = correlation.stack(dropna=False).rename("CORRELATION").reset_index()
+
+    deceased = rows["DATE_OF_DEATH"].notna().to_numpy()
+    deaths = [int(((rows[disease].to_numpy() == YES) & deceased).sum()) for disease in DISEASE_COLUMNS]
+    comorbidities = pd.DataFrame({"DISEASE": DISEASE_COLUMNS, "DEATHS": deaths})
+
+    return dict(zip(REPORTS, [age_distribution, gender_age, intubation, correlation, comorbidities]))
+
+
+def cohort_slug(labels):
+    return "_".join(f"{key.lower()}-{value}" for key, value in labels.items()).replace(" ", "-")
+
+
+def save_charts(results, title, directory):
+    os.makedirs(directory, exist_ok=True)
+    # Bar charts as (report, x column, y column); Q5 is drawn grouped by sex
+    bars = [
+        ("age_groups", "AGE_GROUP", "COUNT"),
+        ("gender_age", "AGE_GROUP", "COUNT"),
+        ("intubation", "INTUBATED", "COUNT"),
+        ("deceased_comorbidities", "DISEASE", "DEATHS"),
+    ]
+    for name, x, y in bars:
+        fig, ax = plt.subplots(figsize=(10, 6))
+        table = results[name]
+        if name == "gender_age":
+            table = table.pivot(index=x, columns="SEX", values=y)
+            if len(table):
+                table.plot.bar(ax=ax)
+        elif len(table):
+            table.plot.bar(x=x, y=y, ax=ax, legend=False)
+        ax.set_title(f"{name.replace('_', ' ').title()} - {title}")
+        fig.tight_layout()
+        fig.savefig(os.path.join(directory, f"{name}.png"))
+        plt.close(fig)
+
+    matrix = results["icu_correlation"].pivot(index="FEATURE_1", columns="FEATURE_2", values="CORRELATION")
+    fig, ax = plt.subplots(figsize=(10, 8))
+    image = ax.imshow(matrix.to_numpy(dtype=float), cmap="coolwarm", vmin=-1, vmax=1)
+    ax.set_xticks(range(len(matrix.columns)), matrix.columns, rotation=45, ha="right")
+    ax.set_yticks(range(len(matrix.index)), matrix.index)
+    fig.colorbar(image, ax=ax)
+    ax.set_title(f"Correlation between Diseases and ICU Admission - {title}")
+    fig.tight_layout()
+    fig.savefig(os.path.join(directory, "icu_correlation.png"))
+    plt.close(fig)
+
+
+def cohort_report(cohort, chart_dir=None):
+    # Runs in a worker: select the cohort on the bitmap index, copy only the
+    # report columns of its rows, and compute (and optionally draw) every analysis
+    df, index = _worker["df"], _worker["index"]
+    positions = index.positions(index.select(filter_terms(**cohort)))
+    rows = df.iloc[positions, df.columns.get_indexer(REPORT_COLUMNS)]
+    results = analyses(rows)
+    labels = cohort_labels(cohort)
+    if chart_dir:
+        title = ", ".join(f"{column}: {value}" for column, value in labels.items())
+        save_charts(results, title, os.path.join(chart_dir, cohort_slug(labels)))
+    for table in results.values():
+        for position, (column, value) in enumerate(labels.items()):
+            table.insert(position, f"COHORT_{column}", value)
+    return results
+
+
+def run(path, out, cohorts, workers=data_loader.PARSE_WORKERS, fmt="csv", charts=True):
+    # Cohorts are spread over `workers` processes; each report is written as
+    # one table covering every cohort
+    chart_dir = os.path.join(out, "charts") if charts else None
+    os.makedirs(out, exist_ok=True)
+    if workers > 1:
+        # Spawned, like the parallel CSV parser; chunks amortize the pickling
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            workers, mp_context=context, initializer=_start_worker, initargs=(path,)
+        ) as pool:
+            chunksize = max(1, len(cohorts) // (workers * 4))
+            results = list(pool.map(cohort_report, cohorts, [chart_dir] * len(cohorts), chunksize=chunksize))
+    else:
+        _start_worker(path)
+        results = [cohort_report(cohort, chart_dir) for cohort in cohorts]
+
+    written = []
+    for name in REPORTS:
+        table = pd.concat([result[name] for result in results], ignore_index=True)
+        target = os.path.join(out, f"{name}.{fmt}")
+        if fmt == "parquet":
+            table.to_parquet(target, index=False)
+        else:
+            table.to_csv(target, index=False)
+        written.append(target)
+    return written
+
+
+def _selections(text):
+    # "all,1,2" -> ["All", 1, 2]
+    return ["All" if item.lower() == "all" else int(item) for item in text.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the notebook analyses for a grid of patient cohorts.")
+    parser.add_argument("path", nargs="?", default=data_loader.DATASET_PATH)
+    parser.add_argument("--out", default="reports", help="output directory")
+    parser.add_argument("--sex", help="comma-separated codes or 'all' (default: all and every code)")
+    parser.add_argument("--nationality", help="comma-separated codes or 'all' (default: all and every code)")
+    parser.add_argument(
+        "--diseases",
+        help="comma-separated disease sets joined with '+', 'none' for no filter "
+        "(default: none and each disease alone)",
+    )
+    parser.add_argument("--workers", type=int, default=data_loader.PARSE_WORKERS, help="report processes")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--no-charts", action="store_true", help="skip the PNG charts")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    # Build or refresh the snapshot once; the workers only map it
+    df, _ = data_loader.open_dataset(args.path, columns=REPORT_COLUMNS)
+    disease_sets = None
+    if args.diseases:
+        disease_sets = [
+            () if item.lower() == "none" else tuple(item.upper().split("+")) for item in args.diseases.split(",")
+        ]
+    cohorts = cohort_grid(
+        df,
+        _selections(args.sex) if args.sex else None,
+        _selections(args.nationality) if args.nationality else None,
+        disease_sets,
+    )
+    written = run(args.path, args.out, cohorts, args.workers, args.format, not args.no_charts)
+    print(f"{len(cohorts)} cohorts reported to {', '.join(written)} in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
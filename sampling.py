@@ -0,0 +1,136 @@
+import copy
+import os
+
+import numpy as np
+import pandas as pd
+
+from age_histogram import KEYS as AGE_KEYS
+from age_histogram import whole_ages
+from count_cube import DIMENSIONS, CountCube, cube_keys, select_cells
+from data_loader import DISEASE_COLUMNS
+
+# Patients kept per stratum; strata no larger than this are kept whole, so
+# their estimates are exact
+STRATUM_ROWS = int(os.environ.get("DASHBOARD_STRATUM_ROWS") or 20_000)
+STRATA = ["SEX", "NATIONALITY"]
+DATE_COLUMN = "ADMISSION DATE"
+
+# Normal quantile of the two-sided 95% confidence intervals
+Z = 1.96
+
+
+class SampleCube(CountCube):
+    # CountCube over a stratified random sample with equal allocation: every
+    # SEX x NATIONALITY stratum keeps the STRATUM_ROWS patients with the lowest
+    # random priority, which remains a simple random sample of the stratum as
+    # rows are appended. COUNT is the sampled count scaled by N_h / n_h, so
+    # every count the cube reports estimates the whole dataset. Ages are
+    # counted in age_cells, keyed like AgeHistogram, so the cells stay no
+    # larger than the exact cube's
+
+    def __init__(self, df, disease_columns=DISEASE_COLUMNS, stratum_rows=STRATUM_ROWS, seed=0):
+        self.disease_columns = list(disease_columns)
+        self.stratum_rows = stratum_rows
+        self._rng = np.random.default_rng(seed)
+        self.population = None
+        self.rows = self._sample(df)
+        self._build()
+
+    def _keys(self, df):
+        keys = cube_keys(df, self.disease_columns)
+        keys["AGE"] = whole_ages(df["AGE"])
+        keys[DATE_COLUMN] = df[DATE_COLUMN].to_numpy() if DATE_COLUMN in df.columns else pd.NaT
+        keys["PRIORITY"] = self._rng.random(len(df))
+        return keys
+
+    def _sample(self, df, kept=None):
+        keys = self._keys(df)
+        population = keys.groupby(STRATA).size()
+        if kept is not None:
+            population = self.population.add(population, fill_value=0).astype(np.int64)
+            keys = pd.concat([kept, keys], ignore_index=True)
+        self.population = population
+        keys = keys.sort_values(STRATA + ["PRIORITY"], kind="stable")
+        return keys[keys.groupby(STRATA).cumcount().to_numpy() < self.stratum_rows].reset_index(drop=True)
+
+    def _build(self):
+        self.strata = pd.DataFrame({
+            "N": self.population,
+            "n": self.rows.groupby(STRATA).size(),
+        }).fillna(0).astype(np.int64)
+        self.cells = self._cells(DIMENSIONS)
+        self.age_cells = self._cells(AGE_KEYS)
+
+    def _cells(self, keys):
+        cells = self.rows.groupby(keys, sort=False).size().rename("SAMPLED").reset_index()
+        weights = (self.strata["N"] / self.strata["n"]).reindex(pd.MultiIndex.from_frame(cells[STRATA]))
+        cells["COUNT"] = cells["SAMPLED"] * weights.to_numpy()
+        return cells
+
+    def extend(self, df):
+        self.rows = self._sample(df, self.rows)
+        self._build()
+
+    def in_range(self, dates):
+        # The cube of the sampled patients admitted between the dates
+        # (start, end), inclusive. Weights stay those of the whole sample, so
+        # counts and shares estimate the admissions in the range
+        start, end = (pd.Timestamp(date) for date in dates)
+        admitted = self.rows[DATE_COLUMN]
+        subset = copy.copy(self)
+        subset.rows = self.rows[((admitted >= start) & (admitted <= end)).to_numpy()]
+        subset.cells = subset._cells(DIMENSIONS)
+        subset.age_cells = subset._cells(AGE_KEYS)
+        return subset
+
+    def __sizeof__(self):
+        frames = (self.rows, self.cells, self.age_cells)
+        return object.__sizeof__(self) + int(sum(frame.memory_usage(deep=True).sum() for frame in frames))
+
+    @property
+    def exact(self):
+        # True while every stratum is kept whole
+        return bool((self.strata["n"] == self.strata["N"]).all())
+
+    def counts(self, cells, column):
+        return super().counts(cells, column).round().astype(np.int64)
+
+    def select_ages(self, terms):
+        return select_cells(self.age_cells, terms, self.disease_columns)
+
+    def cumulative(self, cells):
+        # Estimated running totals per year of age of select_ages() cells, as
+        # AgeHistogram.cumulative
+        cells = cells[cells["AGE"].to_numpy() >= 0]
+        per_year = np.bincount(cells["AGE"].to_numpy(), weights=cells["COUNT"].to_numpy(), minlength=1)
+        return np.rint(np.concatenate([[0], np.cumsum(per_year)])).astype(np.int64)
+
+    def proportion(self, cells, column, code):
+        return self.share(cells, cells[column].to_numpy() == code)
+
+    def share(self, cells, matches):
+        # Estimated share of the filtered patients in the cells flagged by
+        # `matches` and its 95% confidence interval: a stratified ratio
+        # estimate with the linearized variance and the finite population
+        # correction
+        sampled = cells["SAMPLED"].to_numpy()
+        hits = np.where(matches, sampled, 0)
+        counts = pd.DataFrame({"domain": sampled, "hits": hits}).groupby(
+            [cells[stratum].to_numpy() for stratum in STRATA]
+        ).sum()
+        strata = self.strata.join(counts.rename_axis(STRATA), how="inner")
+        if not len(strata):
+            return np.nan, np.nan, np.nan
+        population, size = strata["N"].to_numpy(float), strata["n"].to_numpy(float)
+        domain, hits = strata["domain"].to_numpy(float), strata["hits"].to_numpy(float)
+        weights = population / size
+        estimated = (weights * domain).sum()
+        share = (weights * hits).sum() / estimated
+        # Residuals of the sampled patients: 1 - share for hits, -share for
+        # the rest of the selection, 0 outside it
+        misses = domain - hits
+        mean = (hits * (1 - share) - misses * share) / size
+        spread = (hits * (1 - share) ** 2 + misses * share**2 - size * mean**2) / np.maximum(size - 1, 1)
+        variance = (population**2 * (1 - size / population) * spread / size).sum() / estimated**2
+        half = Z * np.sqrt(max(variance, 0))
+        return share, max(share - half, 0.0), min(share + half, 1.0)
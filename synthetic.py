@@ -0,0 +1,144 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_loader import DATA_DICTIONARY_PATH, DATE_FORMAT, MISSING_CODE, code_tables
+
+# Column order of the published dataset
+COLUMNS = [
+    "ORIGIN", "SECTOR", "TREATMENT_LOCATION", "SEX", "BIRTHPLACE_LOCATION", "PATIENT_LOCATION",
+    "MUNICIPALITY", "HOSPITALIZED", "ADMISSION DATE", "DATE_OF_FIRST_SYMPTOM", "DATE_OF_DEATH",
+    "INTUBATED", "PNEUMONIA", "AGE", "NATIONALITY", "PREGNANCY", "SPEAKS_NATIVE_LANGUAGE",
+    "DIABETES", "COPD", "ASTHMA", "INMUSUPR", "HYPERTENSION", "OTHER_DISEASE", "CARDIOVASCULAR",
+    "OBESITY", "CHRONIC_KIDNEY", "TOBACCO", "ANOTHER CASE", "OUTCOME", "MIGRANT",
+    "COUNTRY OF ORIGIN", "ICU",
+]
+
+SIZES = {"100k": 100_000, "1m": 1_000_000, "10m": 10_000_000, "50m": 50_000_000}
+
+# Rows generated and written at a time
+CHUNK_ROWS = 1_000_000
+
+FIRST_ADMISSION = pd.Timestamp("2020-01-01")
+ADMISSION_DAYS = 730
+
+# Share of patients answering YES; the rest answer NO apart from ~1% unknowns
+PREVALENCE = {
+    "DIABETES": 0.12, "COPD": 0.015, "ASTHMA": 0.03, "INMUSUPR": 0.015, "HYPERTENSION": 0.16,
+    "PNEUMONIA": 0.12, "CARDIOVASCULAR": 0.02, "OBESITY": 0.15, "CHRONIC_KIDNEY": 0.02,
+    "TOBACCO": 0.08, "OTHER_DISEASE": 0.03, "SPEAKS_NATIVE_LANGUAGE": 0.01,
+    "ANOTHER CASE": 0.35, "MIGRANT": 0.001,
+}
+
+
+def dictionary_code(column, text):
+    # Code the data dictionary gives `text` in `column`, e.g. HOSPITALIZED "YES" -> 2
+    for code, name in code_tables(DATA_DICTIONARY_PATH).get(column, {}).items():
+        if name == text:
+            return code
+    return MISSING_CODE
+
+
+def _answers(rng, column, yes, rows):
+    # YES with probability `yes`, a little IGNORED/UNKNOWN, NO otherwise
+    draw = rng.random(rows)
+    codes = np.full(rows, dictionary_code(column, "NO"), dtype=np.int16)
+    codes[draw < yes] = dictionary_code(column, "YES")
+    codes[draw > 0.995] = dictionary_code(column, "IGNORED")
+    codes[draw > 0.9975] = dictionary_code(column, "UNKNOWN")
+    return codes
+
+
+def synthetic_rows(rng, rows):
+    # One chunk of patients with the dataset's codes and the dependencies the
+    # pages look at: ICU/INTUBATED only apply to hospitalized patients,
+    # PREGNANCY only to women, and deaths rise with age and hospitalization
+    age = np.clip(rng.normal(42, 18, rows), 0, 110).astype(np.int16)
+    sex = rng.choice([dictionary_code("SEX", "FEMALE"), dictionary_code("SEX", "MALE")], rows)
+    does_not_apply = dictionary_code("ICU", "DOES NOT APPLY")
+
+    hospitalized = rng.random(rows) < 0.05 + age / 250
+    icu = np.where(hospitalized, _answers(rng, "ICU", 0.1, rows), does_not_apply)
+    intubated = np.where(hospitalized, _answers(rng, "INTUBATED", 0.12, rows), does_not_apply)
+    pregnancy = np.where(
+        sex == dictionary_code("SEX", "FEMALE"), _answers(rng, "PREGNANCY", 0.01, rows), does_not_apply
+    )
+    # POSITIVE, NEGATIVE and PENDING as the data dictionary codes them
+    outcome = rng.choice([1, 2, 3], rows, p=[0.4, 0.5, 0.1])
+    deceased = rng.random(rows) < 0.002 + 0.15 * hospitalized + (age > 60) * 0.03
+
+    # Dates are looked up in one table of day strings rather than formatted per row
+    days = pd.date_range(FIRST_ADMISSION - pd.Timedelta(days=14), periods=ADMISSION_DAYS + 60)
+    day_text = np.asarray(days.strftime(DATE_FORMAT), dtype=object)
+    admission = rng.integers(14, 14 + ADMISSION_DAYS, rows)
+    death = np.where(deceased, day_text[admission + rng.integers(1, 30, rows)], "")
+
+    location = rng.integers(1, 33, rows)
+    df = pd.DataFrame({
+        "ORIGIN": rng.choice(["USMER", "OUTSIDE USMER"], rows, p=[0.4, 0.6]),
+        "SECTOR": rng.choice(
+            ["SSA", "IMSS", "ISSSTE", "STATE", "PRIVATE"], rows, p=[0.6, 0.25, 0.05, 0.05, 0.05]
+        ),
+        "TREATMENT_LOCATION": location,
+        "SEX": sex,
+        "BIRTHPLACE_LOCATION": np.where(rng.random(rows) < 0.8, location, rng.integers(1, 33, rows)),
+        "PATIENT_LOCATION": location,
+        "MUNICIPALITY": rng.integers(1, 200, rows),
+        "HOSPITALIZED": np.where(
+            hospitalized, dictionary_code("HOSPITALIZED", "YES"), dictionary_code("HOSPITALIZED", "NO")
+        ),
+        "ADMISSION DATE": day_text[admission],
+        "DATE_OF_FIRST_SYMPTOM": day_text[admission - rng.integers(0, 14, rows)],
+        "DATE_OF_DEATH": death,
+        "INTUBATED": intubated,
+        "AGE": age,
+        "NATIONALITY": rng.choice(
+            [dictionary_code("NATIONALITY", "MEXICAN"), dictionary_code("NATIONALITY", "FOREIGN"), 99],
+            rows,
+            p=[0.98, 0.015, 0.005],
+        ),
+        "PREGNANCY": pregnancy,
+        "OUTCOME": outcome,
+        "COUNTRY OF ORIGIN": np.where(rng.random(rows) < 0.99, "99", "Estados Unidos de América"),
+        "ICU": icu,
+    })
+    for column, yes in PREVALENCE.items():
+        df[column] = _answers(rng, column, yes, rows)
+    return df[COLUMNS]
+
+
+def write_dataset(path, rows, seed=0, chunk_rows=CHUNK_ROWS):
+    # Same seed, same file. Written beside `path` and moved into place, so a
+    # running app never sees a half-written dataset as appended rows
+    rng = np.random.default_rng(seed)
+    partial = path + ".partial"
+    with open(partial, "w", newline="") as f:
+        for start in range(0, max(rows, 1), chunk_rows):
+            chunk = synthetic_rows(rng, min(chunk_rows, rows - start))
+            chunk.to_csv(f, index=False, header=start == 0)
+    os.replace(partial, path)
+
+
+def parse_size(text):
+    return SIZES.get(text.lower()) or int(text.replace("_", ""))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic dataset with the survey's codes.")
+    parser.add_argument("size", help="rows, e.g. 250000, or one of " + ", ".join(SIZES))
+    parser.add_argument("--out", default=None, help="output CSV (default: synthetic_<size>.csv)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rows = parse_size(args.size)
+    path = args.out or f"synthetic_{args.size.lower()}.csv"
+    started = time.perf_counter()
+    write_dataset(path, rows, args.seed)
+    print(f"{rows:,} rows written to {path} in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
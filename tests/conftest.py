@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# The modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_loader import parse_csv
+from synthetic import write_dataset
+
+# Enough patients for rare filter combinations and int overflows to show up
+PATIENT_ROWS = 120_000
+
+
+@pytest.fixture(scope="session")
+def patients(tmp_path_factory):
+    # Decoded synthetic patients, as the pages load them
+    path = str(tmp_path_factory.mktemp("patients") / "dataset.csv")
+    write_dataset(path, PATIENT_ROWS, seed=1)
+    return parse_csv(path, workers=1)
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from age_histogram import AGE_SCHEMES, AgeHistogram, band_labels, bin_counts
+from data_loader import DISEASE_COLUMNS, YES
+
+# Custom edges as typed on the main page: starting above 0, so younger
+# patients fall below the first band, and ending below the oldest ages
+CUSTOM = [[18, 65], [0, 1, 2], [5, 40, 41, 100], [120]]
+TERMS = [(), (("SEX", 2),), (("NATIONALITY", 1), ("HYPERTENSION", YES))]
+
+
+@pytest.fixture(scope="module")
+def ages(patients):
+    # Fractional, unknown and negative ages as well as the whole years of
+    # the synthetic data
+    df = patients.copy()
+    rng = np.random.default_rng(2)
+    age = df["AGE"].to_numpy(dtype=float, copy=True)
+    age[rng.random(len(df)) < 0.05] += 0.5
+    age[rng.random(len(df)) < 0.01] = np.nan
+    age[rng.random(len(df)) < 0.001] = -1
+    df["AGE"] = age
+    return df
+
+
+def expected_counts(age, edges):
+    # Bands closed on the left, from age 0 up and open above the last edge
+    bins = ([0] if edges[0] > 0 else []) + list(edges) + [np.inf]
+    labels = band_labels(edges)
+    return pd.cut(age, bins, right=False, labels=labels).value_counts().reindex(labels).to_numpy()
+
+
+@pytest.mark.parametrize("edges", list(AGE_SCHEMES.values()) + CUSTOM)
+def test_bands_match_pd_cut(ages, edges):
+    histogram = AgeHistogram(ages, DISEASE_COLUMNS)
+    for terms in TERMS:
+        mask = np.ones(len(ages), dtype=bool)
+        for column, code in terms:
+            mask &= ages[column].to_numpy() == code
+        counts = bin_counts(histogram.cumulative(histogram.select(terms)), edges)
+        assert list(counts.index) == band_labels(edges)
+        np.testing.assert_array_equal(counts.to_numpy(), expected_counts(ages.loc[mask, "AGE"], edges))
@@ -0,0 +1,51 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from comorbidity import COMBINATION_SIZES, combination_table, superset_counts, top_combinations
+from count_cube import CountCube
+from data_loader import DISEASE_COLUMNS, YES
+
+TERMS = [(), (("SEX", 1),), (("NATIONALITY", 1), ("OBESITY", YES))]
+
+
+def test_superset_counts_brute_force():
+    rng = np.random.default_rng(8)
+    width = 7
+    masks = rng.integers(0, 1 << width, 5000)
+    weights = rng.integers(1, 50, 5000).astype(float)
+    totals = superset_counts(masks, weights, width)
+    for m in range(1 << width):
+        assert totals[m] == weights[(masks & m) == m].sum()
+
+
+@pytest.mark.parametrize("terms", TERMS)
+def test_combinations_match_pandas_count(patients, terms):
+    cube = CountCube(patients, DISEASE_COLUMNS)
+    table = combination_table(cube.select(terms), DISEASE_COLUMNS).set_index("COMBINATION")
+
+    rows = patients
+    for column, code in terms:
+        rows = rows[rows[column] == code]
+    diseased = {disease: (rows[disease] == YES).to_numpy() for disease in DISEASE_COLUMNS}
+    deceased = rows["DATE_OF_DEATH"].notna().to_numpy()
+    expected = 0
+    for size in COMBINATION_SIZES:
+        for combination in itertools.combinations(DISEASE_COLUMNS, size):
+            having = np.logical_and.reduce([diseased[disease] for disease in combination])
+            row = table.loc[" + ".join(combination)]
+            assert row["DISEASES"] == size
+            assert row["CASES"] == having.sum()
+            assert row["DEATHS"] == (having & deceased).sum()
+            if having.any():
+                assert row["CASE_FATALITY"] == pytest.approx((having & deceased).sum() / having.sum())
+            else:
+                assert np.isnan(row["CASE_FATALITY"])
+            expected += 1
+    assert len(table) == expected
+
+    # Ranking keeps only combinations with enough patients, ties by cases
+    top = top_combinations(table.reset_index(), 10, "CASE_FATALITY", min_cases=30)
+    assert (top["CASES"] >= 30).all()
+    assert list(top["CASE_FATALITY"]) == sorted(top["CASE_FATALITY"], reverse=True)
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from correlation import CorrelationStats, correlation_features
+from data_loader import MISSING_CODE, NO, YES
+from reports import analyses
+
+
+def coded_frame(rows, seed=0):
+    # YES/NO answers with a few missing, as the code columns hold them
+    rng = np.random.default_rng(seed)
+    codes = np.array([YES, NO, MISSING_CODE], dtype=np.int8)
+    return pd.DataFrame({
+        feature: rng.choice(codes, rows, p=[0.3, 0.65, 0.05]) for feature in correlation_features()
+    })
+
+
+def expected_correlation(df):
+    return df.replace({NO: 0, MISSING_CODE: np.nan}).astype(float).corr()
+
+
+def test_matrix_matches_dataframe_corr_at_realistic_size():
+    # Past a few hundred thousand rows the pair products no longer fit int64
+    df = coded_frame(300_000)
+    features = correlation_features()
+    matrix = CorrelationStats(df).matrix(features)
+    pd.testing.assert_frame_equal(matrix, expected_correlation(df), check_exact=False, atol=1e-12)
+    assert (np.diag(matrix.to_numpy()) == 1).all()
+
+
+def test_extend_matches_one_pass():
+    df = coded_frame(50_000, seed=1)
+    stats = CorrelationStats(df.iloc[:20_000])
+    stats.extend(df.iloc[20_000:])
+    features = ["DIABETES", "ICU", "OBESITY"]
+    pd.testing.assert_frame_equal(
+        stats.matrix(features), expected_correlation(df)[features].loc[features], check_exact=False, atol=1e-12
+    )
+
+
+def test_report_diagonal_is_one(patients):
+    # The cohorts reports.py writes: every feature answered both YES and NO
+    # in a cohort correlates with itself exactly
+    for sex in (1, 2):
+        rows = patients[patients["SEX"] == sex]
+        table = analyses(rows)["icu_correlation"]
+        diagonal = table[table["FEATURE_1"] == table["FEATURE_2"]].set_index("FEATURE_1")["CORRELATION"]
+        answered = [feature for feature in diagonal.index if {YES, NO} <= set(rows[feature].unique())]
+        assert answered
+        assert (diagonal[answered] == 1).all()
@@ -0,0 +1,51 @@
+import itertools
+
+import pandas as pd
+import pytest
+
+from count_cube import CountCube
+from data_loader import DISEASE_COLUMNS, YES, dictionary_codes
+from filter_index import filter_terms
+
+# Every sidebar choice of sex and nationality, with disease selections from
+# none to several at once
+SEXES = ["All"] + dictionary_codes("SEX")
+NATIONALITIES = ["All"] + dictionary_codes("NATIONALITY")
+DISEASES = [(), ("DIABETES",), ("HYPERTENSION", "OBESITY"), ("DIABETES", "HYPERTENSION", "OBESITY", "TOBACCO")]
+# Columns whose value counts the pages show
+COUNTED = ["SEX", "NATIONALITY", "OUTCOME", "ICU", "INTUBATED"]
+
+
+@pytest.fixture(scope="module")
+def cube(patients):
+    return CountCube(patients, DISEASE_COLUMNS)
+
+
+def matching(df, terms):
+    mask = pd.Series(True, index=df.index)
+    for column, code in terms:
+        mask &= df[column] == code
+    return df[mask]
+
+
+@pytest.mark.parametrize("sex, nationality", list(itertools.product(SEXES, NATIONALITIES)))
+def test_matches_pandas_groupby(patients, cube, sex, nationality):
+    for diseases in DISEASES:
+        terms = filter_terms(sex, nationality, diseases)
+        rows = matching(patients, terms)
+        cells = cube.select(terms)
+
+        assert cube.total(cells) == len(rows)
+        for column in COUNTED:
+            expected = rows.groupby(column).size()
+            pd.testing.assert_series_equal(
+                cube.counts(cells, column).sort_index(), expected[expected > 0].sort_index(), check_names=False
+            )
+            for code in expected.index:
+                assert cube.count(cells, column, code) == expected[code]
+        deceased = rows["DATE_OF_DEATH"].notna()
+        assert cube.count(cells, "DECEASED", True) == deceased.sum()
+        assert cube.disease_counts(cells) == {disease: (rows[disease] == YES).sum() for disease in DISEASE_COLUMNS}
+        assert cube.disease_counts(cells, deceased=True) == {
+            disease: (rows.loc[deceased, disease] == YES).sum() for disease in DISEASE_COLUMNS
+        }
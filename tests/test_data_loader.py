@@ -0,0 +1,58 @@
+import os
+
+import pandas as pd
+import pytest
+
+from data_loader import _data_start, parse_csv, parse_csv_parallel, split_ranges
+from synthetic import write_dataset
+
+ROWS = 5000
+
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("data") / "dataset.csv")
+    write_dataset(path, ROWS, seed=7)
+    return path
+
+
+def test_parallel_matches_serial(dataset):
+    serial = parse_csv(dataset, workers=1)
+    assert len(serial) == ROWS
+    pd.testing.assert_frame_equal(parse_csv_parallel(dataset, 3), serial)
+
+
+def test_parallel_matches_serial_projected(dataset):
+    columns = ["SEX", "AGE", "ORIGIN", "ADMISSION DATE", "DIABETES"]
+    serial = parse_csv(dataset, workers=1, columns=columns)
+    assert set(serial.columns) == set(columns)
+    pd.testing.assert_frame_equal(parse_csv_parallel(dataset, 3, columns=columns), serial)
+
+
+def test_split_lands_mid_line(dataset):
+    # The equal shares of the file end inside rows; each range is moved on
+    # to the next line start, so no row is lost, cut or read twice
+    size = os.path.getsize(dataset)
+    start = _data_start(dataset)
+    with open(dataset, "rb") as f:
+        data = f.read()
+    shares = [start + (size - start) * i // 3 for i in range(1, 3)]
+    assert any(data[share - 1 : share] != b"\n" for share in shares)
+
+    ranges = split_ranges(dataset, 3)
+    assert len(ranges) == 3
+    assert ranges[0][0] == start and ranges[-1][1] == size
+    for (_, end), (next_start, _) in zip(ranges, ranges[1:]):
+        assert end == next_start and data[next_start - 1 : next_start] == b"\n"
+    pd.testing.assert_frame_equal(parse_csv_parallel(dataset, 3), parse_csv(dataset, workers=1))
+
+
+def test_parallel_matches_serial_up_to_end(dataset):
+    # Only the rows in the first `end` bytes, as when rows were appended
+    # after the snapshot was taken; `end` is a line end
+    with open(dataset, "rb") as f:
+        data = f.read()
+    end = data.index(b"\n", len(data) // 2) + 1
+    serial = parse_csv(dataset, workers=1, end=end)
+    assert 0 < len(serial) < ROWS
+    pd.testing.assert_frame_equal(parse_csv_parallel(dataset, 3, end=end), serial)
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+from age_histogram import KEYS as AGE_KEYS
+from age_histogram import AgeHistogram
+from correlation import CorrelationStats
+from count_cube import DIMENSIONS, CountCube
+from data_loader import DISEASE_COLUMNS, YES, parse_csv
+from dataset import Dataset
+from filter_index import FilterIndex
+from synthetic import synthetic_rows, write_dataset
+from timeseries import DailyCounts
+
+# Neither count is a multiple of 8, so the appended bits start mid-byte
+ROWS = 100_003
+APPENDED = 1_005
+TERMS = [(), (("SEX", 1),), (("NATIONALITY", 2), ("DIABETES", YES)), (("OBESITY", YES), ("ICU", YES))]
+FACTORIES = {
+    "filter_index": lambda df, _: FilterIndex(df),
+    "count_cube": CountCube,
+    "age_histogram": AgeHistogram,
+    "daily_counts": DailyCounts,
+    "correlation": CorrelationStats,
+}
+
+
+def cells(aggregate, keys):
+    return aggregate.cells.groupby(keys)["COUNT"].sum().sort_index()
+
+
+def assert_same(aggregates, df):
+    # Each aggregate against the same one built from the rows in one pass
+    index = FilterIndex(df)
+    for terms in TERMS:
+        expected = index.select(terms)
+        assert aggregates["filter_index"].count(aggregates["filter_index"].select(terms)) == index.count(expected)
+        np.testing.assert_array_equal(aggregates["filter_index"].select(terms), expected)
+    pd.testing.assert_series_equal(
+        cells(aggregates["count_cube"], DIMENSIONS), cells(CountCube(df, DISEASE_COLUMNS), DIMENSIONS)
+    )
+    pd.testing.assert_series_equal(
+        cells(aggregates["age_histogram"], AGE_KEYS), cells(AgeHistogram(df, DISEASE_COLUMNS), AGE_KEYS)
+    )
+    daily = DailyCounts(df, DISEASE_COLUMNS)
+    pd.testing.assert_frame_equal(aggregates["daily_counts"].table("SEX"), daily.table("SEX"))
+    np.testing.assert_array_equal(aggregates["correlation"].n, CorrelationStats(df, DISEASE_COLUMNS).n)
+
+
+def test_refresh_swaps_in_extended_aggregates(tmp_path):
+    path = str(tmp_path / "dataset.csv")
+    write_dataset(path, ROWS, seed=3)
+    dataset = Dataset(path)
+    dataset.require(None)
+    before = {name: dataset.derived(name, factory) for name, factory in FACTORIES.items()}
+    assert_same(before, parse_csv(path, workers=1))
+
+    with open(path, "a", newline="") as f:
+        synthetic_rows(np.random.default_rng(4), APPENDED).to_csv(f, index=False, header=False)
+    assert dataset.refresh() == APPENDED
+    assert dataset.rows == ROWS + APPENDED
+
+    # The refreshed aggregates are new objects matching a fresh load ...
+    after = {name: dataset.derived(name, factory) for name, factory in FACTORIES.items()}
+    assert all(after[name] is not before[name] for name in FACTORIES)
+    assert_same(after, parse_csv(path, workers=1))
+    # ... while the ones sessions were handed before still hold the old rows
+    assert_same(before, parse_csv(path, workers=1).iloc[:ROWS])
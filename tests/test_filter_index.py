@@ -0,0 +1,72 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_loader import YES, dictionary_codes
+from filter_index import FilterIndex, filter_terms
+
+SEXES = ["All"] + dictionary_codes("SEX")
+NATIONALITIES = ["All"] + dictionary_codes("NATIONALITY")
+DISEASES = [(), ("PNEUMONIA",), ("DIABETES", "HYPERTENSION"), ("OBESITY", "TOBACCO", "ASTHMA")]
+SELECTIONS = [
+    filter_terms(sex, nationality, diseases)
+    for sex, nationality, diseases in itertools.product(SEXES, NATIONALITIES, DISEASES)
+]
+# Row counts at which the index is extended; none a multiple of 8
+SPLITS = [1, 13, 5_003, 77_777, 100_001]
+
+
+def mask(df, terms):
+    selected = np.ones(len(df), dtype=bool)
+    for column, code in terms:
+        selected &= df[column].to_numpy() == code
+    return selected
+
+
+def assert_matches(index, df):
+    for terms in SELECTIONS:
+        selected = mask(df, terms)
+        selection = index.select(terms)
+        assert index.count(selection) == selected.sum()
+        np.testing.assert_array_equal(index.positions(selection), np.flatnonzero(selected))
+        assert index.count(selection, ("ICU", YES)) == (selected & (df["ICU"] == YES).to_numpy()).sum()
+        assert index.take(df, selection).equals(df[selected])
+
+
+def test_matches_pandas_masks(patients):
+    assert_matches(FilterIndex(patients), patients)
+
+
+def test_extend_mid_byte_matches_one_pass(patients):
+    # Each extension starts inside a byte and a 64-bit word of the bitsets
+    bounds = [0] + SPLITS + [len(patients)]
+    index = FilterIndex(patients.iloc[: bounds[1]])
+    for start, end in zip(bounds[1:], bounds[2:]):
+        index.extend(patients.iloc[start:end])
+        assert index.rows == end
+        assert_matches(index, patients.iloc[:end])
+    whole = FilterIndex(patients)
+    for key, bitset in whole.bitsets.items():
+        np.testing.assert_array_equal(index.bitsets[key], bitset)
+
+
+@pytest.mark.parametrize(
+    "sort_by, ascending", [(None, True), ("AGE", True), ("ORIGIN", False), ("ADMISSION DATE", True)]
+)
+def test_pages_match_sorted_frame(patients, sort_by, ascending):
+    index = FilterIndex(patients)
+    columns = ["SEX", "AGE", "ORIGIN"]
+    for terms in SELECTIONS[::7]:
+        rows = patients[mask(patients, terms)]
+        if sort_by is not None:
+            # Categories sort by their text, as in the table's column header
+            values = rows[sort_by].reset_index(drop=True)
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype(object)
+            rows = rows.iloc[values.sort_values(ascending=ascending, kind="stable").index]
+        selection = index.select(terms)
+        for start in (0, 50, max(len(rows) - 20, 0)):
+            page = index.page(patients, selection, start, 50, sort_by, ascending, columns)
+            pd.testing.assert_frame_equal(page, rows.iloc[start : start + 50][columns])
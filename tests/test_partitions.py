@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import partitions
+from age_histogram import KEYS, AgeHistogram
+from count_cube import DIMENSIONS, CountCube
+from data_loader import DATE_FORMAT, DISEASE_COLUMNS, parse_csv
+from dataset import load_in_range, load_rows_in_range
+from synthetic import synthetic_rows
+
+ROWS = 120_000
+# Rows from here on name countries and leave ages blank that the rows
+# before never did, so the months they fall in outgrow their first chunk
+CHANGE = 60_000
+NEW_COUNTRIES = 300
+# (start, end) admission ranges, inclusive; the synthetic admissions run
+# from 2020-01-01 to 2021-12-30
+RANGES = [
+    ("2020-03-10", "2020-05-20"),  # cuts two months and covers the one between
+    ("2020-06-01", "2020-06-30"),  # exactly one month
+    ("2021-02-14", "2021-02-14"),  # a single day
+    ("2020-12-15", "2021-12-31"),  # across the change to the new categories
+    ("2030-01-01", "2030-12-31"),  # no admissions
+]
+COLUMNS = ["SEX", "AGE", "COUNTRY OF ORIGIN", "DATE_OF_DEATH", "DIABETES"]
+
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory):
+    # Sorted by admission, so each month's rows arrive over several chunks
+    rows = synthetic_rows(np.random.default_rng(11), ROWS)
+    rows = rows.iloc[np.argsort(pd.to_datetime(rows["ADMISSION DATE"], format=DATE_FORMAT), kind="stable")]
+    rows = rows.reset_index(drop=True)
+    later = rows.index >= CHANGE
+    rows["COUNTRY OF ORIGIN"] = rows["COUNTRY OF ORIGIN"].where(
+        ~later, [f"COUNTRY {i % NEW_COUNTRIES}" for i in range(ROWS)]
+    )
+    rows["AGE"] = rows["AGE"].astype(object).where(~later | (rows.index % 50 != 0), "")
+    path = str(tmp_path_factory.mktemp("data") / "dataset.csv")
+    rows.to_csv(path, index=False)
+    return path
+
+
+def comparable(df):
+    # Stored partitions hold categories as codes and whole numbers as floats
+    return pd.DataFrame({
+        column: values.astype(object) if isinstance(values.dtype, pd.CategoricalDtype) else values
+        for column, values in df.reset_index(drop=True).items()
+    })
+
+
+def test_later_months_add_categories_and_blank_ages(dataset):
+    # Chunks of 1000 rows: the month holding row CHANGE gets its new
+    # categories and blank ages appended after its first chunk was written
+    manifest = partitions.build_partitions(dataset, memory_limit=1)
+    assert manifest is not None
+    assert sum(entry["rows"] for entry in manifest["partitions"].values()) == ROWS
+
+    expected = parse_csv(dataset, workers=1)
+    assert expected["COUNTRY OF ORIGIN"].nunique() > NEW_COUNTRIES
+    assert expected["AGE"].isna().any()
+    span = partitions.admission_span(manifest)
+    stored = partitions.rows_in_range(dataset, manifest, span[0].isoformat(), span[1].isoformat())
+    pd.testing.assert_frame_equal(comparable(stored), comparable(expected), check_dtype=False)
+
+
+def test_month_rebuilt_when_rows_do_not_fit(tmp_path):
+    # A column read as numbers first and as text later cannot be appended
+    # to; only its month is rewritten, the others keep their files
+    dates = pd.to_datetime(["2020-01-05", "2020-01-20", "2020-02-03"])
+    first = pd.DataFrame({partitions.DATE_COLUMN: dates, "CODE": [1.5, 2.5, 3.5]})
+    later = pd.DataFrame({partitions.DATE_COLUMN: dates[:1], "CODE": ["A1"]})
+    manifest = {"partitions": {}}
+    partitions._add_rows(str(tmp_path), manifest, first)
+    february = manifest["partitions"]["2020-02"]
+    partitions._add_rows(str(tmp_path), manifest, later)
+
+    assert manifest["partitions"]["2020-02"] is february
+    january = manifest["partitions"]["2020-01"]
+    assert january["rows"] == 3
+    rows = partitions.data_loader.read_columns(str(tmp_path / "2020-01"), january["columns"], january["rows"])
+    assert rows["CODE"].astype(object).tolist() == [1.5, 2.5, "A1"]
+
+
+def admitted(df, start, end):
+    dates = df[partitions.DATE_COLUMN]
+    return df[(dates >= pd.Timestamp(start)) & (dates <= pd.Timestamp(end))]
+
+
+def sorted_cells(cells, keys):
+    return cells[cells["COUNT"] > 0].sort_values(keys).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("start, end", RANGES)
+def test_ranges_match_pandas_date_filter(dataset, start, end):
+    expected = admitted(parse_csv(dataset, workers=1), start, end)
+
+    rows = load_rows_in_range((start, end), COLUMNS, path=dataset)
+    pd.testing.assert_frame_equal(comparable(rows), comparable(expected[COLUMNS]), check_dtype=False)
+
+    cube = load_in_range("count_cube", CountCube, (start, end), path=dataset)
+    pd.testing.assert_frame_equal(
+        sorted_cells(cube.cells, DIMENSIONS),
+        sorted_cells(CountCube(expected, DISEASE_COLUMNS).cells, DIMENSIONS),
+        check_dtype=False,
+    )
+    ages = load_in_range("age_histogram", AgeHistogram, (start, end), path=dataset)
+    pd.testing.assert_frame_equal(
+        sorted_cells(ages.cells, KEYS),
+        sorted_cells(AgeHistogram(expected, DISEASE_COLUMNS).cells, KEYS),
+        check_dtype=False,
+    )
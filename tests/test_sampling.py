@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from age_histogram import AgeHistogram
+from count_cube import DIMENSIONS, CountCube
+from data_loader import DISEASE_COLUMNS, parse_csv
+from sampling import SampleCube
+from synthetic import write_dataset
+
+ROWS = 100_000
+DATES = ("2020-04-10", "2020-11-20")
+TERMS = [(), (("SEX", 1),), (("NATIONALITY", 1), ("DIABETES", 1), ("OBESITY", 1))]
+
+
+@pytest.fixture(scope="module")
+def df(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("data") / "dataset.csv")
+    write_dataset(path, ROWS, seed=5)
+    return parse_csv(path, workers=1)
+
+
+def admitted(df, dates):
+    admission = df["ADMISSION DATE"]
+    return df[(admission >= pd.Timestamp(dates[0])) & (admission <= pd.Timestamp(dates[1]))]
+
+
+def counts(cells, keys):
+    return cells[cells["COUNT"] > 0].groupby(keys)["COUNT"].sum().sort_index()
+
+
+def test_whole_strata_are_exact(df):
+    # Strata no larger than stratum_rows are kept whole, so every count,
+    # also over a date range, is the exact one
+    sample = SampleCube(df, stratum_rows=ROWS)
+    assert sample.exact
+    subset = sample.in_range(DATES)
+    expected = admitted(df, DATES)
+    for source, rows in ((sample, df), (subset, expected)):
+        cube = CountCube(rows, DISEASE_COLUMNS)
+        ages = AgeHistogram(rows, DISEASE_COLUMNS)
+        pd.testing.assert_series_equal(
+            counts(source.cells, DIMENSIONS), counts(cube.cells, DIMENSIONS), check_dtype=False
+        )
+        for terms in TERMS:
+            np.testing.assert_array_equal(
+                source.cumulative(source.select_ages(terms)), ages.cumulative(ages.select(terms))
+            )
+            cells = source.select(terms)
+            assert source.disease_counts(cells) == cube.disease_counts(cube.select(terms))
+
+
+def test_sample_is_no_larger_than_the_exact_cube(df):
+    # Ages are kept apart from the cube's cells, which would otherwise
+    # multiply by every year of age
+    sample = SampleCube(df, stratum_rows=5_000)
+    assert not sample.exact
+    assert len(sample.cells) <= len(CountCube(df, DISEASE_COLUMNS).cells)
+    assert len(sample.age_cells) <= len(AgeHistogram(df, DISEASE_COLUMNS).cells)
+    # Estimates of a range stay close to the exact counts
+    estimated = sample.in_range(DATES)
+    exact = len(admitted(df, DATES))
+    assert abs(estimated.total(estimated.cells) - exact) < 0.03 * exact
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_loader import DISEASE_COLUMNS
+from timeseries import GRANULARITIES, DailyCounts
+
+CATEGORIES = ["SEX", "OUTCOME", "ICU", "DIABETES"]
+
+
+@pytest.fixture(scope="module")
+def admissions(patients):
+    # Some patients without an admission date, and whole weeks without any
+    # admission, which the tables must show as zeros rather than skip
+    df = patients.copy()
+    dates = df["ADMISSION DATE"]
+    rng = np.random.default_rng(6)
+    df.loc[rng.random(len(df)) < 0.01, "ADMISSION DATE"] = pd.NaT
+    gaps = dates.between("2020-05-01", "2020-05-07") | dates.between("2021-03-10", "2021-03-31")
+    return df[~gaps.to_numpy()].reset_index(drop=True)
+
+
+def expected_table(df, category, freq="D", window=1):
+    known = df.dropna(subset=["ADMISSION DATE"])
+    table = known.groupby(["ADMISSION DATE", category]).size().unstack(fill_value=0)
+    days = pd.date_range(table.index.min(), table.index.max(), freq="D", name="ADMISSION DATE")
+    table = table.reindex(days, fill_value=0)
+    if freq != "D":
+        table = table.resample(freq).sum()
+    if window > 1:
+        table = table.rolling(window, min_periods=1).mean()
+    return table
+
+
+def assert_matches(counts, df):
+    for category in CATEGORIES:
+        for freq in GRANULARITIES.values():
+            for window in (1, 7):
+                pd.testing.assert_frame_equal(
+                    counts.table(category, freq, window),
+                    expected_table(df, category, freq, window),
+                    check_names=False,
+                    check_dtype=False,
+                    check_freq=False,
+                    check_column_type=False,
+                )
+
+
+def test_matches_groupby_size(admissions):
+    assert_matches(DailyCounts(admissions, DISEASE_COLUMNS), admissions)
+    daily = DailyCounts(admissions, DISEASE_COLUMNS).table("SEX").sum(axis=1)
+    expected = admissions.groupby("ADMISSION DATE").size()
+    pd.testing.assert_series_equal(daily[daily > 0], expected, check_names=False, check_freq=False)
+
+
+def test_extend_matches_one_pass(admissions):
+    # Middle dates first, then later ones and then earlier ones, so the day
+    # axis grows at both ends
+    dates = admissions["ADMISSION DATE"]
+    middle = dates.between("2020-09-01", "2021-02-28")
+    later = dates > "2021-02-28"
+    counts = DailyCounts(admissions[middle], DISEASE_COLUMNS)
+    counts.extend(admissions[later])
+    counts.extend(admissions[~(middle | later)])
+    np.testing.assert_array_equal(counts.cube, DailyCounts(admissions, DISEASE_COLUMNS).cube)
+    assert_matches(counts, admissions)
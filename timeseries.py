@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+from data_loader import DISEASE_COLUMNS
+
+TIME_SERIES_CATEGORIES = ["PNEUMONIA", "SEX", "HOSPITALIZED", "INTUBATED", "ICU", "OUTCOME"]
+
+# Page granularities as pandas offset aliases
+GRANULARITIES = {"Daily": "D", "Weekly": "W", "Monthly": "MS"}
+
+# Codes are int8, so code + 1 is a slot in 0..128 with MISSING_CODE in slot 0
+_CODES = 129
+# Rows binned at a time; bounds the temporary key array
+BLOCK_ROWS = 1 << 18
+
+
+def time_series_categories(disease_columns=DISEASE_COLUMNS, categories=TIME_SERIES_CATEGORIES):
+    return list(dict.fromkeys(list(categories) + list(disease_columns)))
+
+
+def day_numbers(dates):
+    # datetime64 values -> days since 1970-01-01, plus the mask of known dates
+    dates = np.asarray(dates, dtype="datetime64[ns]")
+    known = ~np.isnat(dates)
+    return dates[known].astype("datetime64[D]").astype(np.int64), known
+
+
+class DailyCounts:
+    # Admissions per day for every code of every category, held as one
+    # (day, category, code slot) count array starting at first_day
+
+    def __init__(self, df, disease_columns=DISEASE_COLUMNS, categories=TIME_SERIES_CATEGORIES):
+        self.categories = time_series_categories(disease_columns, categories)
+        self.first_day = 0
+        self.cube = np.zeros((0, len(self.categories), _CODES), dtype=np.int64)
+        self._tables = {}
+        self.extend(df)
+
+    def _cover(self, first, last):
+        # Grow the day axis so it spans [first, last]
+        if not len(self.cube):
+            self.first_day = first
+        start = min(first, self.first_day)
+        end = max(last + 1, self.first_day + len(self.cube))
+        before = self.first_day - start
+        after = end - self.first_day - len(self.cube)
+        if before or after:
+            self.cube = np.pad(self.cube, ((before, after), (0, 0), (0, 0)))
+            self.first_day = start
+
+    def extend(self, df):
+        # One bincount per block counts every category at once: each
+        # (row, category) pair maps to the flat slot (day, category, code)
+        days, known = day_numbers(df["ADMISSION DATE"].to_numpy())
+        if len(days):
+            self._cover(int(days.min()), int(days.max()))
+            missing = np.full(len(df), -1, dtype=np.int8)
+            codes = np.column_stack([
+                df[category].to_numpy() if category in df.columns else missing
+                for category in self.categories
+            ])[known]
+            k = len(self.categories)
+            slots = np.arange(k) * _CODES + 1
+            cube = self.cube.copy()
+            for start in range(0, len(days), BLOCK_ROWS):
+                block = slice(start, start + BLOCK_ROWS)
+                keys = ((days[block] - self.first_day) * (k * _CODES))[:, None] + slots + codes[block]
+                cube += np.bincount(keys.ravel(), minlength=cube.size).reshape(cube.shape)
+            self.cube = cube
+        self._tables = {}
+
+    def table(self, category, freq="D", window=1):
+        # Admissions per period indexed by ADMISSION DATE, one column per code
+        # seen; window > 1 turns the counts into a trailing rolling mean
+        key = (category, freq, window)
+        if key not in self._tables:
+            counts = self.cube[:, self.categories.index(category), :]
+            present = np.flatnonzero(counts.sum(axis=0))
+            index = pd.date_range(
+                pd.Timestamp(self.first_day, unit="D"), periods=len(counts), freq="D", name="ADMISSION DATE"
+            )
+            table = pd.DataFrame(counts[:, present], index=index, columns=present - 1)
+            if freq != "D":
+                table = table.resample(freq).sum()
+            if window > 1:
+                table = table.rolling(window, min_periods=1).mean()
+            self._tables[key] = table
+        return self._tables[key]